@@ -1,14 +1,35 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-import joblib
 import numpy as np
-import requests
 import os
 from dotenv import load_dotenv
 import datetime
-import sqlite3
+import json
 import random
 import uuid
+import threading
+
+import db
+from broadcast import Broadcaster
+from chat import CHAT_BACKEND, ChatBusy, ChatService, ChatTimeout, make_upstream
+from ensemble import Ensemble
+from explain import ExplanationCache
+from fanout import load_districts
+from feature_engineering import FEATURES, FeatureHistory, PipelineModel, rolling_features
+from http_client import upstream_stats
+from heatmap_grid import HeatmapError, parse_grid_args, precompute, risk_grid, tile_cache
+from model_registry import ModelRegistry
+from response_cache import response_cache
+from risk_engine import RAW_FEATURES, predict_risk_batch, weather_matrix
+from rollups import nearest_district, priority_zones, roi_stats
+from scheduler import FORECAST_WAIT, TREND_THRESHOLD, ForecastScheduler
+from task_catalog import Task, load_catalog
+from tree_inference import FLAT_INFERENCE, compile_model
+from verification import VERIFY_MAX_BYTES, VERIFY_MAX_WAIT, VERIFY_WAIT, UploadError, VerificationQueue
+from weather import OPENWEATHER_API_KEY, get_real_weather, get_forecast_weather, weather_cache
+from weather_cache import grid_cell
+from weather_history import WeatherHistory
+from write_behind import TASK_WRITE_BEHIND, WriteBehindFull, WriteBehindTaskStore
 
 # --------------------
 # App Setup
@@ -18,126 +39,92 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# --------------------
-# Model Loading
-# --------------------
-try:
-    model = joblib.load("dengue_model.pkl")
-    USE_ML = True
-    print("Loaded ML model")
-except:
-    USE_ML = False
-    print("Using rule-based prediction")
+# Photo verification worker processes (verification.py), forked here before
+# any background thread starts
+verification = VerificationQueue()
 
-OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
-
-# --------------------
-# Weather Helpers
 # --------------------
-def get_real_weather(lat, lon):
-    if not OPENWEATHER_API_KEY:
-        return None
-    try:
-        url = (
-            f"https://api.openweathermap.org/data/2.5/weather"
-            f"?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
-        )
-        r = requests.get(url, timeout=5)
-        if r.status_code == 200:
-            d = r.json()
-            return {
-                "temp": d["main"]["temp"],
-                "humidity": d["main"]["humidity"],
-                "rainfall": d.get("rain", {}).get("1h", 0) * 24,
-                "salinity": 0.5,
-            }
-    except Exception as e:
-        print("Weather error:", e)
-    return None
-
-def get_forecast_weather(lat, lon, days_ahead=2):
-    if not OPENWEATHER_API_KEY:
-        return None
-    try:
-        url = (
-            f"https://api.openweathermap.org/data/2.5/forecast"
-            f"?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
-        )
-        r = requests.get(url, timeout=5)
-        if r.status_code != 200:
-            return None
-
-        data = r.json()
-        target_date = (datetime.datetime.now() + datetime.timedelta(days=days_ahead)).date()
-
-        items = []
-        for item in data["list"]:
-            if datetime.datetime.fromtimestamp(item["dt"]).date() == target_date:
-                items.append(item)
-
-        if not items:
-            items = [data["list"][-1]]
-
-        return {
-            "temp": np.mean([x["main"]["temp"] for x in items]),
-            "humidity": np.mean([x["main"]["humidity"] for x in items]),
-            "rainfall": sum([x.get("rain", {}).get("3h", 0) for x in items]) * 4,
-            "salinity": 0.5,
-        }
-    except Exception as e:
-        print("Forecast error:", e)
-    return None
-
-# --------------------
-# Risk Prediction Logic (CENTRALIZED)
+# Model Loading
 # --------------------
-def rule_based_predict(temp, rainfall, humidity, salinity):
-    risk = 0
-
-    if 25 <= temp <= 30:
-        risk += 35
-    elif 23 <= temp < 25 or 30 < temp <= 32:
-        risk += 20
-    else:
-        risk += 5
-
-    if rainfall > 150:
-        risk += 35
-    elif rainfall > 80:
-        risk += 20
+# Versioned artifacts (dengue_model_v<N>.pkl + .json metadata) are loaded
+# lazily on first prediction; see model_registry.py
+registry = ModelRegistry(compile=compile_model if FLAT_INFERENCE else None)
+# Rolling 14-day weather per location, for models trained on engineered features
+feature_history = FeatureHistory()
+# Daily readings per grid cell, persisted across restarts (weather_history.py)
+weather_history = WeatherHistory()
+weather_history.replay(feature_history)
+explain_cache = ExplanationCache()
+_warned_features = set()
+# version -> Ensemble or None, resolved once per activation
+_ensembles = {}
+
+def active_model():
+    """
+    (model, feature names, Ensemble or None) for the active version, or
+    (None, None, None) for rule-based.
+    """
+    info, model = registry.get()
+    if model is None:
+        return None, None, None
+    features = info.features
+    if not features and getattr(model, "n_features_in_", None) == len(RAW_FEATURES):
+        features = RAW_FEATURES
+    if features and list(features) in (RAW_FEATURES, FEATURES):
+        if info.version not in _ensembles:
+            _ensembles[info.version] = Ensemble.configured(info.metadata)
+        return model, list(features), _ensembles[info.version]
+    if info.version not in _warned_features:
+        _warned_features.add(info.version)
+        print(f"Model v{info.version} expects {features}; using rule-based prediction")
+    return None, None, None
+
+def serving_model():
+    """Active model as a scorer of raw weather rows (stateless), or None."""
+    model, features, _ = active_model()
+    if features == FEATURES:
+        return PipelineModel(model)
+    return model
+
+def predict_risks(weathers, locations=None, days_ahead=0, observed=False, explain=False):
+    """
+    Risk for each weather reading, in one batched call. With locations,
+    engineered-feature models see each location's rolling history;
+    observed=True records the readings as today's observations, otherwise
+    they are scored without being stored. explain=True also returns one
+    explanation dict per reading (see explain.py).
+    """
+    X = raw = weather_matrix(weathers)
+    day = datetime.date.today().toordinal() + days_ahead
+    engineered = None
+    if observed and locations is not None and days_ahead == 0:
+        # Persist the reading and advance the rolling windows whatever model is active
+        weather_history.ingest(locations, day, X)
+        engineered = feature_history.update(locations, day, X)
+
+    model, features, ensemble = active_model()
+    if features == FEATURES or ensemble is not None:
+        if engineered is None:
+            if locations is None:
+                engineered = rolling_features(X, groups=np.arange(len(X)))
+            else:
+                engineered = feature_history.peek(locations, day, X)
+        if features == FEATURES:
+            X = engineered
+    if ensemble is not None and len(X):
+        # ML, rule and trend scores blended in one pass (ensemble.py)
+        risks = ensemble.score(model.predict(X), raw, engineered)
     else:
-        risk += 5
+        risks = predict_risk_batch(X, model)
+    if not explain:
+        return risks
+    version = registry.active_version if model is not None else "rules"
+    return risks, explain_cache.explain(version, raw, model, X if model is not None else None, features,
+                                        ensemble if model is not None else None, engineered)
 
-    if humidity > 75:
-        risk += 25
-    elif humidity > 65:
-        risk += 15
-    else:
-        risk += 5
-
-    if salinity > 2:
-        risk -= 10
-
-    return min(95, max(10, risk + np.random.randint(-3, 3)))
-
-def predict_risk(weather):
-    if USE_ML:
-        features = np.array([[
-            weather["temp"],
-            weather["rainfall"],
-            weather["humidity"],
-            weather["salinity"]
-        ]])
-        return int(model.predict(features)[0])
-    else:
-        return int(
-            rule_based_predict(
-                weather["temp"],
-                weather["rainfall"],
-                weather["humidity"],
-                weather["salinity"]
-            )
-        )
+def predict_risk(weather, location=None, days_ahead=0, observed=False):
+    locations = None if location is None else [location]
+    return int(predict_risks([weather], locations, days_ahead, observed)[0])
 
 # --------------------
 # Citizen APIs
@@ -147,14 +134,18 @@ def get_risk():
     lat = float(request.args.get("lat", 10.03))
     lon = float(request.args.get("lon", 105.78))
 
-    weather = get_real_weather(lat, lon) or {
+    observed = get_real_weather(lat, lon)
+    weather = observed or {
         "temp": np.random.uniform(27, 31),
         "rainfall": np.random.uniform(100, 250),
         "humidity": np.random.uniform(75, 88),
         "salinity": 0.5,
     }
 
-    risk_pct = predict_risk(weather)
+    risks, explanations = predict_risks(
+        [weather], [grid_cell(lat, lon)], observed=observed is not None, explain=True
+    )
+    risk_pct = int(risks[0])
 
     if risk_pct >= 75:
         level, color = "HIGH", "#FF5733"
@@ -174,6 +165,7 @@ def get_risk():
         },
         "last_update": "Just now" if OPENWEATHER_API_KEY else "Simulated",
         "color": color,
+        "explanation": explanations[0],
     })
 
 @app.route("/api/forecast")
@@ -189,7 +181,7 @@ def forecast():
         "salinity": 0.5,
     }
 
-    risk_pct = predict_risk(weather)
+    risk_pct = predict_risk(weather, grid_cell(lat, lon), days_ahead=days)
 
     if risk_pct >= 75:
         level, color = "HIGH", "#FF5733"
@@ -214,102 +206,118 @@ def forecast():
 
 @app.route("/api/heatmap")
 def heatmap():
-    offset = int(request.args.get("date_offset", 0))
-    np.random.seed(42 + offset)
+    # Model risk on a lat/lon grid; bbox, resolution and date_offset come from the query
+    try:
+        bbox, resolution, offset = parse_grid_args(request.args)
+    except HeatmapError as e:
+        return jsonify({"error": str(e)}), 400
 
-    zones = []
-    base_lat, base_lon = 10.03, 105.78
+    lats, lons, risk = risk_grid(bbox, resolution, offset, serving_model())
 
-    for la in np.arange(-5, 5, 0.2):
-        for lo in np.arange(-3, 3, 0.2):
-            risk = np.random.randint(20, 95)
-            zones.append({
-                "lat": round(base_lat + la + np.random.random() * 0.02, 3),
-                "lon": round(base_lon + lo + np.random.random() * 0.02, 3),
-                "risk": risk,
-            })
+    if request.args.get("format") == "grid":
+        # Compact form for large grids: risk[i][j] is the risk at (lats[i], lons[j])
+        return jsonify({
+            "lats": lats.tolist(),
+            "lons": lons.tolist(),
+            "risk": risk.tolist(),
+            "resolution": resolution,
+        })
 
+    LA, LO = np.meshgrid(lats, lons, indexing="ij")
+    zones = [
+        {"lat": la, "lon": lo, "risk": r}
+        for la, lo, r in zip(LA.ravel().tolist(), LO.ravel().tolist(), risk.ravel().tolist())
+    ]
     return jsonify({"zones": zones})
 
+# Warm the default heatmap view so the first requests hit the tile cache
+threading.Thread(target=lambda: precompute(model=serving_model()), daemon=True).start()
+registry.on_activate(lambda info: tile_cache.clear())
+registry.on_activate(lambda info: explain_cache.clear())
+registry.on_activate(lambda info: _ensembles.clear())
+
+# District x day forecast, recomputed in the background and on model switches
+forecast_scheduler = ForecastScheduler(
+    lambda weathers, cells, days: predict_risks(weathers, cells, days, explain=True),
+    lambda: registry.active_version,
+).start()
+registry.on_activate(lambda info: forecast_scheduler.trigger())
 
-# Gemini Chatbot Integration
-import google.generativeai as genai
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    chat_model = genai.GenerativeModel('gemini-2.5-flash')
-    print("Gemini model configured")
+# Sentinel AI chat (chat.py): streamed, concurrency-bounded, FAQ answers cached
+chat_service = ChatService(make_upstream())
+if chat_service.online:
+    print(f"Chat backend: {CHAT_BACKEND}")
 else:
     print("Warning: GEMINI_API_KEY not found")
 
+CHAT_OFFLINE = "I'm currently offline (API Key missing). Please check back later!"
+CHAT_BUSY = "I'm helping a lot of people right now. Please try again in a moment!"
+CHAT_FAILED = "I'm having trouble connecting to my knowledge base right now. Please try again."
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat_with_bot():
-    data = request.json
+    data = request.json or {}
     user_message = data.get('message', '')
-    
-    if not GEMINI_API_KEY:
-        return jsonify({"response": "I'm currently offline (API Key missing). Please check back later!"})
+    # Opt-in Server-Sent Events: "delta" events as text arrives, then "done" (or "error")
+    stream = bool(data.get('stream')) or request.args.get('stream') == '1' \
+        or 'text/event-stream' in request.headers.get('Accept', '')
 
+    if not chat_service.online:
+        return jsonify({"response": CHAT_OFFLINE})
     try:
-        # Construct prompt with persona
-        prompt = f"""
-        You are Sentinel AI, a friendly and helpful local health assistant for families in the Mekong Delta.
-        Your goal is to explain Dengue prevention in a simple, encouraging, and easy-to-understand way.
-
-        Guidelines:
-        - Use a warm, conversational tone (like a helpful neighbor).
-        - Use emojis 🦟💧🏡 to make the text engaging.
-        - Use ### for Section Headers (e.g., "### 1. Tip the Water").
-        - Use **bold text** for important words.
-        - Use simple bullet points (-) for lists.
-        - Keep answers short and scannable.
-        - Focus on practical actions: "Empty water jars", "Sleep under nets", "Wear long sleeves".
-        - If the user asks about symptoms, list them clearly but always say: "If you feel sick, visit the doctor immediately! 🏥"
-        - Avoid complex medical jargon. Speak simply.
-        
-        User: {user_message}
-        Sentinel AI:
-        """
-        
-        response = chat_model.generate_content(prompt)
-        return jsonify({"response": response.text})
-    except Exception as e:
-        print(f"Gemini API Error: {e}")
-        return jsonify({"response": "I'm having trouble connecting to my knowledge base right now. Please try again."}), 500
+        reply = chat_service.ask(user_message)
+    except ChatBusy:
+        return jsonify({"response": CHAT_BUSY}), 503, {"Retry-After": "2"}
+
+    if not stream:
+        try:
+            return jsonify({"response": "".join(reply), "cached": reply.cached})
+        except Exception as e:
+            print(f"Chat error: {e}")
+            return jsonify({"response": CHAT_FAILED}), 504 if isinstance(e, ChatTimeout) else 500
+
+    def events():
+        parts = []
+        try:
+            for text in reply:
+                parts.append(text)
+                yield _sse("delta", {"text": text})
+        except Exception as e:
+            print(f"Chat error: {e}")
+            yield _sse("error", {"response": CHAT_FAILED})
+            return
+        yield _sse("done", {"response": "".join(parts), "cached": reply.cached})
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Frees the upstream slot even if the client disconnects before the answer ends
+    response.call_on_close(reply.close)
+    return response
 
 # --- Daily Quest Engine ---
-import sqlite3
 import random
 import datetime
 import uuid
 
-# Task Pools
-TASK_POOLS = {
-    "HIGH": [
-        {"id": "T1", "desc": "Clean stagnant water in 3 jars", "points": 50, "type": "photo"},
-        {"id": "T2", "desc": "Apply mosquito repellent to family", "points": 40, "type": "photo"},
-        {"id": "T3", "desc": "Alert 5 neighbors via SMS/App", "points": 60, "type": "action"}
-    ],
-    "MEDIUM": [
-        {"id": "T4", "desc": "Check window screens for holes", "points": 25, "type": "photo"},
-        {"id": "T5", "desc": "Complete a 3-question Dengue quiz", "points": 20, "type": "quiz"},
-        {"id": "wash_hands", "desc": "Wash hands with soap", "points": 50, "type": "photo"}
-    ],
-    "LOW": [
-        {"id": "T6", "desc": "Read today's health tip", "points": 10, "type": "read"}
-    ]
-}
+# Task catalog (tasks.json): immutable definitions, id index and weighted pools per risk level
+task_catalog = load_catalog()
 
-def init_db():
-    conn = sqlite3.connect('dengue.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS user_daily_tasks
-                 (user_id text, task_id text, status text, date text, risk_level_at_assignment real)''')
-    conn.commit()
-    conn.close()
+# Creates/migrates dengue.db (see db.MIGRATIONS) and credits completions made before the points ledger
+db.init_db()
+db.backfill_ledger({t.id: t.points for t in task_catalog.by_id.values()})
 
-init_db()
+# Task reads/writes go straight to SQLite, or through the write-behind queue
+# when TASK_WRITE_BEHIND=1 (see write_behind.py for durability notes)
+task_store = WriteBehindTaskStore() if TASK_WRITE_BEHIND else db
+if TASK_WRITE_BEHIND:
+    # Rollups only change once a batch is committed
+    task_store.on_flush = lambda: response_cache.invalidate("tasks")
+# Queued zone broadcasts, delivered by background workers
+broadcaster = Broadcaster().start()
 
 @app.route('/api/daily-task')
 def get_daily_task():
@@ -319,7 +327,8 @@ def get_daily_task():
     # Ideally, refactor risk calculation into a helper function
     lat = float(request.args.get('lat', 10.03))
     lon = float(request.args.get('lon', 105.78))
-    weather = get_real_weather(lat, lon)
+    observed = get_real_weather(lat, lon)
+    weather = observed
     if not weather:
         weather = {
             'temp': np.random.uniform(27, 31),
@@ -328,48 +337,33 @@ def get_daily_task():
             'salinity': 0.5
         }
     
-    if USE_ML:
-        features = np.array([[weather['temp'], weather['rainfall'], weather['humidity'], weather['salinity']]])
-        risk_pct = int(model.predict(features)[0])
-    else:
-        risk_pct = int(rule_based_predict(weather['temp'], weather['rainfall'], weather['humidity'], weather['salinity']))
+    risk_pct = predict_risk(weather, grid_cell(lat, lon), observed=observed is not None)
+    # Where the user is, for district rollups and zone broadcasts
+    district_id = nearest_district(lat, lon)
+    task_store.upsert_user_location(user_id, district_id, lat, lon)
         
     date_str = datetime.date.today().isoformat()
     
     # Check DB for existing task
-    conn = sqlite3.connect('dengue.db')
-    c = conn.cursor()
-    c.execute("SELECT task_id, status FROM user_daily_tasks WHERE user_id=? AND date=?", (user_id, date_str))
-    existing = c.fetchone()
-    
-    task_data = None
+    existing = task_store.get_task(user_id, date_str)
     
     if existing:
         task_id, status = existing
-        # Find task details in pools
-        for pool in TASK_POOLS.values():
-            for t in pool:
-                if t['id'] == task_id:
-                    task_data = t
-                    task_data['status'] = status
-                    break
     else:
-        # Assign new task
-        if risk_pct >= 70:
-            pool = TASK_POOLS["HIGH"]
-        elif risk_pct >= 30:
-            pool = TASK_POOLS["MEDIUM"]
-        else:
-            pool = TASK_POOLS["LOW"]
-        
-        task_data = random.choice(pool)
-        task_data['status'] = 'assigned'
-        
-        c.execute("INSERT INTO user_daily_tasks VALUES (?, ?, ?, ?, ?)", 
-                  (user_id, task_data['id'], 'assigned', date_str, risk_pct))
-        conn.commit()
+        # Assign new task from the pool for the current risk level
+        # A concurrent request may have assigned first; report whichever task won
+        try:
+            task_id, status = task_store.assign_task(
+                user_id, task_catalog.choose(risk_pct).id, date_str, risk_pct, district_id
+            )
+        except WriteBehindFull:
+            return jsonify({"error": "Too many quests being saved, please try again"}), 503, {"Retry-After": "2"}
+        # Rollups count assignments, so the manager views change too
+        response_cache.invalidate("tasks")
     
-    conn.close()
+    # Tasks retired from tasks.json still render for users who already hold them
+    task = task_catalog.get(task_id) or Task(task_id, "", "Quest no longer available", 0, "read")
+    task_data = task.view(status)
     
     return jsonify({
         "user_id": user_id,
@@ -385,89 +379,129 @@ def get_daily_task():
         }
     })
 
+def complete_verified_task(job):
+    """Completes the task of a photo that passed verification; returns (points, message)."""
+    user_id, task_id, date_str = job["user_id"], job["task_id"], job["date"]
+    task = task_catalog.get(task_id)
+    points = task.points if task else 0
+
+    # Status flip and points credit happen in one transaction; a repeat
+    # verification (or a race between two) credits nothing
+    if not task_store.complete_task(user_id, task_id, date_str, points):
+        if task_store.get_task_status(user_id, task_id, date_str) == 'completed':
+            return 0, "Task already completed!"
+        return 0, "This quest is not assigned to you today."
+    response_cache.invalidate("tasks", f"user:{user_id}")
+    return points, "Excellent work! Sentinel AI verified your action."
+
+verification.start(complete_verified_task, lambda task_id: getattr(task_catalog.get(task_id), "type", None))
+
+def _wait_arg(default):
+    """?wait= seconds, capped at VERIFY_MAX_WAIT; ValueError if it is not a non-negative number."""
+    wait = float(request.args.get('wait', default))
+    if not wait >= 0:
+        raise ValueError(wait)
+    return min(wait, VERIFY_MAX_WAIT)
+
+def _verification_response(job):
+    body = {k: job[k] for k in ("job_id", "status", "verified", "points_earned", "message", "queued_ms", "verify_ms")}
+    if job["status"] == "queued":
+        body["status_url"] = f"/api/tasks/verify/{job['job_id']}"
+        return jsonify(body), 202
+    return jsonify(body)
+
 @app.route('/api/tasks/verify', methods=['POST'])
 def verify_daily_task():
-    # Mock AI Verification
-    data = request.json
+    # Photos are stored by content hash and checked by worker processes
+    # (verification.py). Multipart uploads ("image" file part) get a 202 with a
+    # status URL; the legacy JSON body with a base64 "image" waits up to
+    # VERIFY_WAIT seconds for the verdict.
+    try:
+        wait = _wait_arg(VERIFY_WAIT if request.mimetype != 'multipart/form-data' else 0)
+    except ValueError:
+        return jsonify({"verified": False, "message": "wait must be a number of seconds"}), 400
+    # base64 bodies run about 4/3 of the photo size; the store enforces the exact limit
+    if request.content_length and request.content_length > VERIFY_MAX_BYTES * 2:
+        return jsonify({"verified": False, "message": "Photo is too large."}), 413
+    if request.mimetype == 'multipart/form-data':
+        data = request.form
+        upload = request.files.get('image')
+        stream, image_base64 = (upload.stream if upload else None), None
+    else:
+        data = request.json or {}
+        stream, image_base64 = None, data.get('image')
     user_id = data.get('user_id', 'user_123')
     task_id = data.get('task_id')
-    image_base64 = data.get('image') 
-    
-    if not image_base64:
+
+    if stream is None and not image_base64:
         return jsonify({"verified": False, "message": "No image provided. Please upload a photo to verify."}), 400
 
-    # Simulate AI processing time/logic
-    # In a real app, decode base64 and pass to model
-    # For now, we trust the user if they send an image
-    
-    verified = True 
-    
+    # Cheap checks first, so no worker time is spent on photos that cannot count
     date_str = datetime.date.today().isoformat()
-    
-    conn = sqlite3.connect('dengue.db')
-    c = conn.cursor()
-    
-    # Check if already completed to avoid double counting
-    c.execute("SELECT status FROM user_daily_tasks WHERE user_id=? AND task_id=? AND date=?", (user_id, task_id, date_str))
-    existing = c.fetchone()
-    if existing and existing[0] == 'completed':
-         conn.close()
-         return jsonify({"verified": True, "points_earned": 0, "message": "Task already completed!"})
-
-    if verified:
-        c.execute("UPDATE user_daily_tasks SET status='completed' WHERE user_id=? AND task_id=? AND date=?", 
-                  (user_id, task_id, date_str))
-        conn.commit()
-        
-        # Find points (from pools)
-        points = 0
-        found_task = False
-        for pool in TASK_POOLS.values():
-             for t in pool:
-                if t['id'] == task_id:
-                    points = t['points']
-                    found_task = True
-                    break
-             if found_task: break
-        
-        conn.close()
-        return jsonify({
-            "verified": True,
-            "points_earned": points,
-            "message": "Excellent work! Sentinel AI verified your action."
-        })
-    else:
-        conn.close()
-        return jsonify({"verified": False, "message": "Could not verify the action. Please try again."})
+    status = task_store.get_task_status(user_id, task_id, date_str)
+    if status == 'completed':
+        return jsonify({"verified": True, "points_earned": 0, "message": "Task already completed!"})
+    if status is None:
+        return jsonify({"verified": False, "message": "This quest is not assigned to you today."}), 404
 
+    try:
+        job_id, _ = verification.submit(user_id, task_id, date_str, stream=stream, base64_data=image_base64)
+    except UploadError as e:
+        return jsonify({"verified": False, "message": str(e)}), e.status
+    return _verification_response(verification.wait(job_id, wait))
+
+@app.route('/api/tasks/verify/<int:job_id>')
+def verify_status(job_id):
+    # ?wait=N holds the request until the verdict is in (at most N seconds)
+    try:
+        wait = _wait_arg(0)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    job = verification.wait(job_id, wait)
+    if job is None:
+        return jsonify({"error": "Unknown verification"}), 404
+    return _verification_response(job)
+
+
+VOUCHERS = [
+    {"id": "V1", "title": "50% Off Mosquito Net", "points": 500, "merchant": "Pharmacity"},
+    {"id": "V2", "title": "Free Coffee", "points": 200, "merchant": "Highlands Coffee"},
+    {"id": "V3", "title": "Cinema Ticket", "points": 1000, "merchant": "CGV Cinemas"},
+    {"id": "V4", "title": "Grab Bike 20k Off", "points": 300, "merchant": "Grab"},
+    {"id": "V5", "title": "Free Dengue Rapid Test", "points": 1500, "merchant": "City Hospital"}
+]
+VOUCHERS_BY_ID = {v["id"]: v for v in VOUCHERS}
 
 @app.route('/api/vouchers')
+@response_cache.cached(ttl=60, tags=lambda args: ["vouchers", f"user:{args.get('user_id', 'user_123')}"])
 def get_vouchers():
-    # Mock Vouchers
-    vouchers = [
-        {"id": "V1", "title": "50% Off Mosquito Net", "points": 500, "merchant": "Pharmacity"},
-        {"id": "V2", "title": "Free Coffee", "points": 200, "merchant": "Highlands Coffee"},
-        {"id": "V3", "title": "Cinema Ticket", "points": 1000, "merchant": "CGV Cinemas"},
-        {"id": "V4", "title": "Grab Bike 20k Off", "points": 300, "merchant": "Grab"},
-        {"id": "V5", "title": "Free Dengue Rapid Test", "points": 1500, "merchant": "City Hospital"}
-    ]
-    return jsonify({"vouchers": vouchers, "user_points": 1240}) # Mock points
+    user_id = request.args.get('user_id', 'user_123')
+    return jsonify({"vouchers": VOUCHERS, "user_points": task_store.get_balance(user_id)})
 
 @app.route('/api/vouchers/redeem', methods=['POST'])
 def redeem_voucher():
     data = request.json
-    user_id = data.get('user_id')
+    user_id = data.get('user_id', 'user_123')
     voucher_id = data.get('voucher_id')
     
-    # Mock redemption logic
-    # In reality, check balance in DB, deduct, create transaction
+    voucher = VOUCHERS_BY_ID.get(voucher_id)
+    if not voucher:
+        return jsonify({"success": False, "message": "Unknown voucher."}), 404
     
-    # Simulate DB Update
-    new_balance = 1240 - 200 # Mock calculation
+    # Atomic compare-and-deduct; the code doubles as the ledger reference
+    code = f"DENGUE-{voucher_id}-{uuid.uuid4().hex[:6].upper()}"
+    new_balance = task_store.redeem(user_id, voucher["points"], code)
+    if new_balance is None:
+        return jsonify({
+            "success": False,
+            "new_balance": task_store.get_balance(user_id),
+            "message": "Not enough points!"
+        }), 400
+    response_cache.invalidate(f"user:{user_id}")
     
     # Generate a fake QR code URL (using a placeholder service or just a static string)
     # Using a reliable QR placeholder service for demo
-    qr_code_url = f"https://api.qrserver.com/v1/create-qr-code/?size=150x150&data=DENGUE-{voucher_id}-{uuid.uuid4().hex[:6].upper()}"
+    qr_code_url = f"https://api.qrserver.com/v1/create-qr-code/?size=150x150&data={code}"
     
     return jsonify({
         "success": True,
@@ -476,91 +510,74 @@ def redeem_voucher():
         "message": "Voucher redeemed successfully!"
     })
 
+@app.route('/api/leaderboard')
+def get_leaderboard():
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"leaderboard": [
+        {"rank": i + 1, "user_id": user_id, "points": points}
+        for i, (user_id, points, _) in enumerate(task_store.leaderboard(min(100, max(1, limit))))
+    ]})
 
 
 # --- Manager Dashboard APIs ---
 
 @app.route('/api/manager/heatmap')
 def manager_heatmap():
-    # 14-day forecast risk map using Real AI Model
-    days = int(request.args.get('days', 14))
-    
-    # Defined Districts in Mekong Delta
-    districts = [
-        {"name": "Ninh Kieu", "id": "CT-NK", "center": [10.03, 105.78], "pop": 280000}, # Can Tho (Urban)
-        {"name": "Cai Rang", "id": "CT-CR", "center": [10.01, 105.74], "pop": 105000},
-        {"name": "Binh Thuy", "id": "CT-BT", "center": [10.06, 105.76], "pop": 140000},
-        {"name": "O Mon", "id": "CT-OM", "center": [10.10, 105.62], "pop": 128000},
-        {"name": "Phong Dien", "id": "CT-PD", "center": [9.99, 105.68], "pop": 98000},
-        {"name": "Vinh Long", "id": "VL-TP", "center": [10.25, 105.97], "pop": 150000},
-        {"name": "Sa Dec", "id": "DT-SD", "center": [10.29, 105.75], "pop": 110000}, # Dong Thap
-        {"name": "Cao Lanh", "id": "DT-CL", "center": [10.46, 105.63], "pop": 160000},
-        {"name": "Soc Trang", "id": "ST-TP", "center": [9.60, 105.97], "pop": 140000}, # Coastal
-        {"name": "Bac Lieu", "id": "BL-TP", "center": [9.29, 105.72], "pop": 150000}  # Coastal
-    ]
-    
+    # 14-day forecast risk map: a column of the latest scheduled run (scheduler.py)
+    run, previous = forecast_scheduler.runs(timeout=FORECAST_WAIT)
+    try:
+        days = int(request.args.get('days', run.horizon))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    days = min(max(days, 0), run.horizon)
+
+    body = run.responses.get(days)
+    if body is None:
+        body = run.responses[days] = json.dumps(manager_heatmap_payload(run, previous, days))
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(f"forecast-{run.id}-{days}")
+    response.last_modified = run.created_at
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def manager_heatmap_payload(run, previous, days):
+    districts = {d["id"]: d for d in load_districts()}
+    current = run.risks[:, 0]
+    projected = run.risks[:, days]
+    before = run.previous_risks(previous, days)
+
     response_data = []
-    
-    for d in districts:
-        lat, lon = d['center']
-        
-        # 1. Get Forecast Weather (Extrapolate to 14 days if needed)
-        # We rely on get_forecast_weather (which currently does +2 days). 
-        # For the "Manager View" looking 14 days ahead, we'll simulate a trend based on the 2-day forecast.
-        weather_now = get_forecast_weather(lat, lon, days_ahead=2) # Get real 2-day forecast as baseline
-        
-        if not weather_now:
-             weather_now = {
-                'temp': 30, 'rainfall': 50, 'humidity': 80, 'salinity': 0.5
-            }
-
-        # Simulate 14-day shift based on user request
-        # If looking 14 days ahead, we assume weather patterns intensify or settle
-        # For demo purposes: random fluctuation around the real 2-day prediction
-        future_weather = {
-            'temp': weather_now['temp'] + np.random.uniform(-2, 2),
-            'rainfall': max(0, weather_now['rainfall'] + np.random.uniform(-20, 50)), # Maybe more rain?
-            'humidity': min(100, weather_now['humidity'] + np.random.uniform(-5, 5)),
-            'salinity': weather_now['salinity']
-        }
-        
-        # Coastal districts have higher salinity risk
-        if d['name'] in ["Soc Trang", "Bac Lieu"]:
-             future_weather['salinity'] = np.random.uniform(1.0, 5.0) # High salinity
-
-        # 2. RUN AI MODEL
-        if USE_ML:
-            features = np.array([[
-                future_weather['temp'],
-                future_weather['rainfall'],
-                future_weather['humidity'],
-                future_weather['salinity']
-            ]])
-            # Predict
-            risk_pct = int(model.predict(features)[0])
-        else:
-             risk_pct = int(rule_based_predict(future_weather['temp'], future_weather['rainfall'], future_weather['humidity'], future_weather['salinity']))
-        
-        # Clamp
-        risk_pct = min(100, max(0, risk_pct))
-        
-        # Calculate Trend (Compare to a baseline "today" risk)
-        # Simplified: Just randomize trend label for UI if we don't store history
-        trend = "up" if risk_pct > 50 else "stable"
-        
+    for i, district_id in enumerate(run.district_ids):
+        risk_now, risk_pct = int(current[i]), int(projected[i])
+        # Trend: change since the previous run forecast the same date, else vs. today
+        delta = None if np.isnan(before[i]) else risk_pct - int(before[i])
+        change = delta if delta is not None else risk_pct - risk_now
+        trend = "up" if change >= TREND_THRESHOLD else "down" if change <= -TREND_THRESHOLD else "stable"
+
         color = "#ef4444" if risk_pct >= 75 else "#f97316" if risk_pct >= 50 else "#22c55e"
-        
+
         response_data.append({
-            **d,
-            "risk": int(risk_pct * 0.9), # Current (approx)
-            "projected_risk": risk_pct,  # Future
+            **districts.get(district_id, {"id": district_id}),
+            "risk": risk_now,            # Today
+            "projected_risk": risk_pct,  # `days` ahead
+            "delta": delta,
             "trend": trend,
-            "color": color
+            "color": color,
+            "explanation": run.explanations[days][i] if run.explanations else None,
         })
-        
-    return jsonify({"districts": response_data})
+
+    return {
+        "districts": response_data,
+        "days": days,
+        "run": run.describe(),
+        "previous_run": previous.describe() if previous else None,
+    }
 
 @app.route('/api/manager/sensors')
+@response_cache.cached(ttl=10, tags=["sensors"])
 def manager_sensors():
     # Mock real-time sensor array - Competition Ready Data
     return jsonify({
@@ -571,59 +588,85 @@ def manager_sensors():
     })
 
 @app.route('/api/manager/priority-zones')
+@response_cache.cached(ttl=60, tags=["tasks"])
 def manager_priority_zones():
-    # Top hotspots matching the mockup logic
-    return jsonify([
-        {
-            "id": "Z1",
-            "name": "Ninh Kieu, Ward 5",
-            "mosquito_index": 8.8,
-            "risk_label": "CRITICAL",
-            "status": "Pending",
-            "action_needed": "Immediate Spraying"
-        },
-        {
-            "id": "Z2",
-            "name": "Cai Rang, Hung Phu",
-            "mosquito_index": 7.2,
-            "risk_label": "HIGH",
-            "status": "Scheduled",
-            "action_needed": "Larvicide"
-        },
-        {
-            "id": "Z3",
-            "name": "O Mon, Phuoc Thoi",
-            "mosquito_index": 6.5,
-            "risk_label": "ELEVATED",
-            "status": "In Progress",
-            "action_needed": "Community Cleanup"
-        }
-    ])
+    # Districts with the highest risk and the least follow-up, from the task rollups
+    try:
+        limit = int(request.args.get('limit', 3))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify(priority_zones(min(50, max(1, limit))))
 
 @app.route('/api/manager/broadcast', methods=['POST'])
 def manager_broadcast():
-    data = request.json
+    data = request.json or {}
     zone_id = data.get('zone_id')
     message = data.get('message', 'Urgent Dengue Alert')
-    
-    # Mock sending to Firebase/SMS
+    if not zone_id:
+        return jsonify({"success": False, "message": "zone_id is required"}), 400
+
+    # Delivery runs on the broadcast workers (broadcast.py); poll the status URL for progress
+    job_id, recipients = broadcaster.enqueue(zone_id, message)
     return jsonify({
         "success": True,
-        "recipients": 5420,
+        "job_id": job_id,
+        "recipients": recipients,
         "zone": zone_id,
-        "status": "Sent"
-    })
+        "status": "Queued",
+        "status_url": f"/api/manager/broadcast/{job_id}",
+    }), 202
+
+@app.route('/api/manager/broadcast/<int:job_id>')
+def manager_broadcast_status(job_id):
+    status = broadcaster.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown broadcast"}), 404
+    return jsonify(status)
 
 @app.route('/api/manager/roi-stats')
+@response_cache.cached(ttl=60, tags=["tasks"])
 def manager_roi():
-    # Impact calculations - Fake for Value Demonstration
+    # Impact of completed citizen actions (rollups.py)
+    return jsonify(roi_stats())
+
+# --- Operational Metrics ---
+
+@app.route('/api/metrics')
+def metrics():
     return jsonify({
-        "cases_avoided": 342,
-        "money_saved_usd": 51300, # $150 * 342
-        "money_saved_vnd": 1282500000, 
-        "citizen_actions": 5230,
-        "prevention_rate_improvement": "24%"
+        "weather_cache": weather_cache.stats(),
+        "heatmap_tiles": tile_cache.stats(),
+        "upstreams": upstream_stats(),
+        "task_write_behind": task_store.stats() if TASK_WRITE_BEHIND else None,
+        "models": registry.stats(),
+        "feature_history": feature_history.stats(),
+        "weather_history": weather_history.stats(),
+        "explanations": explain_cache.stats(),
+        "forecast": forecast_scheduler.stats(),
+        "responses": response_cache.stats(),
+        "broadcasts": broadcaster.stats(),
+        "chat": chat_service.stats(),
+        "verification": verification.stats(),
     })
 
+@app.route('/api/models')
+def list_models():
+    registry.discover()
+    return jsonify(registry.stats())
+
+@app.route('/api/models/activate', methods=['POST'])
+def activate_model():
+    # Hot-swap: the new version is fully loaded before it becomes active
+    version = (request.json or {}).get('version')
+    try:
+        info = registry.activate(int(version))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "version must be an integer"}), 400
+    except KeyError as e:
+        return jsonify({"success": False, "message": str(e.args[0])}), 404
+    except RuntimeError as e:
+        return jsonify({"success": False, "message": f"Model failed to load: {e}"}), 500
+    return jsonify({"success": True, "model": info.describe()})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5328, debug=True)
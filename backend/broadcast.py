@@ -0,0 +1,298 @@
+"""
+Asynchronous broadcast delivery.
+
+POST /api/manager/broadcast only records a job (db.create_broadcast) and
+returns its id. Worker threads then
+  1. resolve the zone's recipients from user_locations (indexed by
+     district) into broadcast_deliveries, BROADCAST_RESOLVE_CHUNK users per
+     transaction, and
+  2. claim BROADCAST_BATCH deliveries at a time, pass them to the sender
+     under a shared rate limit and record the outcome,
+so delivery starts before a large zone is fully resolved. Claimed
+deliveries are leased to their worker; deliveries whose lease expired
+without being completed (the process died) are handed out again, so the
+queue survives restarts and several processes (e.g. the debug reloader's)
+can share one database. Recipients of an interrupted batch may get the
+message twice.
+
+Senders are pluggable: BROADCAST_SENDER names one registered with
+register_sender(). "log" prints one line per batch; "stub" simulates a
+provider with latency and failures, for load tests:
+
+    python broadcast.py --load-test --recipients 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import threading
+import time
+
+import db
+
+BROADCAST_SENDER = os.getenv("BROADCAST_SENDER", "log")
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 4))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", 500))
+# Messages per second across all workers; 0 disables the limit.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 2000))
+BROADCAST_RESOLVE_CHUNK = int(os.getenv("BROADCAST_RESOLVE_CHUNK", 50_000))
+BROADCAST_MAX_ATTEMPTS = 3
+# Seconds an idle worker sleeps before polling the queue again.
+BROADCAST_POLL = 1.0
+# Seconds a claimed batch stays leased beyond the time the rate limit may hold it.
+BROADCAST_LEASE = 60.0
+
+# --------------------
+# Senders
+# --------------------
+class LogSender:
+    """Development sender: logs each batch instead of delivering it."""
+
+    def send(self, job_id, user_ids, message):
+        print(f"[broadcast {job_id}] {len(user_ids)} recipients: {message!r}")
+        return []
+
+
+class StubSender:
+    """
+    Stand-in provider: sleeps `latency` seconds per batch and rejects each
+    recipient with probability `failure_rate`.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, job_id, user_ids, message):
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.failure_rate:
+            return []
+        with self._lock:
+            return [u for u in user_ids if self._rng.random() < self.failure_rate]
+
+
+SENDERS = {"log": LogSender, "stub": StubSender}
+
+def register_sender(name, factory):
+    """
+    Make `factory()` available as BROADCAST_SENDER=name. Senders implement
+    send(job_id, user_ids, message) -> user ids that were rejected, and
+    raise to have the whole batch retried.
+    """
+    SENDERS[name] = factory
+
+# --------------------
+# Rate Limiting
+# --------------------
+class RateLimiter:
+    """Token bucket shared by all workers; acquire(n) blocks until n messages may go out."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+# --------------------
+# Workers
+# --------------------
+class Broadcaster:
+    def __init__(self, path=None, sender=None, workers=BROADCAST_WORKERS, batch_size=BROADCAST_BATCH,
+                 rate=BROADCAST_RATE, resolve_chunk=BROADCAST_RESOLVE_CHUNK):
+        self.path = path
+        self.sender = sender or SENDERS[BROADCAST_SENDER]()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.resolve_chunk = resolve_chunk
+        self.limiter = RateLimiter(rate)
+        # A batch can wait up to batch_size / rate for tokens before it is sent.
+        self.lease = BROADCAST_LEASE + (batch_size / rate if rate > 0 else 0)
+        self._recovered_at = 0.0
+        self._wake = threading.Event()
+        self._closed = False
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "sent": 0, "failed": 0, "send_errors": 0, "send_ms_total": 0.0}
+
+    def start(self):
+        self._recover(db.connect(self.path))
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"broadcast-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout=10)
+
+    # --- API ---
+
+    def enqueue(self, zone_id, message):
+        """Queue a broadcast to everyone last seen in district zone_id; returns (job id, recipients)."""
+        conn = db.connect(self.path)
+        recipients = db.count_recipients(zone_id, conn=conn)
+        job_id = db.create_broadcast(zone_id, message, time.time(), conn=conn)
+        self._wake.set()
+        return job_id, recipients
+
+    def status(self, job_id):
+        row = db.get_broadcast(job_id, conn=db.connect(self.path))
+        if row is None:
+            return None
+        job_id, zone_id, status, total, resolved, sent, failed, created_at, started_at, finished_at = row
+        done = sent + failed
+        elapsed = ((finished_at or time.time()) - started_at) if started_at else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return {
+            "job_id": job_id,
+            "zone": zone_id,
+            "status": status,
+            "recipients": total,
+            "recipients_final": bool(resolved),
+            "sent": sent,
+            "failed": failed,
+            "pending": total - done,
+            "progress": round(done / total, 4) if total else (1.0 if status == "done" else 0.0),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_s": round(rate, 1),
+            "eta_s": round((total - done) / rate, 1) if rate and status != "done" else None,
+            "created_at": _iso(created_at),
+            "finished_at": _iso(finished_at),
+        }
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s["send_ms_avg"] = round(s["send_ms_total"] / s["batches"], 2) if s["batches"] else 0.0
+        s["send_ms_total"] = round(s["send_ms_total"], 1)
+        s["workers"] = self.workers
+        s["rate_limit"] = self.limiter.rate
+        return s
+
+    # --- worker loop ---
+
+    def _run(self):
+        conn = db.connect(self.path)
+        while not self._closed:
+            try:
+                claimed = db.claim_deliveries(self.batch_size, time.time(), self.lease, conn=conn)
+                if claimed is not None:
+                    self._deliver(conn, *claimed)
+                    continue
+                if db.resolve_broadcast_chunk(self.resolve_chunk, time.time(), conn=conn) is not None:
+                    continue
+                if time.time() - self._recovered_at > self.lease:
+                    self._recover(conn)
+            except Exception as e:
+                print("Broadcast worker error:", e)
+            self._wake.wait(BROADCAST_POLL)
+            self._wake.clear()
+
+    def _recover(self, conn):
+        self._recovered_at = time.time()
+        db.recover_broadcasts(self._recovered_at, self.lease, conn=conn)
+
+    def _deliver(self, conn, job_id, lo, hi, rows, token):
+        message = db.get_broadcast_message(job_id, conn=conn)
+        failed = []
+        if rows:
+            self.limiter.acquire(len(rows))
+            user_ids = [u for _, u in rows]
+            start = time.perf_counter()
+            for attempt in range(BROADCAST_MAX_ATTEMPTS):
+                try:
+                    rejected = set(self.sender.send(job_id, user_ids, message))
+                    failed = [seq for seq, u in rows if u in rejected]
+                    break
+                except Exception as e:
+                    with self._lock:
+                        self._stats["send_errors"] += 1
+                    if attempt == BROADCAST_MAX_ATTEMPTS - 1:
+                        print(f"Broadcast {job_id}: batch {lo}-{hi} failed: {e}")
+                        failed = [seq for seq, _ in rows]
+                    else:
+                        time.sleep(0.1 * 2 ** attempt)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        else:
+            elapsed_ms = 0.0
+        sent, n_failed = db.complete_deliveries(job_id, lo, hi, failed, token, time.time(), conn=conn)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["sent"] += sent
+            self._stats["failed"] += n_failed
+            self._stats["send_ms_total"] += elapsed_ms
+
+
+def _iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(timespec="seconds") if ts else None
+
+# --------------------
+# Load Test
+# --------------------
+def load_test(path, recipients=1_000_000, workers=BROADCAST_WORKERS, batch_size=BROADCAST_BATCH,
+              rate=0, latency=0.0, failure_rate=0.001):
+    """Seed `recipients` users in one zone, broadcast to them through StubSender and report throughput."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = db.connect(path)
+
+    start = time.perf_counter()
+    batch = 200_000
+    for lo in range(0, recipients, batch):
+        with db.transaction(conn):
+            conn.executemany(
+                "INSERT INTO user_locations (user_id, district_id) VALUES (?, ?)",
+                ((f"u{i:08d}", "LOAD" if i % 10 else "OTHER") for i in range(lo, min(recipients, lo + batch))),
+            )
+    zone_size = db.count_recipients("LOAD", conn=conn)
+    print(f"seeded {recipients:,} users ({zone_size:,} in zone) in {time.perf_counter() - start:.1f}s")
+
+    broadcaster = Broadcaster(path, StubSender(latency, failure_rate), workers, batch_size, rate).start()
+    start = time.perf_counter()
+    job_id, _ = broadcaster.enqueue("LOAD", "Load test alert")
+    print(f"enqueued job {job_id} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    while True:
+        time.sleep(1)
+        s = broadcaster.status(job_id)
+        print(f"  {s['status']:<8} {s['sent'] + s['failed']:>10,}/{s['recipients']:,}  {s['throughput_per_s']:>10,.0f} msg/s")
+        if s["status"] == "done":
+            break
+    broadcaster.close()
+    print(f"delivered {s['sent']:,} ({s['failed']:,} rejected) in {s['elapsed_s']:.1f}s "
+          f"-> {s['throughput_per_s']:,.0f} msg/s; {broadcaster.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Broadcast queue load test (stub sender)")
+    parser.add_argument("--load-test", action="store_true")
+    parser.add_argument("--db", default="broadcast_loadtest.db")
+    parser.add_argument("--recipients", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, default=BROADCAST_WORKERS)
+    parser.add_argument("--batch", type=int, default=BROADCAST_BATCH)
+    parser.add_argument("--rate", type=float, default=0, help="messages/s limit (0: unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub seconds per batch")
+    args = parser.parse_args()
+    if args.load_test:
+        load_test(args.db, args.recipients, args.workers, args.batch, args.rate, args.latency)
+    else:
+        parser.print_help()
@@ -0,0 +1,288 @@
+"""
+Sentinel AI chat: streamed answers with bounded upstream concurrency and
+an answer cache for frequent questions.
+
+- At most CHAT_MAX_CONCURRENCY upstream calls run at once. A request that
+  cannot get a slot within CHAT_QUEUE_TIMEOUT seconds is rejected
+  (ChatBusy) rather than queued behind slow calls.
+- The upstream streams on a pool thread. The request thread relays its
+  chunks and gives up after CHAT_TIMEOUT seconds in total. The slot is held
+  until the upstream call itself returns, so abandoned calls still count.
+- Complete answers to short questions are cached for CHAT_CACHE_TTL
+  seconds, keyed on the question's content words in order, so "What are
+  the symptoms of dengue?" and "Symptoms of dengue" share one entry.
+
+CHAT_BACKEND picks the upstream: "gemini" (needs GEMINI_API_KEY and
+google-generativeai) or "stub", a local canned model for tests.
+"""
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "gemini")
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 8))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 2))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", 30))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", 3600))
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", 1024))
+# Only questions of at most this many normalized words are cached.
+CHAT_CACHE_MAX_WORDS = 8
+
+PERSONA = """
+You are Sentinel AI, a friendly and helpful local health assistant for families in the Mekong Delta.
+Your goal is to explain Dengue prevention in a simple, encouraging, and easy-to-understand way.
+
+Guidelines:
+- Use a warm, conversational tone (like a helpful neighbor).
+- Use emojis 🦟💧🏡 to make the text engaging.
+- Use ### for Section Headers (e.g., "### 1. Tip the Water").
+- Use **bold text** for important words.
+- Use simple bullet points (-) for lists.
+- Keep answers short and scannable.
+- Focus on practical actions: "Empty water jars", "Sleep under nets", "Wear long sleeves".
+- If the user asks about symptoms, list them clearly but always say: "If you feel sick, visit the doctor immediately! 🏥"
+- Avoid complex medical jargon. Speak simply.
+"""
+
+def build_prompt(message):
+    return f"{PERSONA}\nUser: {message}\nSentinel AI:"
+
+
+class ChatBusy(Exception):
+    pass
+
+
+class ChatTimeout(Exception):
+    pass
+
+# --------------------
+# Upstreams
+# --------------------
+class GeminiUpstream:
+    def __init__(self, api_key=GEMINI_API_KEY, model=GEMINI_MODEL):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True, request_options={"timeout": CHAT_TIMEOUT}):
+            if chunk.text:
+                yield chunk.text
+
+
+class StubUpstream:
+    """Canned answers streamed word by word, `delay` seconds apart."""
+
+    ANSWERS = {
+        "symptom": "### Dengue symptoms 🦟\n- **High fever**\n- **Headache** and pain behind the eyes\n"
+                   "- **Muscle and joint pain**\n- Rash\n\nIf you feel sick, visit the doctor immediately! 🏥",
+        "": "### Keep mosquitoes away 💧\n- **Empty water jars** every week\n- **Sleep under nets**\n"
+            "- **Wear long sleeves** at dawn and dusk 🏡",
+    }
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.calls = 0
+
+    def stream(self, prompt):
+        self.calls += 1
+        question = prompt.rsplit("User:", 1)[-1].lower()
+        answer = next(a for key, a in self.ANSWERS.items() if key in question)
+        for word in re.split(r"(?<=\s)", answer):
+            time.sleep(self.delay)
+            yield word
+
+
+UPSTREAMS = {"gemini": GeminiUpstream, "stub": StubUpstream}
+
+def make_upstream(backend=CHAT_BACKEND):
+    """Configured upstream, or None when chat is offline (no Gemini key)."""
+    if backend == "gemini" and not GEMINI_API_KEY:
+        return None
+    return UPSTREAMS[backend]()
+
+# --------------------
+# Answer Cache
+# --------------------
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "what", "whats", "which", "how", "do", "does", "can", "i", "me",
+    "my", "you", "of", "for", "to", "in", "on", "about", "please", "tell", "some", "any", "and", "or",
+}
+
+def normalize_question(message):
+    """
+    Key of a question's content words, or None if it is too long to be an
+    FAQ. Word order is kept: "can mosquitoes infect humans" and "can humans
+    infect mosquitoes" are different questions.
+    """
+    words = re.findall(r"[a-z0-9]+", message.lower())
+    # Crude plural folding so "symptom" and "symptoms" match.
+    content = [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words if w not in _STOPWORDS]
+    if not content or len(content) > CHAT_CACHE_MAX_WORDS:
+        return None
+    return " ".join(content)
+
+
+class AnswerCache:
+    """TTL + LRU cache of complete answers keyed on normalize_question()."""
+
+    def __init__(self, ttl=CHAT_CACHE_TTL, max_entries=CHAT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None or time.monotonic() - hit[0] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            return hit[1]
+
+    def put(self, key, answer):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+# --------------------
+# Service
+# --------------------
+_DONE = object()
+
+
+class ChatReply:
+    """
+    Iterator over one answer's text chunks. Raises ChatTimeout, or the
+    upstream's error, part-way. close() tells the upstream call to stop at
+    its next chunk; it runs on exhaustion and must also be called if the
+    client goes away. The upstream slot is freed when that call returns.
+    """
+
+    def __init__(self, service, key, cached=False):
+        self.service = service
+        self.key = key
+        self.cached = cached
+        self.chunks = queue.Queue()
+        self.deadline = time.monotonic() + service.timeout
+        self._cancelled = threading.Event()
+        self._parts = []
+        self._closed = cached
+
+    def produce(self, upstream, prompt):
+        start = time.perf_counter()
+        try:
+            for text in upstream.stream(prompt):
+                if self._cancelled.is_set():
+                    return
+                self.chunks.put(text)
+            self.chunks.put(_DONE)
+        except Exception as e:
+            self.chunks.put(e)
+        finally:
+            self.service._release(start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            item = self.chunks.get(timeout=max(0.0, self.deadline - time.monotonic()))
+        except queue.Empty:
+            self.close("timeouts")
+            raise ChatTimeout(f"No answer within {self.service.timeout:g}s")
+        if item is _DONE:
+            if self.key and self._parts and not self.cached:
+                self.service.cache.put(self.key, "".join(self._parts))
+            self.close()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.close("errors")
+            raise item
+        self._parts.append(item)
+        return item
+
+    def close(self, outcome=None):
+        if self._closed:
+            return
+        self._closed = True
+        self._cancelled.set()
+        if outcome:
+            self.service._count(outcome)
+
+
+class ChatService:
+    def __init__(self, upstream=None, max_concurrency=CHAT_MAX_CONCURRENCY, queue_timeout=CHAT_QUEUE_TIMEOUT,
+                 timeout=CHAT_TIMEOUT, cache=None):
+        self.upstream = upstream
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.cache = cache or AnswerCache()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chat")
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "cache_hits": 0, "busy": 0, "timeouts": 0, "errors": 0,
+                       "in_flight": 0, "upstream_ms_total": 0.0, "upstream_calls": 0}
+
+    @property
+    def online(self):
+        return self.upstream is not None
+
+    def ask(self, message):
+        """
+        ChatReply for a question: a cached answer, or one streaming from
+        the upstream. Raises ChatBusy when no upstream slot frees up within
+        queue_timeout.
+        """
+        key = normalize_question(message)
+        answer = self.cache.get(key) if key else None
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["cache_hits"] += answer is not None
+        if answer is not None:
+            reply = ChatReply(self, key, cached=True)
+            reply.chunks.put(answer)
+            reply.chunks.put(_DONE)
+            return reply
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._stats["busy"] += 1
+            raise ChatBusy("Too many chats in progress")
+        with self._lock:
+            self._stats["in_flight"] += 1
+        reply = ChatReply(self, key)
+        self._pool.submit(reply.produce, self.upstream, build_prompt(message))
+        return reply
+
+    def _release(self, start):
+        """Called by the pool thread when its upstream call has returned."""
+        self._slots.release()
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            self._stats["upstream_calls"] += 1
+            self._stats["upstream_ms_total"] += (time.perf_counter() - start) * 1000
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s["upstream_ms_avg"] = round(s.pop("upstream_ms_total") / s["upstream_calls"], 1) if s["upstream_calls"] else 0.0
+        s["cached_answers"] = len(self.cache)
+        s["backend"] = type(self.upstream).__name__ if self.upstream else None
+        return s
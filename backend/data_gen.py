@@ -1,61 +1,245 @@
-import pandas as pd
+"""
+Synthetic Mekong Delta dengue dataset.
+
+One row per district per day, time-ordered within each district:
+
+    District, Date, Lat, Lon, Temperature, Rainfall, Humidity, Salinity, Risk_Percentage
+
+Weather follows a wet/dry season cycle plus AR(1) anomalies. Anomalies are
+spatially correlated: each district mixes a few regional signals, weighted
+by its distance to their anchors, with its own local noise, so nearby
+districts move together. Risk_Percentage applies the rule-based score
+(risk_engine.rule_points) plus noise, clipped to 0-100.
+
+Every random stream is derived from (seed, district) or (seed, anchor), so
+output is reproducible for a seed and holds the same rows whatever --workers
+and --chunk-days are. Row order does depend on --workers: each worker's
+block of districts is written in turn, time-ordered within the block.
+Readers that need a global order should sort on (Date, District). Rows are
+generated and written chunk_days at a time, so memory stays bounded by one
+chunk per worker.
+
+    python data_gen.py                                  # 10 districts x 100 days
+    python data_gen.py --districts 500 --days 3650 --workers 4 --out big.csv
+    python data_gen.py --out big.parquet                # needs pyarrow
+"""
+import argparse
+import datetime
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 
-# Set random seed for reproducibility
-np.random.seed(42)
-
-# Number of samples
-n_samples = 1000
-
-# Generate synthetic features
-data = {
-    'Temperature': np.random.uniform(20, 35, n_samples),  # 20 to 35 degrees Celsius
-    'Rainfall': np.random.uniform(0, 300, n_samples),     # 0 to 300 mm
-    'Humidity': np.random.uniform(40, 100, n_samples),    # 40 to 100 %
-    'Salinity': np.random.uniform(0, 30, n_samples)       # 0 to 30 ppt
-}
-
-df = pd.DataFrame(data)
-
-# Define a function to calculate risk percentage based on some rules with noise
-def calculate_risk(row):
-    risk = 0
-    # Temperature: Optimal 25-30
-    if 25 <= row['Temperature'] <= 30:
-        risk += 35
-    elif 23 <= row['Temperature'] < 25 or 30 < row['Temperature'] <= 32:
-        risk += 20
-    else:
-        risk += 5
-    
-    # Rainfall: High rainfall increases breeding sites
-    if row['Rainfall'] > 150:
-        risk += 35
-    elif row['Rainfall'] > 80:
-        risk += 20
-    else:
-        risk += 5
-    
-    # Humidity: High humidity favors mosquito survival
-    if row['Humidity'] > 75:
-        risk += 25
-    elif row['Humidity'] > 65:
-        risk += 15
+from fanout import load_districts
+from risk_engine import rule_points
+
+# Area covered by the extra synthetic districts (lat_min, lon_min, lat_max, lon_max).
+REGION_BBOX = (9.0, 104.8, 10.9, 106.8)
+# Regional signal anchors (3 x 3 over REGION_BBOX) and their reach in degrees.
+ANCHOR_GRID = 3
+ANCHOR_SCALE = 0.6
+# Share of anomaly variance explained by the regional signals.
+REGIONAL_SHARE = 0.7
+# Day-to-day persistence of temperature / rain / humidity anomalies.
+AR_PHI = np.array([0.8, 0.6, 0.7])
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+COLUMNS = ["District", "Date", "Lat", "Lon", "Temperature", "Rainfall", "Humidity", "Salinity", "Risk_Percentage"]
+
+# --------------------
+# Districts
+# --------------------
+def make_districts(n, seed):
+    """First n districts: the real ones from districts.json, then synthetic ones."""
+    districts = [dict(d) for d in load_districts()][:n]
+    rng = np.random.default_rng([seed, 0])
+    lat_min, lon_min, lat_max, lon_max = REGION_BBOX
+    for i in range(len(districts), n):
+        lat = round(float(rng.uniform(lat_min, lat_max)), 4)
+        lon = round(float(rng.uniform(lon_min, lon_max)), 4)
+        districts.append({
+            "id": f"SYN-{i:05d}",
+            "center": [lat, lon],
+            # Southern, seaward part of the delta takes in saltwater.
+            "coastal": lat < 9.8 and lon > 105.5,
+        })
+    return districts
+
+def _anchor_weights(districts):
+    lat_min, lon_min, lat_max, lon_max = REGION_BBOX
+    a_lat, a_lon = np.meshgrid(np.linspace(lat_min, lat_max, ANCHOR_GRID), np.linspace(lon_min, lon_max, ANCHOR_GRID))
+    anchors = np.column_stack([a_lat.ravel(), a_lon.ravel()])
+    centers = np.array([d["center"] for d in districts], dtype=np.float64)
+    d2 = ((centers[:, None, :] - anchors[None, :, :]) ** 2).sum(axis=2)
+    w = np.exp(-d2 / (2 * ANCHOR_SCALE ** 2))
+    # Scale so the regional part carries REGIONAL_SHARE of the unit variance.
+    return w * np.sqrt(REGIONAL_SHARE / (w ** 2).sum(axis=1, keepdims=True))
+
+# --------------------
+# Generation
+# --------------------
+class _Shard:
+    """State for generating a contiguous block of districts chunk by chunk."""
+
+    def __init__(self, districts, index, seed):
+        self.districts = districts
+        self.weights = _anchor_weights(districts)
+        n_anchors = self.weights.shape[1]
+        self.anchor_rngs = [np.random.default_rng([seed, 1, k]) for k in range(n_anchors)]
+        self.local_rngs = [np.random.default_rng([seed, 2, i]) for i in index]
+        self.salinity_rngs = [np.random.default_rng([seed, 3, i]) for i in index]
+        self.risk_rngs = [np.random.default_rng([seed, 4, i]) for i in index]
+        self.state = np.zeros((len(districts), 3))
+        self.coastal = np.array([bool(d.get("coastal")) for d in districts])
+        self.lat = np.array([d["center"][0] for d in districts])
+        self.lon = np.array([d["center"][1] for d in districts])
+        self.ids = np.array([d["id"] for d in districts], dtype=object)
+
+    def chunk(self, start_day, n_days):
+        n = len(self.districts)
+        # Innovations (days, districts, 3): regional mix + local noise.
+        regional = np.stack([r.standard_normal((n_days, 3)) for r in self.anchor_rngs], axis=1)
+        local = np.stack([r.standard_normal((n_days, 3)) for r in self.local_rngs], axis=1)
+        eps = np.einsum("dk,tkv->tdv", self.weights, regional) + np.sqrt(1 - REGIONAL_SHARE) * local
+
+        # AR(1) anomalies; sequential in time, vectorized over districts.
+        anomaly = np.empty_like(eps)
+        state = self.state
+        scale = np.sqrt(1 - AR_PHI ** 2)
+        for t in range(n_days):
+            state = AR_PHI * state + scale * eps[t]
+            anomaly[t] = state
+        self.state = state
+
+        dates = np.arange(start_day, start_day + n_days)
+        doy = np.array([datetime.date.fromordinal(int(d)).timetuple().tm_yday for d in dates])
+        # Wet season peaks around early September, dry season around March.
+        wet = 0.5 + 0.5 * np.sin(2 * np.pi * (doy - 150) / 365.25)[:, None]
+
+        temp = 27.5 + 1.5 * np.cos(2 * np.pi * (doy - 110) / 365.25)[:, None] + 1.6 * anomaly[..., 0]
+        rain = (20 + 160 * wet) * np.exp(0.6 * anomaly[..., 1] - 0.18)
+        humidity = 70 + 14 * wet + 4 * anomaly[..., 2] + 2 * anomaly[..., 1]
+        # Salinity intrusion in coastal districts during the dry season.
+        noise = np.stack([r.standard_normal(n_days) for r in self.salinity_rngs], axis=1)
+        salinity = np.where(self.coastal, 1.0 + 6.0 * (1 - wet), 0.3) + 0.4 * np.abs(noise)
+
+        temp = np.clip(temp, 20, 35)
+        rain = np.clip(rain, 0, 300)
+        humidity = np.clip(humidity, 40, 100)
+        X = np.column_stack([temp.ravel(), rain.ravel(), humidity.ravel(), salinity.ravel()])
+
+        risk_noise = np.stack([r.integers(-5, 5, n_days) for r in self.risk_rngs], axis=1)
+        risk = np.clip(rule_points(X) + risk_noise.ravel(), 0, 100)
+
+        return pd.DataFrame({
+            "District": np.tile(self.ids, n_days),
+            "Date": np.repeat(dates - _EPOCH_ORDINAL, n).astype("datetime64[D]"),
+            "Lat": np.tile(self.lat, n_days),
+            "Lon": np.tile(self.lon, n_days),
+            "Temperature": X[:, 0],
+            "Rainfall": X[:, 1],
+            "Humidity": X[:, 2],
+            "Salinity": X[:, 3],
+            "Risk_Percentage": risk.astype(np.int64),
+        }, columns=COLUMNS)
+
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self._pq_writer = None
+        self._header = True
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise SystemExit("Parquet output needs pyarrow (pip install pyarrow)")
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._pq_writer is None:
+                self._pq_writer = pq.ParquetWriter(self.path, table.schema)
+            self._pq_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="a", header=self._header, index=False, date_format="%Y-%m-%d", float_format="%.4f")
+            self._header = False
+
+    def close(self):
+        if self._pq_writer is not None:
+            self._pq_writer.close()
+
+
+def generate(out, districts, index, days, start, seed, chunk_days):
+    """Write one shard (districts with global indices `index`) to `out`; returns rows written."""
+    shard = _Shard(districts, index, seed)
+    writer = _Writer(out)
+    rows = 0
+    try:
+        first = start.toordinal()
+        for offset in range(0, days, chunk_days):
+            df = shard.chunk(first + offset, min(chunk_days, days - offset))
+            writer.write(df)
+            rows += len(df)
+    finally:
+        writer.close()
+    return rows
+
+def _part_path(out, k):
+    root, ext = os.path.splitext(out)
+    return f"{root}.part-{k:03d}{ext}"
+
+def run(out, n_districts, days, start, seed, chunk_days, workers):
+    districts = make_districts(n_districts, seed)
+    workers = max(1, min(workers, len(districts)))
+    t0 = time.perf_counter()
+    if workers == 1:
+        rows = generate(out, districts, range(len(districts)), days, start, seed, chunk_days)
+        parts = [out]
     else:
-        risk += 5
-    
-    # Salinity: Aedes aegypti prefers fresh water
-    if row['Salinity'] > 2:
-        risk -= 10
-        
-    # Add random noise
-    risk += np.random.randint(-5, 5)
-    
-    # Clip between 0 and 100
-    return min(100, max(0, risk))
-
-df['Risk_Percentage'] = df.apply(calculate_risk, axis=1)
-
-# Save to CSV
-df.to_csv('mekong_dengue_data.csv', index=False)
-print("Synthetic data generated and saved to 'mekong_dengue_data.csv'")
+        bounds = np.linspace(0, len(districts), workers + 1).astype(int)
+        parts = [_part_path(out, k) for k in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(generate, parts[k], districts[lo:hi], range(lo, hi), days, start, seed, chunk_days)
+                for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+            ]
+            rows = sum(f.result() for f in futures)
+        if not out.endswith(".parquet"):
+            # Stitch CSV parts into one file (district blocks, each time-ordered).
+            with open(out, "wb") as dst:
+                for k, part in enumerate(parts):
+                    with open(part, "rb") as src:
+                        if k:
+                            src.readline()
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                    os.remove(part)
+            parts = [out]
+    elapsed = time.perf_counter() - t0
+    print(f"Generated {rows:,} rows ({len(districts)} districts x {days} days) in {elapsed:.2f}s "
+          f"-> {rows / elapsed:,.0f} rows/s")
+    print("Wrote " + ", ".join(parts))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic district x day dengue data")
+    parser.add_argument("--districts", type=int, default=10)
+    parser.add_argument("--days", type=int, default=100)
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date(2024, 1, 1))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--out", default="mekong_dengue_data.csv", help=".csv or .parquet (Parquet with --workers > 1 writes one file per worker)")
+    args = parser.parse_args()
+    run(args.out, args.districts, args.days, args.start, args.seed, args.chunk_days, args.workers)
@@ -0,0 +1,764 @@
+import os
+import sqlite3
+import threading
+import time
+
+# --------------------
+# Configuration
+# --------------------
+DB_PATH = os.getenv("DENGUE_DB_PATH", "dengue.db")
+# NORMAL is crash-safe with WAL but may lose the last commits on power loss; FULL fsyncs every commit.
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-32000",       # 32 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+_local = threading.local()
+_migrate_lock = threading.Lock()
+_migrated = set()
+
+# --------------------
+# Connections
+# --------------------
+def connect(path=None):
+    """
+    The calling thread's connection to `path` (default DB_PATH).
+
+    Connections are opened once per thread and reused, so the sqlite3
+    statement cache keeps every query below prepared.
+    """
+    path = path or DB_PATH
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, cached_statements=256, isolation_level=None)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conns[path] = conn
+        migrate(conn, path)
+    return conn
+
+def close():
+    """Close the calling thread's connections."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+class transaction:
+    """`with transaction(conn):` runs the block in BEGIN IMMEDIATE ... COMMIT."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+# --------------------
+# Schema Migrations
+# --------------------
+def _m1_task_primary_key(conn):
+    # The original table had no key; rebuild it keyed on (user_id, date, task_id)
+    # so per-user/day lookups are index seeks and duplicates are impossible.
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_daily_tasks
+                 (user_id text, task_id text, status text, date text, risk_level_at_assignment real)''')
+    conn.execute('''CREATE TABLE user_daily_tasks_v1
+                 (user_id TEXT NOT NULL,
+                  date TEXT NOT NULL,
+                  task_id TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'assigned',
+                  risk_level_at_assignment REAL,
+                  PRIMARY KEY (user_id, date, task_id)) WITHOUT ROWID''')
+    conn.execute('''INSERT OR IGNORE INTO user_daily_tasks_v1
+                 (user_id, date, task_id, status, risk_level_at_assignment)
+                 SELECT user_id, date, task_id, COALESCE(status, 'assigned'), risk_level_at_assignment
+                 FROM user_daily_tasks WHERE user_id IS NOT NULL AND date IS NOT NULL AND task_id IS NOT NULL''')
+    conn.execute("DROP TABLE user_daily_tasks")
+    conn.execute("ALTER TABLE user_daily_tasks_v1 RENAME TO user_daily_tasks")
+
+
+def _m2_points_ledger(conn):
+    # Append-only ledger; (user_id, reason, ref) is unique so a task completion
+    # or a redemption can never be booked twice.
+    conn.execute('''CREATE TABLE points_ledger
+                 (id INTEGER PRIMARY KEY,
+                  user_id TEXT NOT NULL,
+                  delta INTEGER NOT NULL,
+                  reason TEXT NOT NULL,
+                  ref TEXT NOT NULL,
+                  created_at TEXT NOT NULL DEFAULT (datetime('now')))''')
+    conn.execute("CREATE UNIQUE INDEX idx_ledger_user_ref ON points_ledger (user_id, reason, ref)")
+    # Materialized balances, maintained in the same transaction as each ledger row.
+    conn.execute('''CREATE TABLE user_balances
+                 (user_id TEXT PRIMARY KEY,
+                  balance INTEGER NOT NULL DEFAULT 0 CHECK (balance >= 0),
+                  lifetime_points INTEGER NOT NULL DEFAULT 0,
+                  updated_at TEXT NOT NULL DEFAULT (datetime('now'))) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX idx_balances_leaderboard ON user_balances (lifetime_points DESC, user_id)")
+    conn.execute("CREATE TABLE app_meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+
+
+def _m3_forecast_runs(conn):
+    # One row per scheduled forecast run; risks is the (district x day)
+    # int16 matrix as raw bytes, districts the JSON list of its row ids.
+    conn.execute('''CREATE TABLE forecast_runs
+                 (id INTEGER PRIMARY KEY,
+                  created_at TEXT NOT NULL,
+                  base_date TEXT NOT NULL,
+                  model_version INTEGER,
+                  districts TEXT NOT NULL,
+                  horizon INTEGER NOT NULL,
+                  risks BLOB NOT NULL)''')
+
+
+def _m4_district_rollups(conn):
+    # Tasks remember the district they were assigned in; per-district/day
+    # totals are maintained in the same transaction as each assignment and
+    # completion, so dashboards never scan user_daily_tasks.
+    conn.execute("ALTER TABLE user_daily_tasks ADD COLUMN district_id TEXT")
+    conn.execute('''CREATE TABLE district_daily_rollups
+                 (district_id TEXT NOT NULL,
+                  date TEXT NOT NULL,
+                  assigned INTEGER NOT NULL DEFAULT 0,
+                  assigned_risk_sum REAL NOT NULL DEFAULT 0,
+                  completed INTEGER NOT NULL DEFAULT 0,
+                  completed_risk_sum REAL NOT NULL DEFAULT 0,
+                  points_issued INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (district_id, date)) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX idx_rollups_date ON district_daily_rollups (date)")
+    _rebuild_rollups(conn)
+
+
+def _m5_broadcasts(conn):
+    # Where each user was last seen, indexed by district for recipient lookups.
+    conn.execute('''CREATE TABLE user_locations
+                 (user_id TEXT PRIMARY KEY,
+                  district_id TEXT NOT NULL,
+                  lat REAL,
+                  lon REAL,
+                  updated_at TEXT NOT NULL DEFAULT (datetime('now'))) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX idx_user_locations_district ON user_locations (district_id, user_id)")
+    # Broadcast queue: recipients are resolved into deliveries in chunks
+    # (resolve_cursor = last user_id copied) while workers claim seq ranges
+    # below `total` through next_seq.
+    conn.execute('''CREATE TABLE broadcast_jobs
+                 (id INTEGER PRIMARY KEY,
+                  zone_id TEXT NOT NULL,
+                  message TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  total INTEGER NOT NULL DEFAULT 0,
+                  resolved INTEGER NOT NULL DEFAULT 0,
+                  resolve_cursor TEXT NOT NULL DEFAULT '',
+                  next_seq INTEGER NOT NULL DEFAULT 0,
+                  sent INTEGER NOT NULL DEFAULT 0,
+                  failed INTEGER NOT NULL DEFAULT 0,
+                  created_at REAL NOT NULL,
+                  started_at REAL,
+                  finished_at REAL)''')
+    conn.execute("CREATE INDEX idx_broadcast_jobs_status ON broadcast_jobs (status, id)")
+    conn.execute('''CREATE TABLE broadcast_deliveries
+                 (job_id INTEGER NOT NULL,
+                  seq INTEGER NOT NULL,
+                  user_id TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'pending',
+                  PRIMARY KEY (job_id, seq)) WITHOUT ROWID''')
+
+
+def _m6_verifications(conn):
+    # Photo verification jobs. image_hash names the file in the upload store;
+    # a repeated submission of the same photo for the same task maps to one job.
+    conn.execute('''CREATE TABLE verification_jobs
+                 (id INTEGER PRIMARY KEY,
+                  user_id TEXT NOT NULL,
+                  task_id TEXT NOT NULL,
+                  date TEXT NOT NULL,
+                  image_hash TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  verified INTEGER,
+                  points INTEGER NOT NULL DEFAULT 0,
+                  message TEXT,
+                  created_at REAL NOT NULL,
+                  started_at REAL,
+                  finished_at REAL)''')
+    conn.execute('''CREATE UNIQUE INDEX idx_verification_submission
+                    ON verification_jobs (user_id, date, task_id, image_hash)''')
+    conn.execute("CREATE INDEX idx_verification_status ON verification_jobs (status, id)")
+
+
+def _m7_broadcast_leases(conn):
+    # When a delivery was last claimed; a claim older than the lease may be handed out again.
+    conn.execute("ALTER TABLE broadcast_deliveries ADD COLUMN claimed_at REAL")
+
+
+# Append-only: version N is MIGRATIONS[N - 1], tracked in PRAGMA user_version.
+MIGRATIONS = [
+    _m1_task_primary_key,
+    _m2_points_ledger,
+    _m3_forecast_runs,
+    _m4_district_rollups,
+    _m5_broadcasts,
+    _m6_verifications,
+    _m7_broadcast_leases,
+]
+
+def migrate(conn, path=None):
+    path = path or DB_PATH
+    with _migrate_lock:
+        if path in _migrated:
+            return
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for n, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            with transaction(conn):
+                # Re-read under the write lock: another process opening the
+                # same file may have applied this step since the read above.
+                applied = conn.execute("PRAGMA user_version").fetchone()[0] >= n
+                if not applied:
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version={n}")
+            if not applied:
+                print(f"Migrated {path} to schema v{n}")
+        _migrated.add(path)
+
+def init_db(path=None):
+    connect(path)
+
+# --------------------
+# Daily Task Queries
+# --------------------
+SQL_GET_TASK = "SELECT task_id, status FROM user_daily_tasks WHERE user_id=? AND date=? LIMIT 1"
+SQL_GET_TASK_STATUS = "SELECT status FROM user_daily_tasks WHERE user_id=? AND date=? AND task_id=?"
+SQL_ASSIGN_TASK = '''INSERT INTO user_daily_tasks (user_id, date, task_id, status, risk_level_at_assignment, district_id)
+                     SELECT ?, ?, ?, 'assigned', ?, ?
+                     WHERE NOT EXISTS (SELECT 1 FROM user_daily_tasks WHERE user_id=? AND date=?)'''
+SQL_COMPLETE_TASK = '''UPDATE user_daily_tasks SET status='completed'
+                       WHERE user_id=? AND date=? AND task_id=? AND status != 'completed' '''
+
+def get_task(user_id, date_str, conn=None):
+    """(task_id, status) assigned to the user on date_str, or None."""
+    conn = conn or connect()
+    return conn.execute(SQL_GET_TASK, (user_id, date_str)).fetchone()
+
+def get_task_status(user_id, task_id, date_str, conn=None):
+    conn = conn or connect()
+    row = conn.execute(SQL_GET_TASK_STATUS, (user_id, date_str, task_id)).fetchone()
+    return row[0] if row else None
+
+def assign_task(user_id, task_id, date_str, risk_level, district_id=None, conn=None):
+    """
+    Assign task_id unless the user already has a task for date_str.
+
+    Returns the (task_id, status) that is assigned after the call, which is
+    the existing task if a concurrent request got there first.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        _assign(conn, user_id, task_id, date_str, risk_level, district_id)
+        return conn.execute(SQL_GET_TASK, (user_id, date_str)).fetchone()
+
+def _assign(conn, user_id, task_id, date_str, risk_level, district_id):
+    args = (user_id, date_str, task_id, risk_level, district_id, user_id, date_str)
+    if conn.execute(SQL_ASSIGN_TASK, args).rowcount == 1:
+        conn.execute(SQL_ROLLUP_ASSIGN, (district_id, date_str, risk_level))
+
+def complete_task(user_id, task_id, date_str, points=0, conn=None):
+    """
+    Mark the task completed and credit `points` in one transaction.
+
+    Returns False (and credits nothing) if the task is missing or already completed.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        return _complete_and_credit(conn, user_id, task_id, date_str, points)
+
+def _complete_and_credit(conn, user_id, task_id, date_str, points):
+    if conn.execute(SQL_COMPLETE_TASK, (user_id, date_str, task_id)).rowcount != 1:
+        return False
+    booked = bool(points) and _book(conn, user_id, points, "task", f"{date_str}:{task_id}")
+    conn.execute(SQL_ROLLUP_COMPLETE, (points if booked else 0, user_id, date_str, task_id))
+    return True
+
+def apply_task_batch(assigns, completes, locations=(), conn=None):
+    """
+    Apply many task writes in one transaction (used by write_behind).
+
+    assigns: iterable of (user_id, task_id, date_str, risk_level, district_id)
+    completes: iterable of (user_id, task_id, date_str, points)
+    locations: iterable of (user_id, district_id, lat, lon)
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        for u, t, d, r, district_id in assigns:
+            _assign(conn, u, t, d, r, district_id)
+        for u, t, d, p in completes:
+            _complete_and_credit(conn, u, t, d, p)
+        conn.executemany(SQL_UPSERT_LOCATION, locations)
+
+# --------------------
+# District Rollups
+# --------------------
+UNKNOWN_DISTRICT = "unknown"
+
+SQL_ROLLUP_ASSIGN = f'''INSERT INTO district_daily_rollups (district_id, date, assigned, assigned_risk_sum)
+                       VALUES (COALESCE(?, '{UNKNOWN_DISTRICT}'), ?, 1, COALESCE(?, 0))
+                       ON CONFLICT (district_id, date) DO UPDATE SET
+                         assigned = assigned + 1,
+                         assigned_risk_sum = assigned_risk_sum + excluded.assigned_risk_sum'''
+SQL_ROLLUP_COMPLETE = f'''INSERT INTO district_daily_rollups (district_id, date, completed, completed_risk_sum, points_issued)
+                         SELECT COALESCE(district_id, '{UNKNOWN_DISTRICT}'), date, 1, COALESCE(risk_level_at_assignment, 0), ?
+                         FROM user_daily_tasks WHERE user_id=? AND date=? AND task_id=?
+                         ON CONFLICT (district_id, date) DO UPDATE SET
+                           completed = completed + 1,
+                           completed_risk_sum = completed_risk_sum + excluded.completed_risk_sum,
+                           points_issued = points_issued + excluded.points_issued'''
+SQL_ROLLUP_REBUILD = f'''INSERT INTO district_daily_rollups
+                        (district_id, date, assigned, assigned_risk_sum, completed, completed_risk_sum, points_issued)
+                        SELECT COALESCE(t.district_id, '{UNKNOWN_DISTRICT}'), t.date, COUNT(*),
+                               COALESCE(SUM(t.risk_level_at_assignment), 0),
+                               SUM(t.status = 'completed'),
+                               COALESCE(SUM(CASE WHEN t.status = 'completed' THEN t.risk_level_at_assignment END), 0),
+                               COALESCE(SUM(l.delta), 0)
+                        FROM user_daily_tasks t
+                        LEFT JOIN points_ledger l
+                          ON l.user_id = t.user_id AND l.reason = 'task' AND l.ref = t.date || ':' || t.task_id
+                        GROUP BY 1, 2'''
+SQL_ROLLUP_BY_DISTRICT = '''SELECT district_id, SUM(assigned), SUM(assigned_risk_sum), SUM(completed),
+                                 SUM(completed_risk_sum), SUM(points_issued)
+                          FROM district_daily_rollups WHERE date >= ? AND date <= ? GROUP BY district_id'''
+SQL_ROLLUP_TOTALS = '''SELECT COALESCE(SUM(assigned), 0), COALESCE(SUM(assigned_risk_sum), 0), COALESCE(SUM(completed), 0),
+                            COALESCE(SUM(completed_risk_sum), 0), COALESCE(SUM(points_issued), 0)
+                     FROM district_daily_rollups WHERE date >= ? AND date <= ?'''
+
+def _rebuild_rollups(conn):
+    conn.execute("DELETE FROM district_daily_rollups")
+    return conn.execute(SQL_ROLLUP_REBUILD).rowcount
+
+def rebuild_rollups(conn=None):
+    """Recompute every rollup row from user_daily_tasks and the ledger in one pass; returns rows written."""
+    conn = conn or connect()
+    with transaction(conn):
+        return _rebuild_rollups(conn)
+
+def rollups_by_district(start, end, conn=None):
+    """[(district_id, assigned, assigned_risk_sum, completed, completed_risk_sum, points_issued)] for start <= date <= end."""
+    conn = conn or connect()
+    return conn.execute(SQL_ROLLUP_BY_DISTRICT, (start, end)).fetchall()
+
+def rollup_totals(start="", end="9999-12-31", conn=None):
+    """(assigned, assigned_risk_sum, completed, completed_risk_sum, points_issued) over all districts."""
+    conn = conn or connect()
+    return conn.execute(SQL_ROLLUP_TOTALS, (start, end)).fetchone()
+
+# --------------------
+# User Locations & Broadcast Queue
+# --------------------
+SQL_UPSERT_LOCATION = '''INSERT INTO user_locations (user_id, district_id, lat, lon) VALUES (?, ?, ?, ?)
+                         ON CONFLICT (user_id) DO UPDATE SET
+                           district_id = excluded.district_id, lat = excluded.lat, lon = excluded.lon,
+                           updated_at = datetime('now')
+                         WHERE district_id != excluded.district_id'''
+SQL_GET_USER_DISTRICT = "SELECT district_id FROM user_locations WHERE user_id=?"
+SQL_COUNT_RECIPIENTS = "SELECT COUNT(*) FROM user_locations WHERE district_id=?"
+SQL_CREATE_BROADCAST = "INSERT INTO broadcast_jobs (zone_id, message, created_at) VALUES (?, ?, ?)"
+SQL_GET_BROADCAST = '''SELECT id, zone_id, status, total, resolved, sent, failed, created_at, started_at, finished_at
+                       FROM broadcast_jobs WHERE id=?'''
+SQL_NEXT_UNRESOLVED = '''SELECT id, zone_id, total, resolve_cursor FROM broadcast_jobs
+                         WHERE status IN ('queued', 'running') AND resolved = 0 ORDER BY id LIMIT 1'''
+SQL_RESOLVE_CHUNK = '''INSERT INTO broadcast_deliveries (job_id, seq, user_id)
+                       SELECT ?, ? + row_number() OVER (ORDER BY user_id) - 1, user_id
+                       FROM (SELECT user_id FROM user_locations
+                             WHERE district_id = ? AND user_id > ? ORDER BY user_id LIMIT ?)'''
+SQL_NEXT_CLAIMABLE = '''SELECT id, next_seq, total FROM broadcast_jobs
+                        WHERE status = 'running' AND next_seq < total ORDER BY id LIMIT 1'''
+# Deliveries in a range that are pending and not leased to a live worker.
+_CLAIMABLE = "job_id=? AND seq >= ? AND seq < ? AND status='pending' AND (claimed_at IS NULL OR claimed_at < ?)"
+SQL_PENDING_DELIVERIES = f"SELECT seq, user_id FROM broadcast_deliveries WHERE {_CLAIMABLE}"
+SQL_LEASE_DELIVERIES = f"UPDATE broadcast_deliveries SET claimed_at=? WHERE {_CLAIMABLE}"
+SQL_FINISH_BROADCAST = '''UPDATE broadcast_jobs SET status='done', finished_at=?
+                          WHERE id=? AND status='running' AND resolved=1 AND sent + failed >= total'''
+
+def get_user_district(user_id, conn=None):
+    conn = conn or connect()
+    row = conn.execute(SQL_GET_USER_DISTRICT, (user_id,)).fetchone()
+    return row[0] if row else None
+
+def upsert_user_location(user_id, district_id, lat, lon, conn=None):
+    """
+    Record the district a user was last seen in. Unchanged districts cost a
+    read, not a write; returns whether anything was written.
+    """
+    conn = conn or connect()
+    if get_user_district(user_id, conn=conn) == district_id:
+        return False
+    conn.execute(SQL_UPSERT_LOCATION, (user_id, district_id, lat, lon))
+    return True
+
+def count_recipients(district_id, conn=None):
+    conn = conn or connect()
+    return conn.execute(SQL_COUNT_RECIPIENTS, (district_id,)).fetchone()[0]
+
+def create_broadcast(zone_id, message, created_at, conn=None):
+    conn = conn or connect()
+    return conn.execute(SQL_CREATE_BROADCAST, (zone_id, message, created_at)).lastrowid
+
+def get_broadcast(job_id, conn=None):
+    conn = conn or connect()
+    return conn.execute(SQL_GET_BROADCAST, (job_id,)).fetchone()
+
+def get_broadcast_message(job_id, conn=None):
+    conn = conn or connect()
+    return conn.execute("SELECT message FROM broadcast_jobs WHERE id=?", (job_id,)).fetchone()[0]
+
+def resolve_broadcast_chunk(chunk, now, conn=None):
+    """
+    Copy the next `chunk` recipients of the oldest unresolved job into
+    broadcast_deliveries. Returns (job_id, rows copied), or None if no job
+    needs resolving.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        job = conn.execute(SQL_NEXT_UNRESOLVED).fetchone()
+        if job is None:
+            return None
+        job_id, zone_id, total, cursor = job
+        n = conn.execute(SQL_RESOLVE_CHUNK, (job_id, total, zone_id, cursor, chunk)).rowcount
+        if n:
+            cursor = conn.execute("SELECT user_id FROM broadcast_deliveries WHERE job_id=? AND seq=?",
+                                  (job_id, total + n - 1)).fetchone()[0]
+        conn.execute('''UPDATE broadcast_jobs SET status='running', started_at=COALESCE(started_at, ?),
+                        total=total + ?, resolve_cursor=?, resolved=? WHERE id=?''',
+                     (now, n, cursor, int(n < chunk), job_id))
+        conn.execute(SQL_FINISH_BROADCAST, (now, job_id))
+        return job_id, n
+
+def claim_deliveries(batch_size, now, lease, conn=None):
+    """
+    Claim the next seq range of the oldest running job, leasing its pending
+    deliveries for `lease` seconds. Returns (job_id, lo, hi, [(seq,
+    user_id)] leased, lease token), or None. Deliveries leased by another
+    worker whose lease has not expired are skipped.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        job = conn.execute(SQL_NEXT_CLAIMABLE).fetchone()
+        if job is None:
+            return None
+        job_id, lo, total = job
+        hi = min(lo + batch_size, total)
+        conn.execute("UPDATE broadcast_jobs SET next_seq=? WHERE id=?", (hi, job_id))
+        args = (job_id, lo, hi, now - lease)
+        rows = conn.execute(SQL_PENDING_DELIVERIES, args).fetchall()
+        conn.execute(SQL_LEASE_DELIVERIES, (now, *args))
+    return job_id, lo, hi, rows, now
+
+def complete_deliveries(job_id, lo, hi, failed_seqs, token, now, conn=None):
+    """
+    Mark the deliveries leased with `token` in a claimed range delivered,
+    except failed_seqs; finishes the job when nothing is left.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        failed = conn.executemany(
+            "UPDATE broadcast_deliveries SET status='failed' WHERE job_id=? AND seq=? AND status='pending' AND claimed_at=?",
+            ((job_id, s, token) for s in failed_seqs),
+        ).rowcount if failed_seqs else 0
+        sent = conn.execute('''UPDATE broadcast_deliveries SET status='sent'
+                               WHERE job_id=? AND seq >= ? AND seq < ? AND status='pending' AND claimed_at=?''',
+                            (job_id, lo, hi, token)).rowcount
+        conn.execute("UPDATE broadcast_jobs SET sent=sent + ?, failed=failed + ? WHERE id=?", (sent, failed, job_id))
+        conn.execute(SQL_FINISH_BROADCAST, (now, job_id))
+    return sent, failed
+
+def recover_broadcasts(now, lease, conn=None):
+    """
+    Hand deliveries whose lease expired (their worker crashed or stopped)
+    back to the workers; ranges leased by live workers are left alone.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        return conn.execute('''UPDATE broadcast_jobs SET next_seq = COALESCE(
+                                  (SELECT MIN(seq) FROM broadcast_deliveries d
+                                   WHERE d.job_id = broadcast_jobs.id AND d.seq < broadcast_jobs.next_seq
+                                     AND d.status = 'pending' AND (d.claimed_at IS NULL OR d.claimed_at < ?)),
+                                  next_seq)
+                                WHERE status = 'running' ''', (now - lease,)).rowcount
+
+# --------------------
+# Photo Verification Jobs
+# --------------------
+# A failed (status 'error') job is re-queued when the same photo is submitted again.
+SQL_CREATE_VERIFICATION = '''INSERT INTO verification_jobs (user_id, task_id, date, image_hash, created_at)
+                             VALUES (?, ?, ?, ?, ?)
+                             ON CONFLICT (user_id, date, task_id, image_hash) DO UPDATE SET
+                               status = 'queued', message = NULL, created_at = excluded.created_at,
+                               started_at = NULL, finished_at = NULL
+                             WHERE status = 'error' '''
+SQL_FIND_VERIFICATION = "SELECT id FROM verification_jobs WHERE user_id=? AND date=? AND task_id=? AND image_hash=?"
+SQL_GET_VERIFICATION = '''SELECT id, user_id, task_id, date, image_hash, status, verified, points, message,
+                                 created_at, started_at, finished_at
+                          FROM verification_jobs WHERE id=?'''
+SQL_FINISH_VERIFICATION = '''UPDATE verification_jobs SET status=?, verified=?, points=?, message=?,
+                               started_at=?, finished_at=? WHERE id=?'''
+SQL_QUEUED_VERIFICATIONS = "SELECT id FROM verification_jobs WHERE status='queued' ORDER BY id"
+
+def create_verification(user_id, task_id, date_str, image_hash, created_at, conn=None):
+    """
+    (job id, queued) for a photo submission. queued is False when the
+    same photo was already submitted for this task and is pending or done.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        queued = conn.execute(SQL_CREATE_VERIFICATION, (user_id, task_id, date_str, image_hash, created_at)).rowcount > 0
+        job_id = conn.execute(SQL_FIND_VERIFICATION, (user_id, date_str, task_id, image_hash)).fetchone()[0]
+    return job_id, queued
+
+def get_verification(job_id, conn=None):
+    conn = conn or connect()
+    return conn.execute(SQL_GET_VERIFICATION, (job_id,)).fetchone()
+
+def finish_verification(job_id, status, verified, points, message, started_at, finished_at, conn=None):
+    conn = conn or connect()
+    conn.execute(SQL_FINISH_VERIFICATION, (status, verified, points, message, started_at, finished_at, job_id))
+
+def queued_verifications(conn=None):
+    """Ids of jobs that never got a result (e.g. the server stopped), oldest first."""
+    conn = conn or connect()
+    return [r[0] for r in conn.execute(SQL_QUEUED_VERIFICATIONS)]
+
+# --------------------
+# Points Ledger
+# --------------------
+SQL_LEDGER_INSERT = "INSERT OR IGNORE INTO points_ledger (user_id, delta, reason, ref) VALUES (?, ?, ?, ?)"
+SQL_BALANCE_CREDIT = '''INSERT INTO user_balances (user_id, balance, lifetime_points) VALUES (?, ?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                          balance = balance + excluded.balance,
+                          lifetime_points = lifetime_points + excluded.lifetime_points,
+                          updated_at = datetime('now')'''
+SQL_BALANCE_DEBIT = '''UPDATE user_balances SET balance = balance - ?, updated_at = datetime('now')
+                       WHERE user_id = ? AND balance >= ?'''
+SQL_GET_BALANCE = "SELECT balance, lifetime_points FROM user_balances WHERE user_id=?"
+SQL_LEADERBOARD = '''SELECT user_id, lifetime_points, balance FROM user_balances
+                     ORDER BY lifetime_points DESC, user_id LIMIT ?'''
+
+def _book(conn, user_id, delta, reason, ref):
+    """Append a credit to the ledger and the balance; no-op if (reason, ref) was already booked."""
+    if conn.execute(SQL_LEDGER_INSERT, (user_id, delta, reason, ref)).rowcount != 1:
+        return False
+    conn.execute(SQL_BALANCE_CREDIT, (user_id, delta, max(delta, 0)))
+    return True
+
+def get_balance(user_id, conn=None):
+    conn = conn or connect()
+    row = conn.execute(SQL_GET_BALANCE, (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def redeem(user_id, cost, ref, conn=None):
+    """
+    Atomically deduct `cost` if the balance covers it.
+
+    Returns the new balance, or None if the balance is insufficient.
+    """
+    conn = conn or connect()
+    with transaction(conn):
+        if conn.execute(SQL_BALANCE_DEBIT, (cost, user_id, cost)).rowcount != 1:
+            return None
+        conn.execute(SQL_LEDGER_INSERT, (user_id, -cost, "redeem", ref))
+        return conn.execute(SQL_GET_BALANCE, (user_id,)).fetchone()[0]
+
+def leaderboard(limit=10, conn=None):
+    conn = conn or connect()
+    return conn.execute(SQL_LEADERBOARD, (limit,)).fetchall()
+
+def backfill_ledger(points_by_task, conn=None):
+    """
+    One-off: credit tasks completed before the ledger existed.
+
+    Runs once per database (recorded in app_meta) in a single set-based pass.
+    """
+    conn = conn or connect()
+    if conn.execute("SELECT 1 FROM app_meta WHERE key='ledger_backfilled'").fetchone():
+        return 0
+    with transaction(conn):
+        # Claim the backfill under the write lock: of processes starting
+        # together, only the first gets here with the marker still unset.
+        if not conn.execute("INSERT OR IGNORE INTO app_meta VALUES ('ledger_backfilled', datetime('now'))").rowcount:
+            return 0
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS task_points (task_id TEXT PRIMARY KEY, points INTEGER)")
+        conn.execute("DELETE FROM temp.task_points")
+        conn.executemany("INSERT INTO temp.task_points VALUES (?, ?)", points_by_task.items())
+        n = conn.execute('''INSERT OR IGNORE INTO points_ledger (user_id, delta, reason, ref)
+                            SELECT t.user_id, p.points, 'task', t.date || ':' || t.task_id
+                            FROM user_daily_tasks t JOIN temp.task_points p USING (task_id)
+                            WHERE t.status = 'completed' AND p.points > 0''').rowcount
+        conn.execute('''INSERT INTO user_balances (user_id, balance, lifetime_points)
+                        SELECT user_id, SUM(delta), SUM(MAX(delta, 0)) FROM points_ledger GROUP BY user_id
+                        ON CONFLICT (user_id) DO UPDATE SET
+                          balance = excluded.balance, lifetime_points = excluded.lifetime_points''')
+    return n
+
+# --------------------
+# Forecast Runs
+# --------------------
+SQL_SAVE_FORECAST_RUN = '''INSERT INTO forecast_runs (created_at, base_date, model_version, districts, horizon, risks)
+                           VALUES (?, ?, ?, ?, ?, ?)'''
+SQL_PRUNE_FORECAST_RUNS = "DELETE FROM forecast_runs WHERE id <= (SELECT id FROM forecast_runs ORDER BY id DESC LIMIT 1 OFFSET ?)"
+SQL_LATEST_FORECAST_RUNS = '''SELECT id, created_at, base_date, model_version, districts, horizon, risks
+                              FROM forecast_runs ORDER BY id DESC LIMIT ?'''
+
+def save_forecast_run(created_at, base_date, model_version, districts_json, horizon, risks, keep=None, conn=None):
+    """Store a run and drop all but the newest `keep` runs; returns the new run id."""
+    conn = conn or connect()
+    with transaction(conn):
+        run_id = conn.execute(
+            SQL_SAVE_FORECAST_RUN, (created_at, base_date, model_version, districts_json, horizon, risks)
+        ).lastrowid
+        if keep:
+            conn.execute(SQL_PRUNE_FORECAST_RUNS, (keep,))
+    return run_id
+
+def latest_forecast_runs(n=2, conn=None):
+    """The newest n runs, newest first, as rows of SQL_LATEST_FORECAST_RUNS."""
+    conn = conn or connect()
+    return conn.execute(SQL_LATEST_FORECAST_RUNS, (n,)).fetchall()
+
+# --------------------
+# Load Test
+# --------------------
+def load_test(path, rows=2_000_000, writers=8, readers=8, seconds=10):
+    """
+    Seed `rows` task rows, then run concurrent assign+complete writers and
+    point-lookup readers against them and report throughput.
+    """
+    import datetime
+    import random
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    conn = connect(path)
+    days = [(datetime.date(2025, 1, 1) + datetime.timedelta(days=d)).isoformat() for d in range(365)]
+    n_users = max(1, rows // len(days))
+
+    start = time.perf_counter()
+    batch = 100_000
+    for lo in range(0, rows, batch):
+        with transaction(conn):
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_daily_tasks (user_id, date, task_id, status, risk_level_at_assignment) VALUES (?, ?, ?, ?, ?)",
+                ((f"u{i % n_users}", days[i // n_users % len(days)], "T1", "completed", 50.0)
+                 for i in range(lo, min(rows, lo + batch))),
+            )
+    seed_s = time.perf_counter() - start
+    total = conn.execute("SELECT COUNT(*) FROM user_daily_tasks").fetchone()[0]
+    print(f"seeded {total:,} rows in {seed_s:.1f}s ({total / seed_s:,.0f} rows/s)")
+
+    stop = time.monotonic() + seconds
+    counts = {"writes": 0, "reads": 0}
+    lock = threading.Lock()
+    today = datetime.date(2026, 1, 1).isoformat()
+
+    def writer(w):
+        c = connect(path)
+        n = 0
+        while time.monotonic() < stop:
+            user = f"load-{w}-{n}"
+            assign_task(user, "T1", today, 80.0, conn=c)
+            complete_task(user, "T1", today, conn=c)
+            n += 2
+        with lock:
+            counts["writes"] += n
+
+    def reader(r):
+        c = connect(path)
+        rnd = random.Random(r)
+        n = 0
+        while time.monotonic() < stop:
+            get_task(f"u{rnd.randrange(n_users)}", rnd.choice(days), conn=c)
+            n += 1
+        with lock:
+            counts["reads"] += n
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"{writers} writers: {counts['writes'] / seconds:,.0f} writes/s")
+    print(f"{readers} readers: {counts['reads'] / seconds:,.0f} lookups/s")
+
+
+def ledger_load_test(path, users=1_000_000, ledger_rows=10_000_000, ops=20_000):
+    """Seed a ledger/balances at scale and time credit, redeem, balance and leaderboard calls."""
+    import random
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = connect(path)
+
+    start = time.perf_counter()
+    batch = 200_000
+    for lo in range(0, ledger_rows, batch):
+        with transaction(conn):
+            conn.executemany(
+                "INSERT INTO points_ledger (user_id, delta, reason, ref) VALUES (?, 10, 'task', ?)",
+                ((f"u{i % users}", str(i)) for i in range(lo, min(ledger_rows, lo + batch))),
+            )
+    with transaction(conn):
+        conn.execute('''INSERT INTO user_balances (user_id, balance, lifetime_points)
+                        SELECT user_id, SUM(delta), SUM(delta) FROM points_ledger GROUP BY user_id''')
+    print(f"seeded {ledger_rows:,} ledger rows / {users:,} users in {time.perf_counter() - start:.1f}s")
+
+    rnd = random.Random(0)
+    timings = {}
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        for i in range(ops):
+            fn(i)
+        timings[name] = (time.perf_counter() - start) / ops * 1e6
+
+    def credit(i):
+        with transaction(conn):
+            _book(conn, f"u{rnd.randrange(users)}", 10, "task", f"bench-{i}")
+
+    timed("credit", credit)
+    timed("redeem", lambda i: redeem(f"u{rnd.randrange(users)}", 5, f"bench-r{i}", conn=conn))
+    timed("balance", lambda i: get_balance(f"u{rnd.randrange(users)}", conn=conn))
+    timed("leaderboard", lambda i: leaderboard(10, conn=conn))
+    for name, us in timings.items():
+        print(f"{name:<12}{us:>10.1f} us/op")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="user_daily_tasks / points ledger load test")
+    parser.add_argument("--db", default="loadtest.db")
+    parser.add_argument("--ledger", action="store_true", help="run the points ledger test instead")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--ledger-rows", type=int, default=10_000_000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    if args.ledger:
+        ledger_load_test(args.db, args.users, args.ledger_rows)
+    else:
+        load_test(args.db, args.rows, args.writers, args.readers, args.seconds)
@@ -1,6 +1,159 @@
+"""
+Ensemble stage: blends the ML prediction with the rule-based score and a
+weather-trend score.
+
+    risk = w_ml * ml + w_rule * rule + w_trend * trend + intercept
+
+Weights come from the model's metadata ("ensemble", fitted by stacking in
+train_model.py) or from ENSEMBLE_WEIGHTS. Scoring is one matrix product
+over all N locations.
+
+    ENSEMBLE_WEIGHTS=fitted            # default: model metadata, else ML only
+    ENSEMBLE_WEIGHTS=off               # ML only
+    ENSEMBLE_WEIGHTS=0.5,0.3,0.2[,b]   # fixed ml, rule, trend weights (+ intercept)
+"""
+import os
+import time
+
+import numpy as np
+
+from feature_engineering import FEATURES
+from risk_engine import rule_based_predict_batch
+
+ENSEMBLE_WEIGHTS = os.getenv("ENSEMBLE_WEIGHTS", "fitted")
+
+COMPONENTS = ["ml", "rule", "trend"]
+DEFAULT_WEIGHTS = (0.5, 0.3, 0.2)
+
+# Trend score: 50 is flat weather; points per °C/day and per mm/day of change.
+TREND_TEMP_SCALE = 5.0
+TREND_RAIN_SCALE = 0.25
+
+# --------------------
+# Component Scores
+# --------------------
+def rule_scores(raw):
+    """Noise-free rule-based risk (10-95) for an (N, 4) raw weather matrix."""
+    return rule_based_predict_batch(raw, noise=False).astype(np.float64)
+
+def trend_scores(engineered):
+    """0-100 trend score from the day-over-day trends of an (N, len(FEATURES)) matrix."""
+    engineered = np.asarray(engineered, dtype=np.float64)
+    temp = engineered[:, FEATURES.index("temp_trend")]
+    rain = engineered[:, FEATURES.index("rain_trend")]
+    return np.clip(50 + TREND_TEMP_SCALE * temp + TREND_RAIN_SCALE * rain, 0, 100)
+
+# --------------------
+# Scoring
+# --------------------
 def ensemble_predict(ml_risk, rule_risk, trend_score):
+    """Scalar blend with the default weights."""
     return int(
         0.5 * ml_risk +
         0.3 * rule_risk +
         0.2 * trend_score
     )
+
+class Ensemble:
+    """Fixed blend weights; predict() scores arrays of N components at once."""
+
+    def __init__(self, weights=DEFAULT_WEIGHTS, intercept=0.0, source="default"):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.source = source
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """Ensemble fitted at training time, or None if the model has none."""
+        fitted = (metadata or {}).get("ensemble")
+        if not fitted:
+            return None
+        return cls([fitted["weights"][c] for c in COMPONENTS], fitted.get("intercept", 0.0), "fitted")
+
+    @classmethod
+    def parse_setting(cls, setting):
+        """"off", "fitted" or a fixed Ensemble for an ENSEMBLE_WEIGHTS value; ValueError if malformed."""
+        setting = setting.strip().lower()
+        if setting in ("off", "fitted"):
+            return setting
+        try:
+            values = [float(v) for v in setting.split(",")]
+        except ValueError:
+            values = []
+        if len(values) not in (3, 4):
+            raise ValueError(f"ENSEMBLE_WEIGHTS needs 3 weights (+ intercept), got {setting!r}")
+        return cls(values[:3], values[3] if len(values) == 4 else 0.0, "env")
+
+    @classmethod
+    def configured(cls, metadata=None, setting=None):
+        """Ensemble selected by ENSEMBLE_WEIGHTS for a model's metadata; None means ML only."""
+        parsed = _SETTING if setting is None else cls.parse_setting(setting)
+        if parsed == "off":
+            return None
+        if parsed == "fitted":
+            return cls.from_metadata(metadata)
+        return parsed
+
+    def predict(self, ml, rule, trend):
+        """Int risk (0-100) for arrays of ML, rule and trend scores."""
+        stacked = np.column_stack([ml, rule, trend]).astype(np.float64, copy=False)
+        return np.clip(stacked @ self.weights + self.intercept, 0, 100).astype(int)
+
+    def score(self, ml, raw, engineered):
+        """predict() with rule and trend scores computed from the inputs."""
+        return self.predict(ml, rule_scores(raw), trend_scores(engineered))
+
+    def describe(self):
+        return {
+            "source": self.source,
+            "weights": {c: round(float(w), 4) for c, w in zip(COMPONENTS, self.weights)},
+            "intercept": round(self.intercept, 4),
+        }
+
+# Parsed once at import, so a malformed ENSEMBLE_WEIGHTS fails at startup.
+_SETTING = Ensemble.parse_setting(ENSEMBLE_WEIGHTS)
+
+# --------------------
+# Stacking
+# --------------------
+def fit_weights(ml, rule, trend, y):
+    """
+    Stacking: non-negative least-squares weights for the components, plus
+    a free intercept, fitted on predictions the model did not train on.
+    """
+    from scipy.optimize import nnls
+
+    Z = np.column_stack([ml, rule, trend]).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Center so the intercept is unconstrained while the weights stay >= 0.
+    z_mean, y_mean = Z.mean(axis=0), y.mean()
+    weights, _ = nnls(Z - z_mean, y - y_mean)
+    return Ensemble(weights, y_mean - z_mean @ weights, "fitted")
+
+# --------------------
+# Benchmark
+# --------------------
+def benchmark(sizes=(10, 1_000, 100_000), loop_sample=20_000):
+    """Per-row cost of calling ensemble_predict in a loop vs. one Ensemble.predict."""
+    rng = np.random.default_rng(0)
+    ensemble = Ensemble()
+
+    print(f"{'N':>9}{'loop us/row':>14}{'batch us/row':>15}{'speedup':>10}")
+    for n in sizes:
+        ml, rule, trend = rng.uniform(0, 100, (3, n))
+        k = min(n, loop_sample)
+
+        start = time.perf_counter()
+        for i in range(k):
+            ensemble_predict(ml[i], rule[i], trend[i])
+        loop_us = (time.perf_counter() - start) / k * 1e6
+
+        start = time.perf_counter()
+        ensemble.predict(ml, rule, trend)
+        batch_us = (time.perf_counter() - start) / n * 1e6
+
+        print(f"{n:>9}{loop_us:>14.2f}{batch_us:>15.3f}{loop_us / batch_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,16 +1,206 @@
+"""
+Risk explanations for batches of predictions.
+
+Two parts, both computed for every row in one vectorized pass:
+- reasons: plain-language strings from threshold rules on the raw weather
+  and, when available, the engineered 7/14-day features;
+- contributions: how much each model input moved the score. For tree
+  ensembles these are tree-path attributions (tree_inference.FlatEnsemble
+  .contributions); for the rule-based scorer they are the points each rule
+  added. When an ensemble blends the ML score with rule and trend scores,
+  the attributions are scaled by the ML weight and the weighted rule and
+  trend scores are added as "rule_score" and "trend_score", so base plus
+  contributions is the blended score before clipping.
+
+Explanations are cached per (model version, input row), so repeated
+requests for a grid cell whose weather is cached cost a dict lookup.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ensemble import rule_scores, trend_scores
+from risk_engine import RAW_FEATURES, rule_components
+
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", 4096))
+
+# (input, comparison, threshold, message). Inputs are RAW_FEATURES or
+# feature_engineering.FEATURES names; rules on inputs a row lacks are skipped.
+REASONS = [
+    ("temp_avg_7d", ">", 28, "High average temperature increased mosquito activity"),
+    ("rain_sum_14d", ">", 100, "Recent heavy rainfall created breeding sites"),
+    ("humidity_avg_7d", ">", 75, "High humidity prolonged mosquito survival"),
+    ("temp_trend", ">", 1, "Warming trend accelerating transmission risk"),
+    ("temp", "between", (25, 30), "Temperature is in the ideal range for mosquito breeding"),
+    ("rainfall", ">", 150, "Heavy rainfall is filling breeding sites"),
+    ("humidity", ">", 75, "High humidity is prolonging mosquito survival"),
+    ("salinity", ">", 2, "Salinity is high enough to limit Aedes breeding"),
+]
+
+# --------------------
+# Reasons
+# --------------------
+def reason_masks(columns):
+    """
+    columns: {input name: (N,) array}. Returns (messages, (N, R) bool mask)
+    for the rules whose input is present.
+    """
+    messages, masks = [], []
+    for name, op, threshold, message in REASONS:
+        col = columns.get(name)
+        if col is None:
+            continue
+        if op == ">":
+            masks.append(col > threshold)
+        else:
+            masks.append((col >= threshold[0]) & (col <= threshold[1]))
+        messages.append(message)
+    n = len(next(iter(columns.values()))) if columns else 0
+    return messages, (np.column_stack(masks) if masks else np.zeros((n, 0), dtype=bool))
+
 def explain_risk(features):
-    explanations = []
+    """Reasons for a single dict of features (either feature set)."""
+    columns = {k: np.array([v], dtype=np.float64) for k, v in features.items() if k in {r[0] for r in REASONS}}
+    messages, mask = reason_masks(columns)
+    return [m for m, hit in zip(messages, mask[0]) if hit] if len(mask) else []
+
+# --------------------
+# Contributions
+# --------------------
+def contributions(model, X, version=None):
+    """
+    (method, bias (N,), contributions (N, F)) for the matrix the model scored.
+
+    model: FlatEnsemble, a supported sklearn ensemble, or None (rules; X is
+    then the raw (N, 4) matrix). version: the model's registry version; its
+    flattened trees are kept until clear_flat_cache(), else rebuilt per call.
+    """
+    if model is None:
+        return "rules", np.zeros(len(X)), rule_components(X).astype(np.float64)
+    from tree_inference import FlatEnsemble
+
+    flat = model if isinstance(model, FlatEnsemble) else _flat_for(model, version)
+    if flat is None:
+        return None, None, None
+    bias, contrib = flat.contributions(X)
+    return "tree_path", bias, contrib
+
+_flat_lock = threading.Lock()
+# registry version -> FlatEnsemble, or None if the model cannot be flattened
+_flat_cache = {}
+
+def _flatten(model):
+    # Attributions only need the node arrays, not bit-exact predictions, so
+    # models compile_model rejected can still be explained.
+    from tree_inference import FlatEnsemble
+
+    try:
+        return FlatEnsemble.from_model(model)
+    except (TypeError, AttributeError, ValueError):
+        return None
+
+def _flat_for(model, version):
+    if version is None:
+        return _flatten(model)
+    with _flat_lock:
+        if version not in _flat_cache:
+            _flat_cache[version] = _flatten(model)
+        return _flat_cache[version]
+
+def clear_flat_cache():
+    with _flat_lock:
+        _flat_cache.clear()
+
+def blend_contributions(ensemble, bias, contrib, names, raw, engineered):
+    """Attributions of the ML score turned into attributions of the ensemble's blended score."""
+    w_ml, w_rule, w_trend = ensemble.weights
+    extra = np.column_stack([w_rule * rule_scores(raw), w_trend * trend_scores(engineered)])
+    return w_ml * bias + ensemble.intercept, np.hstack([w_ml * contrib, extra]), list(names) + ["rule_score", "trend_score"]
+
+def explain_batch(raw, model=None, X=None, feature_names=None, ensemble=None, engineered=None, version=None):
+    """
+    One explanation dict per row.
+
+    raw: (N, 4) weather in RAW_FEATURES order. X/feature_names: the matrix
+    the model scored and its column names (default: raw, RAW_FEATURES).
+    ensemble/engineered: the Ensemble blending the model's score, and the
+    engineered features its trend score reads. version: the model's
+    registry version (see contributions).
+    """
+    raw = np.asarray(raw, dtype=np.float64).reshape(-1, len(RAW_FEATURES))
+    X = raw if X is None else np.asarray(X, dtype=np.float64)
+    feature_names = list(feature_names or RAW_FEATURES)
+
+    columns = {name: raw[:, j] for j, name in enumerate(RAW_FEATURES)}
+    columns.update({name: X[:, j] for j, name in enumerate(feature_names)})
+    messages, mask = reason_masks(columns)
+    method, bias, contrib = contributions(model, raw if model is None else X, version)
+    names = RAW_FEATURES if model is None else feature_names
+    if ensemble is not None and model is not None and method is not None:
+        bias, contrib, names = blend_contributions(ensemble, bias, contrib, names, raw, engineered)
+        method += "+ensemble"
+
+    out = []
+    for i in range(len(raw)):
+        entry = {"reasons": [messages[j] for j in np.flatnonzero(mask[i])], "method": method}
+        if method is not None:
+            entry["base"] = round(float(bias[i]), 2)
+            entry["contributions"] = {n: round(float(c), 2) for n, c in zip(names, contrib[i])}
+        out.append(entry)
+    return out
 
-    if features["temp_avg_7d"] > 28:
-        explanations.append("High average temperature increased mosquito activity")
+# --------------------
+# Cache
+# --------------------
+class ExplanationCache:
+    """LRU of explanations keyed by (model version, scored input row)."""
 
-    if features["rain_sum_14d"] > 100:
-        explanations.append("Recent heavy rainfall created breeding sites")
+    def __init__(self, max_entries=EXPLAIN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-    if features["humidity_avg_7d"] > 75:
-        explanations.append("High humidity prolonged mosquito survival")
+    def explain(self, version, raw, model=None, X=None, feature_names=None, ensemble=None, engineered=None):
+        """explain_batch with per-row caching; only uncached rows are computed."""
+        raw = np.asarray(raw, dtype=np.float64).reshape(-1, len(RAW_FEATURES))
+        scored = raw if X is None else np.asarray(X, dtype=np.float64)
+        if ensemble is not None:
+            engineered = np.asarray(engineered, dtype=np.float64)
+            # The trend score reads engineered features the scored row may not contain.
+            keys = [(version, r.tobytes(), s.tobytes(), e.tobytes()) for r, s, e in zip(raw, scored, engineered)]
+        else:
+            keys = [(version, r.tobytes(), s.tobytes()) for r, s in zip(raw, scored)]
+        out = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    out[i] = entry
+            self.hits += sum(e is not None for e in out)
+        missing = [i for i, e in enumerate(out) if e is None]
+        if missing:
+            fresh = explain_batch(raw[missing], model, None if X is None else scored[missing], feature_names,
+                                  ensemble, None if ensemble is None else engineered[missing], version)
+            with self._lock:
+                self.misses += len(missing)
+                for i, entry in zip(missing, fresh):
+                    out[i] = entry
+                    self._entries[keys[i]] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return out
 
-    if features["temp_trend"] > 1:
-        explanations.append("Warming trend accelerating transmission risk")
+    def clear(self):
+        """Drop cached explanations and flattened trees (call when the active model changes)."""
+        with self._lock:
+            self._entries.clear()
+        clear_flat_cache()
 
-    return explanations
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+# --------------------
+# Configuration
+# --------------------
+DISTRICTS_FILE = os.getenv(
+    "DISTRICTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "districts.json")
+)
+# Overall time budget for one fan-out, in seconds.
+FANOUT_DEADLINE = float(os.getenv("FANOUT_DEADLINE", 6))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", 32))
+# Maximum concurrent requests to any single upstream host.
+FANOUT_PER_HOST = int(os.getenv("FANOUT_PER_HOST", 8))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+_host_limits = {}
+_host_lock = threading.Lock()
+
+# --------------------
+# District Config
+# --------------------
+_districts = None
+
+def load_districts(path=None):
+    """Districts from DISTRICTS_FILE (list of {name, id, center, pop[, coastal]})."""
+    global _districts
+    if path is None and _districts is not None:
+        return _districts
+    with open(path or DISTRICTS_FILE, encoding="utf-8") as f:
+        districts = json.load(f)
+    if path is None:
+        _districts = districts
+    return districts
+
+# --------------------
+# Concurrent Fetch
+# --------------------
+def host_limit(url_or_host):
+    host = urlparse(url_or_host).netloc or url_or_host
+    with _host_lock:
+        sem = _host_limits.get(host)
+        if sem is None:
+            sem = _host_limits[host] = threading.BoundedSemaphore(FANOUT_PER_HOST)
+        return sem
+
+def fetch_all(points, fetch, host, deadline=FANOUT_DEADLINE):
+    """
+    Call fetch(lat, lon) for every (lat, lon) in points concurrently.
+
+    At most FANOUT_PER_HOST calls to `host` run at once, and the whole
+    fan-out returns after `deadline` seconds at the latest. Results are
+    aligned with points; anything that failed, raised or missed the
+    deadline is None so callers can substitute a fallback per point.
+    """
+    if not points:
+        return []
+
+    end = time.monotonic() + deadline
+    sem = host_limit(host)
+
+    def task(lat, lon):
+        if not sem.acquire(timeout=max(0.0, end - time.monotonic())):
+            return None
+        try:
+            if time.monotonic() >= end:
+                return None
+            return fetch(lat, lon)
+        finally:
+            sem.release()
+
+    futures = [_executor.submit(task, lat, lon) for lat, lon in points]
+    wait(futures, timeout=max(0.0, end - time.monotonic()))
+
+    results = []
+    for f in futures:
+        if f.done() and not f.cancelled() and f.exception() is None:
+            results.append(f.result())
+        else:
+            f.cancel()
+            results.append(None)
+    return results
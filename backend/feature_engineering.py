@@ -1,19 +1,239 @@
+"""
+Feature pipeline shared by training (train_model.py) and serving (app.py).
+
+Input is a matrix of daily observations in CHANNELS order; output is the
+engineered matrix in FEATURES order that the trained models expect:
+
+    temp_avg_7d      mean temperature over the last 7 days
+    humidity_avg_7d  mean humidity over the last 7 days
+    rain_sum_14d     total rainfall over the last 14 days
+    temp_trend       temperature change since the previous day
+    rain_trend       rainfall change since the previous day
+    salinity_flag    today's salinity
+
+Windows shorter than their length (a location's first days) average over
+the days seen so far, like pandas rolling(min_periods=1); trends are 0 on
+a location's first day.
+"""
+import threading
+
 import numpy as np
 
+from risk_engine import RAW_FEATURES
+
+CHANNELS = RAW_FEATURES
+FEATURES = [
+    "temp_avg_7d",
+    "humidity_avg_7d",
+    "rain_sum_14d",
+    "temp_trend",
+    "rain_trend",
+    "salinity_flag",
+]
+WINDOW = 14
+SHORT_WINDOW = 7
+
+_TEMP, _RAIN, _HUM, _SAL = (CHANNELS.index(c) for c in ("temp", "rainfall", "humidity", "salinity"))
+
+# --------------------
+# Batch Mode (training, backfills)
+# --------------------
+def rolling_features(X, groups=None):
+    """
+    Engineered (N, 6) matrix for an (N, 4) matrix of daily observations.
+
+    groups: optional location id per row; windows never cross locations.
+    Rows must be in time order within each location. Every window is a
+    difference of prefix sums, so the whole matrix costs O(N).
+    """
+    X = np.asarray(X, dtype=np.float64).reshape(-1, len(CHANNELS))
+    n = len(X)
+    order = None
+    if groups is not None:
+        groups = np.asarray(groups)
+        order = np.argsort(groups, kind="stable")
+        X, groups = X[order], groups[order]
+        first = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if n else np.zeros(0, dtype=np.int64)
+        start = np.repeat(first, np.diff(np.r_[first, n]))
+    else:
+        start = np.zeros(n, dtype=np.int64)
+
+    idx = np.arange(n)
+    csum = np.vstack([np.zeros((1, X.shape[1])), np.cumsum(X, axis=0)])
+
+    def window(col, width):
+        lo = np.maximum(idx + 1 - width, start)
+        return csum[idx + 1, col] - csum[lo, col], idx + 1 - lo
+
+    temp_sum, days_7 = window(_TEMP, SHORT_WINDOW)
+    hum_sum, _ = window(_HUM, SHORT_WINDOW)
+    rain_sum, _ = window(_RAIN, WINDOW)
+
+    has_prev = idx > start
+    prev = np.where(has_prev, idx - 1, idx)
+
+    out = np.column_stack([
+        temp_sum / days_7,
+        hum_sum / days_7,
+        rain_sum,
+        np.where(has_prev, X[:, _TEMP] - X[prev, _TEMP], 0.0),
+        np.where(has_prev, X[:, _RAIN] - X[prev, _RAIN], 0.0),
+        X[:, _SAL],
+    ])
+    if order is not None:
+        unsorted = np.empty_like(out)
+        unsorted[order] = out
+        out = unsorted
+    return out
+
 def engineer_features(weather_history):
     """
-    weather_history: list of dicts (last 14 days)
-    """
-    temps = np.array([d['temp'] for d in weather_history])
-    rains = np.array([d['rainfall'] for d in weather_history])
-    hums = np.array([d['humidity'] for d in weather_history])
-
-    features = {
-        "temp_avg_7d": temps[-7:].mean(),
-        "humidity_avg_7d": hums[-7:].mean(),
-        "rain_sum_14d": rains.sum(),
-        "temp_trend": temps[-1] - temps[0],
-        "rain_trend": rains[-7:].sum() - rains[:7].sum(),
-        "salinity_flag": weather_history[-1].get("salinity", 0.5)
-    }
-    return features
+    weather_history: list of dicts (oldest first, up to the last 14 days)
+    Returns the feature dict for the most recent day.
+    """
+    X = np.array([[d.get(c, 0.5 if c == "salinity" else 0) for c in CHANNELS] for d in weather_history])
+    return dict(zip(FEATURES, rolling_features(X)[-1].tolist()))
+
+class PipelineModel:
+    """
+    Wraps a model trained on FEATURES so it scores raw (N, 4) observation
+    matrices; each row is treated as a location with no earlier history.
+    Used where no per-location history exists (heatmap tiles).
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(CHANNELS))
+        return self.model.predict(rolling_features(X, groups=np.arange(len(X))))
+
+# --------------------
+# Online Mode (serving)
+# --------------------
+class FeatureHistory:
+    """
+    Rolling per-location state for online scoring.
+
+    Each location owns a WINDOW-day ring buffer plus running window sums,
+    so adding an observation and reading its features is O(1) per location,
+    and update()/peek() are vectorized over any number of locations.
+    Locations are arbitrary hashable keys (weather grid cell, district id).
+    """
+
+    def __init__(self, capacity=256):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._buf = np.zeros((capacity, WINDOW, len(CHANNELS)))
+        self._pos = np.zeros(capacity, dtype=np.int64)  # next slot to write
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._day = np.full(capacity, np.iinfo(np.int64).min, dtype=np.int64)
+        self._sums = np.zeros((capacity, 3))  # temp 7d, humidity 7d, rain 14d
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _lookup(self, keys, create=True):
+        # Row of each key; unknown keys get a new row, or -1 if not create.
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is None:
+                if not create:
+                    rows[i] = -1
+                    continue
+                row = self._rows[key] = len(self._rows)
+                if row == len(self._pos):
+                    self._grow()
+            rows[i] = row
+        if len(set(keys)) != len(keys):
+            raise ValueError("duplicate location keys in one batch")
+        return rows
+
+    def _grow(self):
+        size = len(self._pos)
+        self._buf = np.concatenate([self._buf, np.zeros_like(self._buf)])
+        self._pos = np.concatenate([self._pos, np.zeros(size, dtype=np.int64)])
+        self._count = np.concatenate([self._count, np.zeros(size, dtype=np.int64)])
+        self._day = np.concatenate([self._day, np.full(size, np.iinfo(np.int64).min, dtype=np.int64)])
+        self._sums = np.concatenate([self._sums, np.zeros_like(self._sums)])
+
+    def _step(self, rows, days, X, commit):
+        buf, pos, count = self._buf, self._pos[rows], self._count[rows]
+        # A second reading for the same day replaces that day's slot.
+        same_day = (self._day[rows] == days) & (count > 0)
+        last = (pos - 1) % WINDOW
+        slot = np.where(same_day, last, pos)
+        new_count = np.where(same_day, count, np.minimum(count + 1, WINDOW))
+
+        # Values leaving each window: the replaced reading, or the one
+        # SHORT_WINDOW / WINDOW days back once the window is full.
+        old = buf[rows, slot]
+        back_7 = np.where((count >= SHORT_WINDOW)[:, None], buf[rows, (slot - SHORT_WINDOW) % WINDOW], 0.0)
+        out_7 = np.where(same_day[:, None], old, back_7)
+        out_14 = np.where((same_day | (count >= WINDOW))[:, None], old, 0.0)
+
+        sums = self._sums[rows] + np.column_stack([
+            X[:, _TEMP] - out_7[:, _TEMP],
+            X[:, _HUM] - out_7[:, _HUM],
+            X[:, _RAIN] - out_14[:, _RAIN],
+        ])
+        has_prev = new_count > 1
+        prev = buf[rows, (slot - 1) % WINDOW]
+        days_7 = np.minimum(new_count, SHORT_WINDOW)
+
+        features = np.column_stack([
+            sums[:, 0] / days_7,
+            sums[:, 1] / days_7,
+            sums[:, 2],
+            np.where(has_prev, X[:, _TEMP] - prev[:, _TEMP], 0.0),
+            np.where(has_prev, X[:, _RAIN] - prev[:, _RAIN], 0.0),
+            X[:, _SAL],
+        ])
+        if commit:
+            buf[rows, slot] = X
+            self._pos[rows] = (slot + 1) % WINDOW
+            self._count[rows] = new_count
+            self._day[rows] = days
+            self._sums[rows] = sums
+        return features
+
+    def update(self, keys, days, X):
+        """
+        Record one observation per location and return its features.
+
+        keys: unique location keys; days: day number of each observation
+        (e.g. date.toordinal()), non-decreasing per location; X: (N, 4).
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(CHANNELS))
+        days = np.broadcast_to(np.asarray(days, dtype=np.int64), len(X))
+        with self._lock:
+            return self._step(self._lookup(keys), days, X, commit=True)
+
+    def peek(self, keys, days, X):
+        """
+        Features as if X were recorded for `days`, without changing any state.
+        Locations never updated are scored as having no history.
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(CHANNELS))
+        days = np.broadcast_to(np.asarray(days, dtype=np.int64), len(X))
+        with self._lock:
+            rows = self._lookup(keys, create=False)
+            known = rows >= 0
+            if known.all():
+                return self._step(rows, days, X, commit=False)
+            features = rolling_features(X[~known], groups=np.arange((~known).sum()))
+            out = np.empty((len(X), features.shape[1]))
+            out[~known] = features
+            if known.any():
+                out[known] = self._step(rows[known], days[known], X[known], commit=False)
+            return out
+
+    def stats(self):
+        with self._lock:
+            n = len(self._rows)
+            return {
+                "locations": n,
+                "full_windows": int((self._count[:n] == WINDOW).sum()),
+                "capacity": len(self._pos),
+            }
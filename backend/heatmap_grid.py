@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from fanout import fetch_all
+from risk_engine import RAW_FEATURES, predict_risk_batch
+from weather import OPENWEATHER_BASE_URL, get_forecast_weather, get_real_weather
+from weather_cache import WEATHER_CACHE_TTL
+
+# --------------------
+# Configuration
+# --------------------
+DEFAULT_BBOX = (5.03, 102.78, 15.03, 108.78)  # min_lat, min_lon, max_lat, max_lon
+DEFAULT_RESOLUTION = 0.2
+HEATMAP_MAX_CELLS = int(os.getenv("HEATMAP_MAX_CELLS", 500_000))
+HEATMAP_TILE_CACHE = int(os.getenv("HEATMAP_TILE_CACHE", 512))
+HEATMAP_TILE_TTL = float(os.getenv("HEATMAP_TILE_TTL", WEATHER_CACHE_TTL))
+
+# Each tile is TILE_CELLS x TILE_CELLS grid points on a lattice aligned to
+# multiples of the resolution, so overlapping requests share tiles.
+TILE_CELLS = 128
+# Weather is sampled on a coarse anchor lattice and bilinearly interpolated.
+ANCHOR_SPACING = 0.25
+ANCHORS_PER_TILE = 8
+
+
+class HeatmapError(ValueError):
+    pass
+
+# --------------------
+# Weather Field
+# --------------------
+def simulated_weather(lats, lons, date_offset):
+    """Smooth deterministic stand-in used when no upstream weather is available."""
+    rng = np.random.default_rng(42 + date_offset)
+    p = rng.uniform(0, 2 * np.pi, 4)
+    return np.stack([
+        28.5 + 2.5 * np.sin(lats * 1.3 + p[0]) * np.cos(lons * 0.9 + p[1]),
+        130 + 90 * np.sin(lats * 0.7 + p[2]) * np.sin(lons * 1.1 + p[3]),
+        80 + 7 * np.cos(lats * 0.8 + p[1]) * np.sin(lons * 0.6 + p[0]),
+        np.full(lats.shape, 0.5),
+    ], axis=-1)
+
+def _anchor_weather(lats, lons, date_offset):
+    """(len(lats), len(lons), 4) weather samples on the anchor lattice."""
+    LA, LO = np.meshgrid(lats, lons, indexing="ij")
+    field = simulated_weather(LA, LO, date_offset)
+
+    if date_offset > 0:
+        fetch = lambda la, lo: get_forecast_weather(la, lo, date_offset)
+    else:
+        fetch = get_real_weather
+    points = list(zip(LA.ravel().tolist(), LO.ravel().tolist()))
+    for k, w in enumerate(fetch_all(points, fetch, OPENWEATHER_BASE_URL)):
+        if w:
+            field[np.unravel_index(k, LA.shape)] = [w[f] for f in RAW_FEATURES]
+    return field
+
+def _interpolate(lat0, lon0, spacing, field, lats, lons):
+    """Bilinear interpolation of an anchor field (origin lat0/lon0) onto the lats x lons mesh."""
+    n_lat, n_lon = field.shape[:2]
+    fi = np.clip((lats - lat0) / spacing, 0, n_lat - 1)
+    fj = np.clip((lons - lon0) / spacing, 0, n_lon - 1)
+    i0 = np.minimum(fi.astype(int), n_lat - 2)
+    j0 = np.minimum(fj.astype(int), n_lon - 2)
+    di = (fi - i0)[:, None, None]
+    dj = (fj - j0)[None, :, None]
+
+    f00 = field[i0][:, j0]
+    f01 = field[i0][:, j0 + 1]
+    f10 = field[i0 + 1][:, j0]
+    f11 = field[i0 + 1][:, j0 + 1]
+    return (f00 * (1 - di) * (1 - dj) + f01 * (1 - di) * dj
+            + f10 * di * (1 - dj) + f11 * di * dj)
+
+# --------------------
+# Tile Computation
+# --------------------
+def compute_tile(ti, tj, resolution, date_offset, model=None):
+    """Risk for one TILE_CELLS x TILE_CELLS tile: (lats, lons, risk[lat, lon])."""
+    lats = (ti * TILE_CELLS + np.arange(TILE_CELLS)) * resolution
+    lons = (tj * TILE_CELLS + np.arange(TILE_CELLS)) * resolution
+
+    # Very coarse resolutions span many anchors; widen the anchor spacing so
+    # a tile never costs more than ANCHORS_PER_TILE^2 upstream lookups.
+    span = max(lats[-1] - lats[0], lons[-1] - lons[0])
+    spacing = ANCHOR_SPACING * max(1, int(np.ceil(span / ANCHOR_SPACING / ANCHORS_PER_TILE)))
+    lat0 = np.floor(lats[0] / spacing) * spacing
+    lon0 = np.floor(lons[0] / spacing) * spacing
+    anchor_lats = lat0 + np.arange(int(np.ceil((lats[-1] - lat0) / spacing)) + 2) * spacing
+    anchor_lons = lon0 + np.arange(int(np.ceil((lons[-1] - lon0) / spacing)) + 2) * spacing
+
+    field = _anchor_weather(anchor_lats, anchor_lons, date_offset)
+    grid = _interpolate(lat0, lon0, spacing, field, lats, lons)
+
+    risk = predict_risk_batch(grid.reshape(-1, len(RAW_FEATURES)), model)
+    risk = np.clip(risk, 0, 100).astype(np.int16).reshape(len(lats), len(lons))
+    return lats, lons, risk
+
+
+class TileCache:
+    """LRU of computed tiles keyed on (date_offset, resolution, ti, tj)."""
+
+    def __init__(self, max_tiles=HEATMAP_TILE_CACHE, ttl=HEATMAP_TILE_TTL):
+        self.max_tiles = max_tiles
+        self.ttl = ttl
+        self._tiles = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        with self._lock:
+            hit = self._tiles.get(key)
+            if hit is not None and time.monotonic() - hit[0] <= self.ttl:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+            lock = self._building.setdefault(key, threading.Lock())
+
+        # One builder per tile; late arrivals pick up its result.
+        with lock:
+            with self._lock:
+                hit = self._tiles.get(key)
+                if hit is not None and time.monotonic() - hit[0] <= self.ttl:
+                    return hit[1]
+            tile = build()
+            with self._lock:
+                self._tiles[key] = (time.monotonic(), tile)
+                self._tiles.move_to_end(key)
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+                self._building.pop(key, None)
+        return tile
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"tiles": len(self._tiles), "hits": self.hits, "misses": self.misses,
+                    "max_tiles": self.max_tiles, "ttl": self.ttl}
+
+
+tile_cache = TileCache()
+
+# --------------------
+# Grid Queries
+# --------------------
+def parse_grid_args(args):
+    try:
+        min_lat = float(args.get("min_lat", DEFAULT_BBOX[0]))
+        min_lon = float(args.get("min_lon", DEFAULT_BBOX[1]))
+        max_lat = float(args.get("max_lat", DEFAULT_BBOX[2]))
+        max_lon = float(args.get("max_lon", DEFAULT_BBOX[3]))
+        resolution = float(args.get("resolution", DEFAULT_RESOLUTION))
+        date_offset = int(args.get("date_offset", 0))
+    except ValueError as e:
+        raise HeatmapError(f"Invalid heatmap parameter: {e}")
+
+    if resolution <= 0:
+        raise HeatmapError("resolution must be positive")
+    if not (min_lat < max_lat and min_lon < max_lon):
+        raise HeatmapError("bbox must satisfy min_lat < max_lat and min_lon < max_lon")
+    if not 0 <= date_offset <= 5:
+        raise HeatmapError("date_offset must be between 0 and 5")
+
+    n_cells = (int((max_lat - min_lat) / resolution) + 1) * (int((max_lon - min_lon) / resolution) + 1)
+    if n_cells > HEATMAP_MAX_CELLS:
+        raise HeatmapError(
+            f"Grid of {n_cells} cells exceeds HEATMAP_MAX_CELLS={HEATMAP_MAX_CELLS}; "
+            f"use a coarser resolution or a smaller bbox"
+        )
+    return (min_lat, min_lon, max_lat, max_lon), resolution, date_offset
+
+def risk_grid(bbox, resolution, date_offset=0, model=None):
+    """
+    Risk on the lattice points (multiples of `resolution`) inside bbox.
+
+    Returns (lats, lons, risk) with risk shaped (len(lats), len(lons)).
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    i0, i1 = int(np.ceil(min_lat / resolution)), int(np.floor(max_lat / resolution))
+    j0, j1 = int(np.ceil(min_lon / resolution)), int(np.floor(max_lon / resolution))
+    if i1 < i0 or j1 < j0:
+        return np.zeros(0), np.zeros(0), np.zeros((0, 0), dtype=np.int16)
+
+    risk = np.empty((i1 - i0 + 1, j1 - j0 + 1), dtype=np.int16)
+    for ti in range(i0 // TILE_CELLS, i1 // TILE_CELLS + 1):
+        for tj in range(j0 // TILE_CELLS, j1 // TILE_CELLS + 1):
+            key = (date_offset, resolution, ti, tj, model is not None)
+            _, _, tile = tile_cache.get(
+                key, lambda: compute_tile(ti, tj, resolution, date_offset, model)
+            )
+            # Overlap of this tile with the requested index range.
+            a0, a1 = max(i0, ti * TILE_CELLS), min(i1, (ti + 1) * TILE_CELLS - 1)
+            b0, b1 = max(j0, tj * TILE_CELLS), min(j1, (tj + 1) * TILE_CELLS - 1)
+            risk[a0 - i0:a1 - i0 + 1, b0 - j0:b1 - j0 + 1] = tile[
+                a0 - ti * TILE_CELLS:a1 - ti * TILE_CELLS + 1,
+                b0 - tj * TILE_CELLS:b1 - tj * TILE_CELLS + 1,
+            ]
+
+    lats = np.round(np.arange(i0, i1 + 1) * resolution, 6)
+    lons = np.round(np.arange(j0, j1 + 1) * resolution, 6)
+    return lats, lons, risk
+
+def precompute(date_offsets=range(0, 3), bbox=DEFAULT_BBOX, resolution=DEFAULT_RESOLUTION, model=None):
+    """Warm the tile cache for the default view."""
+    for offset in date_offsets:
+        try:
+            risk_grid(bbox, resolution, offset, model)
+        except RuntimeError:
+            # Fan-out pool refuses new work once the interpreter is exiting.
+            return
@@ -0,0 +1,184 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --------------------
+# Configuration
+# --------------------
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 5))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 2))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.1))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 2.0))
+# Each first attempt earns this many retry tokens; each retry spends one.
+HTTP_RETRY_RATIO = float(os.getenv("HTTP_RETRY_RATIO", 0.2))
+HTTP_RETRY_BURST = float(os.getenv("HTTP_RETRY_BURST", 10))
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown.
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                # Let exactly one probe through.
+                self.state = "half_open"
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    Pooled keep-alive session for one upstream service.
+
+    get() retries connection errors, timeouts and 429/5xx with jittered
+    exponential backoff, bounded both per call (max_retries) and overall
+    (retry budget), and raises CircuitOpenError without touching the network
+    while the breaker is open. Other 4xx responses are returned as-is.
+    """
+
+    def __init__(self, name, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._retry_tokens = HTTP_RETRY_BURST
+        self._buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._counts = {"requests": 0, "attempts": 0, "retries": 0, "errors": 0,
+                        "short_circuited": 0, "budget_exhausted": 0}
+        self._latency_ms_total = 0.0
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._lock:
+            self._counts["requests"] += 1
+            self._retry_tokens = min(HTTP_RETRY_BURST, self._retry_tokens + HTTP_RETRY_RATIO)
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                with self._lock:
+                    self._counts["short_circuited"] += 1
+                raise CircuitOpenError(f"{self.name}: circuit open")
+
+            start = time.perf_counter()
+            error = None
+            response = None
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.RequestException as e:
+                error = e
+            self._observe((time.perf_counter() - start) * 1000)
+
+            retryable = error is not None or response.status_code in RETRYABLE_STATUS
+            self.breaker.record(not retryable)
+            if not retryable:
+                return response
+
+            if attempt >= self.max_retries or not self._take_retry_token():
+                with self._lock:
+                    self._counts["errors"] += 1
+                if error is not None:
+                    raise UpstreamError(f"{self.name}: {error}") from error
+                raise UpstreamError(f"{self.name}: HTTP {response.status_code}")
+
+            attempt += 1
+            # Full jitter: sleep uniformly in [0, base * 2^attempt], capped.
+            time.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt)))
+
+    def _take_retry_token(self):
+        with self._lock:
+            if self._retry_tokens >= 1:
+                self._retry_tokens -= 1
+                self._counts["retries"] += 1
+                return True
+            self._counts["budget_exhausted"] += 1
+            return False
+
+    def _observe(self, ms):
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        with self._lock:
+            self._counts["attempts"] += 1
+            self._buckets[i] += 1
+            self._latency_ms_total += ms
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._counts)
+            buckets = list(self._buckets)
+            total_ms = self._latency_ms_total
+            s["retry_tokens"] = round(self._retry_tokens, 2)
+
+        labels = [f"le_{b}ms" for b in LATENCY_BUCKETS_MS] + ["inf"]
+        s["latency_histogram"] = dict(zip(labels, buckets))
+        s["latency_ms_avg"] = round(total_ms / s["attempts"], 2) if s["attempts"] else 0.0
+        s["breaker"] = {"state": self.breaker.state, "failures": self.breaker.failures, "trips": self.breaker.trips}
+        return s
+
+
+_upstreams = {}
+_registry_lock = threading.Lock()
+
+def upstream(name, **kwargs):
+    """Shared Upstream client for `name`, created on first use."""
+    with _registry_lock:
+        client = _upstreams.get(name)
+        if client is None:
+            client = _upstreams[name] = Upstream(name, **kwargs)
+        return client
+
+def upstream_stats():
+    with _registry_lock:
+        clients = list(_upstreams.values())
+    return {c.name: c.stats() for c in clients}
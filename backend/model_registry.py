@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import threading
+import time
+
+import joblib
+
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+# Pin a version (e.g. MODEL_VERSION=2); default is the newest artifact found.
+MODEL_VERSION = os.getenv("MODEL_VERSION")
+
+# dengue_model.pkl is treated as v1; newer artifacts are dengue_model_v<N>.pkl
+# with an optional dengue_model_v<N>.json metadata sidecar.
+_ARTIFACT_RE = re.compile(r"^dengue_model(?:_v(\d+))?\.pkl$")
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelInfo:
+    __slots__ = ("version", "path", "metadata", "model", "estimator", "load_ms", "rss_delta_mb", "error")
+
+    def __init__(self, version, path, metadata):
+        self.version = version
+        self.path = path
+        self.metadata = metadata
+        self.model = None      # what serving calls predict() on
+        self.estimator = None  # the unpickled estimator
+        self.load_ms = None
+        self.rss_delta_mb = None
+        self.error = None
+
+    @property
+    def features(self):
+        return self.metadata.get("features")
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "path": os.path.basename(self.path),
+            "features": self.features,
+            "training_hash": self.metadata.get("training_hash"),
+            "metrics": self.metadata.get("metrics"),
+            "trained_at": self.metadata.get("trained_at"),
+            "ensemble": self.metadata.get("ensemble"),
+            "loaded": self.model is not None,
+            "engine": None if self.model is None else "sklearn" if self.model is self.estimator else "flat",
+            "load_ms": self.load_ms,
+            "rss_delta_mb": self.rss_delta_mb,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts in MODEL_DIR, loaded lazily.
+
+    Models are loaded with joblib's mmap_mode="r", so the numpy arrays of an
+    uncompressed artifact are mapped read-only from disk and shared between
+    forked workers instead of copied into each. activate() loads the new
+    version fully before swapping the active reference, so in-flight
+    requests keep the model they started with.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, pinned=MODEL_VERSION, compile=None):
+        self.model_dir = model_dir
+        self.pinned = int(pinned) if pinned else None
+        # Optional fn(estimator) -> faster equivalent predictor or None.
+        self.compile = compile
+        self._lock = threading.Lock()
+        # version -> lock held while that version loads, so loading never blocks
+        # requests served by the active model
+        self._load_locks = {}
+        self._models = {}
+        self._active = None
+        self._listeners = []
+        self.discover()
+
+    def discover(self):
+        found = {}
+        for name in os.listdir(self.model_dir):
+            m = _ARTIFACT_RE.match(name)
+            if not m:
+                continue
+            version = int(m.group(1) or 1)
+            path = os.path.join(self.model_dir, name)
+            meta_path = path[:-len(".pkl")] + ".json"
+            metadata = {}
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding="utf-8") as f:
+                    metadata = json.load(f)
+            found[version] = ModelInfo(version, path, metadata)
+
+        with self._lock:
+            for version, info in found.items():
+                # Keep already-loaded models for versions we still know about.
+                if version not in self._models or self._models[version].path != info.path:
+                    self._models[version] = info
+            if self._active is None and found:
+                self._active = self.pinned if self.pinned in found else max(found)
+        return sorted(found)
+
+    def _load(self, info):
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        try:
+            model = joblib.load(info.path, mmap_mode="r")
+        except Exception as e:
+            info.error = f"{type(e).__name__}: {e}"
+            print(f"Model v{info.version} failed to load: {info.error}")
+            return None
+        info.load_ms = round((time.perf_counter() - start) * 1000, 1)
+        rss_after = rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            info.rss_delta_mb = round((rss_after - rss_before) / 2**20, 2)
+        if not info.features and hasattr(model, "feature_names_in_"):
+            info.metadata["features"] = list(model.feature_names_in_)
+        info.error = None
+        info.estimator = model
+        info.model = (self.compile(model) if self.compile else None) or model
+        engine = "flat" if info.model is not model else "sklearn"
+        print(f"Loaded model v{info.version} in {info.load_ms} ms ({engine} inference)")
+        return model
+
+    def _ensure_loaded(self, info, retry=False):
+        """info.model, loading it if needed: first caller pays, the rest wait for the same object."""
+        with self._lock:
+            load_lock = self._load_locks.setdefault(info.version, threading.Lock())
+        with load_lock:
+            if info.model is None and (retry or info.error is None):
+                self._load(info)
+        return info.model
+
+    def get(self, version=None):
+        """(ModelInfo, model) for `version` (default: active), loading it on first use."""
+        with self._lock:
+            version = self._active if version is None else version
+            info = self._models.get(version)
+        if info is None:
+            return None, None
+        if info.model is not None or info.error is not None:
+            return info, info.model
+        return info, self._ensure_loaded(info)
+
+    def activate(self, version):
+        """Load `version` and make it active. Raises KeyError/RuntimeError on failure."""
+        self.discover()
+        with self._lock:
+            info = self._models.get(version)
+        if info is None:
+            raise KeyError(f"No model artifact for version {version}")
+        # Load outside self._lock: requests keep using the current model meanwhile.
+        if self._ensure_loaded(info, retry=True) is None:
+            raise RuntimeError(info.error)
+        with self._lock:
+            self._active = version
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn(info)
+        return info
+
+    def on_activate(self, fn):
+        self._listeners.append(fn)
+
+    @property
+    def active_version(self):
+        return self._active
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "models": [self._models[v].describe() for v in sorted(self._models)],
+            }
+
+    def next_version_path(self):
+        """Artifact path for the next version (used by training)."""
+        versions = self.discover()
+        return os.path.join(self.model_dir, f"dengue_model_v{max(versions, default=1) + 1}.pkl")
+
+
+def write_metadata(model_path, metadata):
+    with open(model_path[:-len(".pkl")] + ".json", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
@@ -0,0 +1,197 @@
+"""
+Walk-forward cross-validation and hyperparameter search.
+
+Days are split into --folds + 1 consecutive blocks; fold k trains on every
+day before block k + 1 and tests on block k + 1, so no fold ever trains on
+data later than what it is scored on. Every (candidate, fold) pair runs as
+one task in a process pool. Features come from train_model.load_features,
+whose on-disk cache is memory-mapped by each worker instead of being
+pickled to it. The best candidate by mean R² is refit on all data and
+written to the model registry with its CV results and ensemble weights,
+which are stacked on its predictions for the last fold's test block.
+
+    python model_selection.py --model gbr --folds 4 --workers 4
+    python model_selection.py --model hgb --max-candidates 6 --data big.csv
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from train_model import (
+    CHUNK_ROWS, DATA_FILE, FEATURE_CACHE_DIR, fit_ensemble, load_features, load_raw, make_model, save_model, stage,
+)
+
+SEARCH_SPACE = {
+    "gbr": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [3, 4, 5],
+        "learning_rate": [0.05, 0.1],
+    },
+    "hgb": {
+        "max_iter": [100, 200, 400],
+        "max_leaf_nodes": [15, 31, 63],
+        "learning_rate": [0.05, 0.1],
+    },
+}
+
+# --------------------
+# Folds & Candidates
+# --------------------
+def walk_forward_folds(t, n_folds, gap=0):
+    """
+    [(train_end, test_start, test_end)] day bounds for rolling-origin CV
+    over the days in t: train on t < train_end, test on
+    test_start <= t < test_end. gap: days left out after training.
+    """
+    days = np.unique(t)
+    if len(days) < n_folds + 1:
+        raise ValueError(f"need at least {n_folds + 1} distinct days, got {len(days)}")
+    edges = np.linspace(0, len(days), n_folds + 2).astype(int)
+    folds = []
+    for k in range(n_folds):
+        test_start = int(days[edges[k + 1]])
+        test_end = int(days[edges[k + 2]]) if edges[k + 2] < len(days) else int(days[-1]) + 1
+        folds.append((test_start - gap, test_start, test_end))
+    return folds
+
+def candidates(kind, max_candidates=None, seed=0):
+    grid = SEARCH_SPACE[kind]
+    combos = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if max_candidates and max_candidates < len(combos):
+        combos = random.Random(seed).sample(combos, max_candidates)
+    return combos
+
+# --------------------
+# Workers
+# --------------------
+_data = None
+
+def _init_worker(path, cache_dir, data_hash, threads):
+    global _data
+    # One BLAS/OpenMP thread per process unless told otherwise, so N
+    # workers do not each start one thread per core.
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads)
+    _data = load_features(path, cache_dir=cache_dir, data_hash=data_hash)
+
+def _run_fold(kind, params, fold_no, train_end, test_start, test_end):
+    X, y, t, _ = _data
+    train_idx = np.flatnonzero(t < train_end)
+    test_idx = np.flatnonzero((t >= test_start) & (t < test_end))
+    model = make_model(kind, **params)
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_s = time.perf_counter() - start
+    pred = model.predict(X[test_idx])
+    return {
+        "fold": fold_no,
+        "r2": float(r2_score(y[test_idx], pred)),
+        "mae": float(mean_absolute_error(y[test_idx], pred)),
+        "fit_s": fit_s,
+        "train_rows": int(len(train_idx)),
+        "test_rows": int(len(test_idx)),
+    }
+
+# --------------------
+# Search
+# --------------------
+def search(path=DATA_FILE, kind="gbr", n_folds=4, gap=0, workers=None, max_candidates=None,
+           threads_per_worker=1, cache_dir=FEATURE_CACHE_DIR, save=True):
+    if not cache_dir:
+        raise ValueError("model selection needs the feature cache to share data with workers")
+    workers = workers or os.cpu_count() or 1
+
+    with stage("load + features"):
+        X, y, t, data_hash = load_features(path, CHUNK_ROWS, cache_dir)
+    folds = walk_forward_folds(t, n_folds, gap)
+    combos = candidates(kind, max_candidates)
+    print(f"🔎 {len(combos)} candidates x {n_folds} folds on {len(X):,} rows, {workers} workers")
+
+    results = {i: [] for i in range(len(combos))}
+    with stage("cross-validate"):
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(path, cache_dir, data_hash, threads_per_worker)) as pool:
+            futures = {
+                pool.submit(_run_fold, kind, params, k, *bounds): i
+                for i, params in enumerate(combos)
+                for k, bounds in enumerate(folds)
+            }
+            for future, i in futures.items():
+                results[i].append(future.result())
+
+    summary = []
+    for i, params in enumerate(combos):
+        folds_out = sorted(results[i], key=lambda r: r["fold"])
+        r2s = [r["r2"] for r in folds_out]
+        summary.append({
+            "params": params,
+            "r2_mean": float(np.mean(r2s)),
+            "r2_std": float(np.std(r2s)),
+            "mae_mean": float(np.mean([r["mae"] for r in folds_out])),
+            "fit_s": float(sum(r["fit_s"] for r in folds_out)),
+            "folds": folds_out,
+        })
+    summary.sort(key=lambda s: (-s["r2_mean"], s["fit_s"]))
+
+    print(f"\n{'params':<58}{'r2':>8}{'±':>7}{'mae':>8}{'fit s':>8}")
+    for s in summary:
+        print(f"{str(s['params']):<58}{s['r2_mean']:>8.3f}{s['r2_std']:>7.3f}{s['mae_mean']:>8.2f}{s['fit_s']:>8.1f}")
+    best = summary[0]
+    print("\nPer-fold results for the winner:")
+    for r in best["folds"]:
+        print(f"  fold {r['fold']}: r2 {r['r2']:.3f}  mae {r['mae']:.2f}  fit {r['fit_s']:.2f}s  "
+              f"train {r['train_rows']:,}  test {r['test_rows']:,}")
+
+    if not save:
+        return best, None
+    with stage("stack ensemble"):
+        train_end, test_start, test_end = folds[-1]
+        held_out = (t >= test_start) & (t < test_end)
+        model = make_model(kind, **best["params"])
+        model.fit(X[t < train_end], y[t < train_end])
+        ensemble, ensemble_r2 = fit_ensemble(model.predict(X[held_out]), load_raw(path, CHUNK_ROWS)[held_out],
+                                             X[held_out], y[held_out], t[held_out])
+    print(f"🧮 Ensemble weights {ensemble.describe()['weights']}, intercept {ensemble.intercept:.2f}")
+    print(f"📈 R² on the later half of the last fold: ML {ensemble_r2['ml']:.3f}, ensemble {ensemble_r2['ensemble']:.3f}")
+    with stage("refit winner"):
+        model = make_model(kind, **best["params"])
+        model.fit(X, y)
+    with stage("save"):
+        model_file = save_model(
+            model, data_hash,
+            {"cv_r2_mean": round(best["r2_mean"], 4), "cv_r2_std": round(best["r2_std"], 4),
+             "cv_mae_mean": round(best["mae_mean"], 3), "ensemble_r2": round(ensemble_r2["ensemble"], 4)},
+            len(X),
+            ensemble={k: v for k, v in ensemble.describe().items() if k != "source"},
+            selection={
+                "method": "walk_forward",
+                "folds": n_folds,
+                "gap_days": gap,
+                "candidates": len(combos),
+                "fold_metrics": [{k: round(v, 4) if isinstance(v, float) else v for k, v in r.items()}
+                                 for r in best["folds"]],
+            },
+        )
+    print(f"💾 Winner saved as '{model_file}'")
+    return best, model_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward CV + hyperparameter search")
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--model", choices=sorted(SEARCH_SPACE), default="gbr")
+    parser.add_argument("--folds", type=int, default=4)
+    parser.add_argument("--gap", type=int, default=0, help="days between training end and test start")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--max-candidates", type=int, default=None, help="random subset of the grid")
+    parser.add_argument("--dry-run", action="store_true", help="do not write the winner to the registry")
+    args = parser.parse_args()
+    search(args.data, args.model, args.folds, args.gap, args.workers, args.max_candidates,
+           args.threads_per_worker, save=not args.dry_run)
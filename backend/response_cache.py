@@ -0,0 +1,158 @@
+"""
+Cache of serialized API responses.
+
+    @app.route('/api/vouchers')
+    @response_cache.cached(ttl=60, tags=lambda args: ["vouchers", f"user:{args.get('user_id')}"])
+    def get_vouchers(): ...
+
+Entries are keyed on the request path plus its sorted query arguments and
+hold the response body both as-is and gzipped, so hits cost no JSON
+encoding or compression. Every response carries an ETag; a matching
+If-None-Match gets a 304. Writes evict entries through their tags
+(response_cache.invalidate("tasks")). A request that was computing while
+one of its tags was invalidated does not store its result.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 30))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+# Bodies smaller than this are not worth gzipping.
+GZIP_MIN_BYTES = 512
+
+
+class _Entry:
+    __slots__ = ("body", "gzipped", "etag", "mimetype", "expires_at", "tags")
+
+    def __init__(self, body, mimetype, ttl, tags):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.mimetype = mimetype
+        self.expires_at = time.monotonic() + ttl
+        self.tags = tags
+
+
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_tag = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidated": 0}
+
+    # --------------------
+    # Decorator
+    # --------------------
+    def cached(self, ttl=None, tags=()):
+        """
+        Cache a view's 200 responses for `ttl` seconds.
+
+        tags: names the entry can be invalidated by, or a function of
+        request.args returning them (for per-user entries).
+        """
+        ttl = self.ttl if ttl is None else ttl
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                entry = self._get(key)
+                if entry is None:
+                    entry_tags = tuple(tags(request.args) if callable(tags) else tags)
+                    generation = self._generation(entry_tags)
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    entry = _Entry(response.get_data(), response.mimetype, ttl, entry_tags)
+                    self._put(key, entry, generation)
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+    def _respond(self, entry):
+        if entry.etag in request.if_none_match:
+            with self._lock:
+                self._stats["not_modified"] += 1
+            response = Response(status=304)
+        elif entry.gzipped is not None and "gzip" in request.accept_encodings:
+            response = Response(entry.gzipped, mimetype=entry.mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        response.cache_control.no_cache = True
+        response.vary.add("Accept-Encoding")
+        return response
+
+    # --------------------
+    # Storage
+    # --------------------
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+            return None
+
+    def _generation(self, tags):
+        with self._lock:
+            return tuple(self._generations.get(t, 0) for t in tags)
+
+    def _put(self, key, entry, generation):
+        with self._lock:
+            if generation != tuple(self._generations.get(t, 0) for t in entry.tags):
+                return
+            self._remove(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    # --------------------
+    # Invalidation
+    # --------------------
+    def invalidate(self, *tags):
+        """Evict every entry carrying any of `tags`."""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self._stats["invalidated"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), **self._stats, "ttl": self.ttl}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,146 @@
+import time
+
+import numpy as np
+
+# Column order of the serving feature matrix.
+RAW_FEATURES = ["temp", "rainfall", "humidity", "salinity"]
+
+# --------------------
+# Feature Matrix
+# --------------------
+def weather_matrix(weathers):
+    """(N, 4) float matrix from a list of weather dicts."""
+    return np.array(
+        [[w[f] for f in RAW_FEATURES] for w in weathers],
+        dtype=np.float64,
+    ).reshape(-1, len(RAW_FEATURES))
+
+# --------------------
+# Rule-Based Scoring
+# --------------------
+def rule_based_predict(temp, rainfall, humidity, salinity):
+    risk = 0
+
+    if 25 <= temp <= 30:
+        risk += 35
+    elif 23 <= temp < 25 or 30 < temp <= 32:
+        risk += 20
+    else:
+        risk += 5
+
+    if rainfall > 150:
+        risk += 35
+    elif rainfall > 80:
+        risk += 20
+    else:
+        risk += 5
+
+    if humidity > 75:
+        risk += 25
+    elif humidity > 65:
+        risk += 15
+    else:
+        risk += 5
+
+    if salinity > 2:
+        risk -= 10
+
+    return min(95, max(10, risk + np.random.randint(-3, 3)))
+
+def rule_components(X):
+    """(N, 4) points from each rule (temp, rainfall, humidity, salinity) for an (N, 4) matrix."""
+    X = np.asarray(X, dtype=np.float64)
+    temp, rainfall, humidity, salinity = X[:, 0], X[:, 1], X[:, 2], X[:, 3]
+
+    return np.column_stack([
+        np.select(
+            [(temp >= 25) & (temp <= 30), ((temp >= 23) & (temp < 25)) | ((temp > 30) & (temp <= 32))],
+            [35, 20],
+            default=5,
+        ),
+        np.select([rainfall > 150, rainfall > 80], [35, 20], default=5),
+        np.select([humidity > 75, humidity > 65], [25, 15], default=5),
+        np.where(salinity > 2, -10, 0),
+    ])
+
+def rule_points(X):
+    """Unclipped, noise-free rule score for every row of an (N, 4) matrix."""
+    return rule_components(X).sum(axis=1)
+
+def rule_based_predict_batch(X, noise=True):
+    """Vectorized rule_based_predict over the rows of an (N, 4) matrix."""
+    risk = rule_points(X)
+    if noise:
+        risk += np.random.randint(-3, 3, size=len(risk))
+
+    return np.clip(risk, 10, 95)
+
+# --------------------
+# Batched Scoring Engine
+# --------------------
+def predict_risk_batch(X, model=None):
+    """
+    Score every row of X in one call.
+
+    X: (N, 4) matrix in RAW_FEATURES order.
+    model: fitted regressor, or None for the rule-based path.
+    Returns an int array of length N.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if len(X) == 0:
+        return np.zeros(0, dtype=int)
+    if model is not None:
+        return model.predict(X).astype(int)
+    return rule_based_predict_batch(X).astype(int)
+
+# --------------------
+# Benchmark
+# --------------------
+def _random_matrix(n, rng):
+    return np.column_stack([
+        rng.uniform(20, 35, n),
+        rng.uniform(0, 300, n),
+        rng.uniform(40, 100, n),
+        rng.uniform(0, 5, n),
+    ])
+
+def _demo_model(rng):
+    from sklearn.ensemble import GradientBoostingRegressor
+
+    X = _random_matrix(2000, rng)
+    y = rule_based_predict_batch(X)
+    return GradientBoostingRegressor(n_estimators=200, learning_rate=0.05, max_depth=4, random_state=42).fit(X, y)
+
+def benchmark(sizes=(10, 1_000, 100_000), loop_sample=2_000):
+    """
+    Per-row cost of the per-district loop vs. one batched call.
+
+    The loop is timed on at most `loop_sample` rows (100k single-row
+    model.predict calls take minutes); its per-row cost does not depend on N.
+    """
+    rng = np.random.default_rng(0)
+    model = _demo_model(rng)
+
+    print(f"{'path':<12}{'N':>9}{'loop us/row':>14}{'batch us/row':>15}{'speedup':>10}")
+    for path, m in (("rules", None), ("ml", model)):
+        for n in sizes:
+            X = _random_matrix(n, rng)
+            k = min(n, loop_sample)
+
+            start = time.perf_counter()
+            for row in X[:k]:
+                if m is not None:
+                    int(m.predict(row.reshape(1, -1))[0])
+                else:
+                    int(rule_based_predict(*row))
+            loop_us = (time.perf_counter() - start) / k * 1e6
+
+            start = time.perf_counter()
+            predict_risk_batch(X, m)
+            batch_us = (time.perf_counter() - start) / n * 1e6
+
+            print(f"{path:<12}{n:>9}{loop_us:>14.2f}{batch_us:>15.3f}{loop_us / batch_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,117 @@
+"""
+Manager dashboard figures from the per-district/day task rollups.
+
+db.py keeps district_daily_rollups current as tasks are assigned and
+verified; this module turns those rows into the ROI and priority-zone
+payloads, so neither endpoint reads user_daily_tasks. Rebuild the rollups
+from history (e.g. after editing tasks by hand) with:
+
+    python rollups.py --backfill [--db dengue.db]
+"""
+import argparse
+import datetime
+import os
+import time
+
+import numpy as np
+
+import db
+from fanout import load_districts
+
+# Days of activity priority zones are ranked on.
+ROLLUP_WINDOW_DAYS = int(os.getenv("ROLLUP_WINDOW_DAYS", 7))
+# Expected dengue cases avoided by one completed action at 100% risk.
+CASES_PER_ACTION = 0.1
+CASE_COST_USD = 150
+USD_TO_VND = 25_000
+
+# --------------------
+# Districts
+# --------------------
+_centers = None
+
+def nearest_district(lat, lon):
+    """Id of the district whose center is closest to (lat, lon)."""
+    global _centers
+    districts = load_districts()
+    if _centers is None or len(_centers) != len(districts):
+        _centers = np.array([d["center"] for d in districts], dtype=np.float64)
+    d2 = (_centers[:, 0] - lat) ** 2 + (_centers[:, 1] - lon) ** 2
+    return districts[int(np.argmin(d2))]["id"]
+
+# --------------------
+# Dashboard Figures
+# --------------------
+def _window(days, today=None):
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=days - 1)).isoformat(), today.isoformat()
+
+def roi_stats(today=None, conn=None):
+    assigned, _, completed, completed_risk, points = db.rollup_totals(conn=conn)
+    cases = round(completed_risk / 100 * CASES_PER_ACTION, 1)
+
+    # Completion rate over the last window vs. the window before it.
+    today = today or datetime.date.today()
+    recent = db.rollup_totals(*_window(ROLLUP_WINDOW_DAYS, today), conn=conn)
+    earlier = db.rollup_totals(*_window(ROLLUP_WINDOW_DAYS, today - datetime.timedelta(days=ROLLUP_WINDOW_DAYS)), conn=conn)
+    rate = lambda row: row[2] / row[0] if row[0] else None
+    improvement = 0
+    if rate(recent) is not None and rate(earlier):
+        improvement = round((rate(recent) / rate(earlier) - 1) * 100)
+
+    return {
+        "cases_avoided": cases,
+        "money_saved_usd": int(round(cases * CASE_COST_USD)),
+        "money_saved_vnd": int(round(cases * CASE_COST_USD * USD_TO_VND)),
+        "citizen_actions": int(completed),
+        "actions_assigned": int(assigned),
+        "points_issued": int(points),
+        "prevention_rate_improvement": f"{improvement}%",
+    }
+
+def priority_zones(limit=3, today=None, conn=None):
+    """
+    Districts ranked by mean risk at assignment times the share of actions
+    still undone over the last ROLLUP_WINDOW_DAYS.
+    """
+    names = {d["id"]: d.get("name", d["id"]) for d in load_districts()}
+    zones = []
+    for district_id, assigned, risk_sum, completed, _, _ in db.rollups_by_district(*_window(ROLLUP_WINDOW_DAYS, today), conn=conn):
+        if not assigned or district_id == db.UNKNOWN_DISTRICT:
+            continue
+        mean_risk = risk_sum / assigned
+        completion = completed / assigned
+        if mean_risk >= 75:
+            label, action = "CRITICAL", "Immediate Spraying"
+        elif mean_risk >= 60:
+            label, action = "HIGH", "Larvicide"
+        else:
+            label, action = "ELEVATED", "Community Cleanup"
+        zones.append({
+            "id": district_id,
+            "name": names.get(district_id, district_id),
+            "mosquito_index": round(mean_risk / 10, 1),
+            "risk_label": label,
+            "status": "Pending" if completed == 0 else "In Progress",
+            "action_needed": action,
+            "actions_assigned": int(assigned),
+            "actions_completed": int(completed),
+            "priority": round(mean_risk * (1 - completion), 1),
+        })
+    zones.sort(key=lambda z: -z["priority"])
+    return zones[:limit]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="District task rollups")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--backfill", action="store_true", help="rebuild all rollups from user_daily_tasks")
+    args = parser.parse_args()
+    conn = db.connect(args.db)
+    if args.backfill:
+        start = time.perf_counter()
+        rows = db.rebuild_rollups(conn=conn)
+        print(f"Rebuilt {rows:,} rollup rows in {time.perf_counter() - start:.2f}s")
+    print(roi_stats(conn=conn))
+    for zone in priority_zones(conn=conn):
+        print(zone)
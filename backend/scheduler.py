@@ -0,0 +1,217 @@
+"""
+Scheduled district risk forecast.
+
+A background thread scores every district for day offsets 0..FORECAST_DAYS
+every FORECAST_INTERVAL seconds (and right after a model is activated) and
+stores the (district x day) risk matrix as a forecast run in SQLite. The
+manager heatmap serves a column of the latest run; the run before it gives
+each district's change since it was last forecast for the same date.
+
+Weather per district comes from its 5-day forecast (cached per grid cell,
+see weather.py); days past the forecast horizon repeat its last step, and
+districts without a forecast use heatmap_grid.simulated_weather.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import db
+from fanout import fetch_all, load_districts
+from heatmap_grid import simulated_weather
+from risk_engine import RAW_FEATURES
+from weather import OPENWEATHER_BASE_URL, get_forecast
+from weather_cache import grid_cell
+
+FORECAST_DAYS = int(os.getenv("FORECAST_DAYS", 14))
+FORECAST_INTERVAL = float(os.getenv("FORECAST_INTERVAL", 3600))
+FORECAST_KEEP_RUNS = int(os.getenv("FORECAST_KEEP_RUNS", 48))
+# Seconds a request waits for the first run before computing one itself.
+FORECAST_WAIT = float(os.getenv("FORECAST_WAIT", 30))
+# Risk points of change reported as an "up"/"down" trend.
+TREND_THRESHOLD = 3
+# Salinity assumed for coastal districts, where saltwater intrusion is likely.
+COASTAL_SALINITY = 3.0
+
+# --------------------
+# Runs
+# --------------------
+class ForecastRun:
+    """One stored forecast: risks[i, k] is district i's risk k days after base_date."""
+
+    def __init__(self, run_id, created_at, base_date, model_version, district_ids, risks, explanations=None):
+        self.id = run_id
+        self.created_at = created_at
+        self.base_date = base_date
+        self.model_version = model_version
+        self.district_ids = district_ids
+        self.risks = risks
+        # explanations[k][i], kept in memory only (None for runs loaded from the database)
+        self.explanations = explanations
+        self.index = {d: i for i, d in enumerate(district_ids)}
+        # Serialized responses per `days`, filled by the API on first request.
+        self.responses = {}
+
+    @property
+    def horizon(self):
+        return self.risks.shape[1] - 1
+
+    @classmethod
+    def from_row(cls, row):
+        run_id, created_at, base_date, model_version, districts, _, risks = row
+        ids = json.loads(districts)
+        matrix = np.frombuffer(risks, dtype=np.int16).reshape(len(ids), -1)
+        return cls(run_id, datetime.datetime.fromisoformat(created_at),
+                   datetime.date.fromisoformat(base_date), model_version, ids, matrix)
+
+    def previous_risks(self, previous, days):
+        """
+        The previous run's risk for the same target date as column `days`,
+        aligned with this run's districts; NaN where it has none.
+        """
+        out = np.full(len(self.district_ids), np.nan)
+        if previous is None:
+            return out
+        k = days + (self.base_date - previous.base_date).days
+        if not 0 <= k <= previous.horizon:
+            return out
+        for i, district_id in enumerate(self.district_ids):
+            j = previous.index.get(district_id)
+            if j is not None:
+                out[i] = previous.risks[j, k]
+        return out
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "created_at": self.created_at.isoformat(timespec="seconds"),
+            "base_date": self.base_date.isoformat(),
+            "model_version": self.model_version,
+            "horizon": self.horizon,
+        }
+
+# --------------------
+# Computation
+# --------------------
+def forecast_weather(districts, days, now=None):
+    """(days + 1, N, 4) weather in RAW_FEATURES order for day offsets 0..days."""
+    now = now or datetime.datetime.now()
+    centers = np.array([d["center"] for d in districts], dtype=np.float64).reshape(-1, 2)
+    field = np.stack([simulated_weather(centers[:, 0], centers[:, 1], k) for k in range(days + 1)])
+
+    forecasts = fetch_all([tuple(d["center"]) for d in districts], get_forecast, OPENWEATHER_BASE_URL)
+    for i, forecast in enumerate(forecasts):
+        if forecast is None:
+            continue
+        for k in range(days + 1):
+            w = forecast.for_days_ahead(k, now)
+            field[k, i] = [w[f] for f in RAW_FEATURES]
+
+    coastal = np.array([bool(d.get("coastal")) for d in districts], dtype=bool)
+    field[:, coastal, RAW_FEATURES.index("salinity")] = COASTAL_SALINITY
+    return field
+
+
+class ForecastScheduler:
+    """
+    score(weathers, locations, days_ahead) -> (risks, explanations) is the
+    app's batched predictor; model_version() names the model it uses.
+    """
+
+    def __init__(self, score, model_version=lambda: None, days=FORECAST_DAYS,
+                 interval=FORECAST_INTERVAL, keep=FORECAST_KEEP_RUNS):
+        self.score = score
+        self.model_version = model_version
+        self.days = days
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._run_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._latest = self._previous = None
+        self._stats = {"runs": 0, "errors": 0, "last_ms": None}
+
+        rows = db.latest_forecast_runs(2)
+        if rows:
+            runs = [ForecastRun.from_row(r) for r in rows]
+            self._latest = runs[0]
+            self._previous = runs[1] if len(runs) > 1 else None
+            self._ready.set()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="forecast-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def trigger(self):
+        """Recompute as soon as possible (e.g. after a model switch)."""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except RuntimeError:
+                # Fan-out pool refuses new work once the interpreter is exiting.
+                return
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                print("Forecast run error:", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self):
+        """Compute, store and publish one run; returns it."""
+        with self._run_lock:
+            start = time.perf_counter()
+            districts = load_districts()
+            now = datetime.datetime.now()
+            field = forecast_weather(districts, self.days, now)
+            cells = [grid_cell(*d["center"]) for d in districts]
+
+            risks = np.empty((len(districts), self.days + 1), dtype=np.int16)
+            explanations = []
+            for k in range(self.days + 1):
+                weathers = [dict(zip(RAW_FEATURES, row)) for row in field[k].tolist()]
+                day_risks, day_explanations = self.score(weathers, cells, k)
+                risks[:, k] = np.clip(day_risks, 0, 100)
+                explanations.append(day_explanations)
+
+            created_at = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+            ids = [d["id"] for d in districts]
+            version = self.model_version()
+            run_id = db.save_forecast_run(
+                created_at.isoformat(), now.date().isoformat(), version, json.dumps(ids),
+                self.days, risks.tobytes(), keep=self.keep,
+            )
+            run = ForecastRun(run_id, created_at, now.date(), version, ids, risks, explanations)
+            with self._lock:
+                self._previous, self._latest = self._latest, run
+                self._stats["runs"] += 1
+                self._stats["last_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            self._ready.set()
+            return run
+
+    def runs(self, timeout=None):
+        """
+        (latest, previous) runs. Waits up to `timeout` seconds for the
+        first run; computes one inline if none appeared by then.
+        """
+        if not self._ready.wait(timeout):
+            with self._run_lock:
+                if not self._ready.is_set():
+                    self.run_once()
+        with self._lock:
+            return self._latest, self._previous
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["latest"] = self._latest.describe() if self._latest else None
+        return s
@@ -0,0 +1,110 @@
+"""
+Local stand-in for the OpenWeatherMap endpoints used by weather.py.
+
+    python stub_weather.py --port 8090 --latency 0.2 --error-rate 0.1
+    OPENWEATHER_API_KEY=stub OPENWEATHER_BASE_URL=http://127.0.0.1:8090 python app.py
+
+Responses are deterministic in (lat, lon) so cache behaviour can be checked
+against the request counter printed on every hit. --latency and
+--error-rate inject delay and HTTP 503s to exercise retries and the
+circuit breaker in http_client.py.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_lock = threading.Lock()
+_counts = {"weather": 0, "forecast": 0, "errors": 0}
+
+
+def _observation(lat, lon):
+    return {
+        "main": {
+            "temp": round(27 + 3 * math.sin(lat * 7) + math.cos(lon * 5), 2),
+            "humidity": round(78 + 8 * math.cos(lat * 3), 1),
+        },
+        "rain": {"1h": round(max(0.0, 6 * math.sin(lon * 11)), 2)},
+    }
+
+
+def _forecast(lat, lon, now=None):
+    now = int(now or time.time())
+    items = []
+    for step in range(40):
+        obs = _observation(lat + step * 0.01, lon)
+        items.append({
+            "dt": now + step * 3 * 3600,
+            "main": obs["main"],
+            "rain": {"3h": obs["rain"]["1h"] * 3},
+        })
+    return {"list": items}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection pooling is exercised
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        qs = parse_qs(parsed.query)
+        try:
+            lat = float(qs["lat"][0])
+            lon = float(qs["lon"][0])
+        except (KeyError, ValueError):
+            self._send(400, {"message": "lat/lon required"})
+            return
+
+        if parsed.path.endswith("/weather"):
+            kind, body = "weather", _observation(lat, lon)
+        elif parsed.path.endswith("/forecast"):
+            kind, body = "forecast", _forecast(lat, lon)
+        else:
+            self._send(404, {"message": "not found"})
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            with _lock:
+                _counts["errors"] += 1
+            self._send(503, {"message": "injected failure"})
+            return
+
+        with _lock:
+            _counts[kind] += 1
+            n = _counts[kind]
+        print(f"{kind} #{n} lat={lat} lon={lon}")
+        self._send(200, body)
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=8090, latency=0.0, error_rate=0.0):
+    handler = type("Handler", (StubHandler,), {"latency": latency, "error_rate": error_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"Stub weather server on http://127.0.0.1:{server.server_port}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    serve(args.port, args.latency, args.error_rate).serve_forever()
@@ -0,0 +1,86 @@
+import bisect
+import itertools
+import json
+import os
+import random
+from types import MappingProxyType
+from typing import NamedTuple
+
+TASKS_FILE = os.getenv(
+    "TASKS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks.json")
+)
+
+
+class Task(NamedTuple):
+    """Immutable quest definition; per-user state lives in the DB, never here."""
+    id: str
+    level: str
+    desc: str
+    points: int
+    type: str
+    weight: float = 1.0
+
+    def view(self, status):
+        """Fresh per-request dict with the user's status overlaid."""
+        return {"id": self.id, "desc": self.desc, "points": self.points, "type": self.type, "status": status}
+
+
+class _SelectionTable(NamedTuple):
+    tasks: tuple
+    cum_weights: tuple
+
+    def choose(self, rng=random):
+        x = rng.random() * self.cum_weights[-1]
+        return self.tasks[bisect.bisect_right(self.cum_weights, x)]
+
+
+class TaskCatalog:
+    """
+    Read-only task catalog: O(1) id lookup and O(log n) weighted selection
+    per risk level. Instances are never mutated after construction, so they
+    can be shared by every request thread; reloading swaps in a new one.
+    """
+
+    def __init__(self, tasks, levels):
+        by_id = {}
+        for t in tasks:
+            if t.id in by_id:
+                raise ValueError(f"Duplicate task id {t.id!r}")
+            by_id[t.id] = t
+        self.by_id = MappingProxyType(by_id)
+
+        # Highest threshold first: the first level whose min_risk <= risk wins.
+        self.levels = tuple(sorted(levels, key=lambda lv: lv[1], reverse=True))
+        tables = {}
+        for level, _ in self.levels:
+            pool = tuple(t for t in tasks if t.level == level and t.weight > 0)
+            if not pool:
+                raise ValueError(f"No tasks for risk level {level!r}")
+            tables[level] = _SelectionTable(pool, tuple(itertools.accumulate(t.weight for t in pool)))
+        self.tables = MappingProxyType(tables)
+
+    def get(self, task_id):
+        return self.by_id.get(task_id)
+
+    def level_for_risk(self, risk_pct):
+        for level, min_risk in self.levels:
+            if risk_pct >= min_risk:
+                return level
+        return self.levels[-1][0]
+
+    def choose(self, risk_pct, rng=random):
+        return self.tables[self.level_for_risk(risk_pct)].choose(rng)
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+def load_catalog(path=None):
+    with open(path or TASKS_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    tasks = [
+        Task(t["id"], t["level"], t["desc"], int(t["points"]), t["type"], float(t.get("weight", 1.0)))
+        for t in data["tasks"]
+    ]
+    levels = [(lv["level"], lv["min_risk"]) for lv in data["levels"]]
+    return TaskCatalog(tasks, levels)
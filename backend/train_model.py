@@ -1,99 +1,260 @@
-import pandas as pd
+import argparse
+import datetime
+import hashlib
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+import joblib
 import numpy as np
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.metrics import r2_score
-import joblib
+
+from ensemble import fit_weights, rule_scores, trend_scores
+from feature_engineering import CHANNELS, FEATURES, WINDOW, rolling_features
+from model_registry import ModelRegistry, rss_bytes, write_metadata
 
 # -------------------------------
-# 1. Load Dataset
+# Configuration
 # -------------------------------
 DATA_FILE = "mekong_dengue_data.csv"
+FEATURE_CACHE_DIR = os.getenv(
+    "FEATURE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".feature_cache")
+)
+CHUNK_ROWS = 500_000
+
+# CSV column for each pipeline channel, and the dtypes they are read with.
+COLUMNS = {"temp": "Temperature", "rainfall": "Rainfall", "humidity": "Humidity", "salinity": "Salinity"}
+LOCATION_COLUMN = "District"
+TIME_COLUMN = "Date"
+TARGET = "Risk_Percentage"
+DTYPES = {**{c: np.float64 for c in COLUMNS.values()}, TARGET: np.float32, LOCATION_COLUMN: "category", TIME_COLUMN: str}
+
+MODELS = {
+    # Exact, single-threaded; the original model.
+    "gbr": GradientBoostingRegressor,
+    # Histogram-based, multi-threaded (OpenMP on all cores); for large datasets.
+    "hgb": HistGradientBoostingRegressor,
+}
+DEFAULT_PARAMS = {
+    "gbr": {"n_estimators": 200, "learning_rate": 0.05, "max_depth": 4, "random_state": 42},
+    "hgb": {"max_iter": 200, "learning_rate": 0.05, "max_leaf_nodes": 31, "early_stopping": False, "random_state": 42},
+}
 
-try:
-    df = pd.read_csv(DATA_FILE)
-except FileNotFoundError:
-    raise FileNotFoundError(
-        "Dataset not found. Please run data_gen.py first to generate training data."
-    )
+def make_model(kind, **params):
+    return MODELS[kind](**{**DEFAULT_PARAMS[kind], **params})
 
 # -------------------------------
-# 2. Feature Engineering
+# Stage Timing
 # -------------------------------
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    rss = rss_bytes()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rss_text = f"{rss / 2**20:,.0f} MB" if rss is not None else "n/a"
+    print(f"⏱️  {name:<18}{elapsed:>8.2f}s   rss {rss_text:>9}   peak {peak_mb:,.0f} MB")
 
-# Sort for time-series style processing (synthetic but consistent)
-df = df.reset_index(drop=True)
+# -------------------------------
+# 1. Load Dataset + 2. Feature Engineering
+# -------------------------------
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
 
-# Rolling averages (simulate lag effects)
-df["temp_avg_7d"] = df["Temperature"].rolling(window=7, min_periods=1).mean()
-df["humidity_avg_7d"] = df["Humidity"].rolling(window=7, min_periods=1).mean()
-df["rain_sum_14d"] = df["Rainfall"].rolling(window=14, min_periods=1).sum()
+def _chunk_features(chunk, carry):
+    """
+    Features for one chunk, windows continuing from the previous chunk.
 
-# Trends (difference over time)
-df["temp_trend"] = df["Temperature"].diff().fillna(0)
-df["rain_trend"] = df["Rainfall"].diff().fillna(0)
+    carry holds the last WINDOW - 1 rows of every location seen so far; it
+    is prepended so windows and trends span the chunk boundary, then its
+    rows are dropped from the output.
+    """
+    X = chunk[[COLUMNS[c] for c in CHANNELS]].to_numpy(dtype=np.float64)
+    if LOCATION_COLUMN not in chunk:
+        # Legacy single-series file: one location.
+        groups = np.zeros(len(chunk), dtype=np.int64)
+    else:
+        groups = chunk[LOCATION_COLUMN].astype(str).to_numpy()
+    if carry is not None:
+        X = np.vstack([carry[0], X])
+        groups = np.concatenate([carry[1], groups])
+    n_carry = 0 if carry is None else len(carry[0])
 
-# Salinity modifier (kept as is)
-df["salinity_flag"] = df["Salinity"]
+    features = rolling_features(X, groups)[n_carry:]
 
-# -------------------------------
-# 3. Define Features & Target
-# -------------------------------
-FEATURES = [
-    "temp_avg_7d",
-    "humidity_avg_7d",
-    "rain_sum_14d",
-    "temp_trend",
-    "rain_trend",
-    "salinity_flag"
-]
-
-X = df[FEATURES]
-y = df["Risk_Percentage"]
+    # New carry: the last WINDOW - 1 rows per location (stable sort keeps time order).
+    order = np.argsort(groups, kind="stable")
+    g = groups[order]
+    last = np.r_[g[1:] != g[:-1], True]
+    ends = np.flatnonzero(last)
+    starts = np.r_[0, ends[:-1] + 1]
+    keep = np.concatenate([order[max(s, e - WINDOW + 2):e + 1] for s, e in zip(starts, ends)])
+    keep.sort()
+    return features, (X[keep], groups[keep])
 
-# -------------------------------
-# 4. Train / Test Split
-# -------------------------------
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
+def load_features(path=DATA_FILE, chunksize=CHUNK_ROWS, cache_dir=FEATURE_CACHE_DIR, data_hash=None):
+    """
+    (X float32 (N, 6), y float32 (N,), t int64 (N,), sha256 of the data file).
 
-# -------------------------------
-# 5. Train Model (Enhanced)
-# -------------------------------
-model = GradientBoostingRegressor(
-    n_estimators=200,
-    learning_rate=0.05,
-    max_depth=4,
-    random_state=42
-)
+    t is each row's day (days since 1970-01-01) when the file has a Date
+    column, else its row number. Reads the CSV chunk by chunk, so only the
+    engineered matrix is held in memory. Results are cached in cache_dir
+    under the file hash and the feature list as .npy files, which are
+    returned memory-mapped on a hit so parallel workers share one copy;
+    pass cache_dir=None to always recompute.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "Dataset not found. Please run data_gen.py first to generate training data."
+        )
+    data_hash = data_hash or file_hash(path)
+    key = hashlib.sha256((data_hash + "|" + ",".join(FEATURES) + f"|{WINDOW}").encode()).hexdigest()[:24]
+    cache = os.path.join(cache_dir, f"features-{key}") if cache_dir else None
+    if cache and os.path.isdir(cache):
+        print(f"🗃️  Feature cache hit: {cache}")
+        arrays = [np.load(os.path.join(cache, f"{name}.npy"), mmap_mode="r") for name in ("X", "y", "t")]
+        return (*arrays, data_hash)
 
-model.fit(X_train, y_train)
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in (*COLUMNS.values(), TARGET, LOCATION_COLUMN, TIME_COLUMN) if c in header]
+    dtypes = {c: DTYPES[c] for c in usecols}
 
-# -------------------------------
-# 6. Evaluate Model
-# -------------------------------
-y_pred = model.predict(X_test)
-r2 = r2_score(y_test, y_pred)
+    xs, ys, ts, carry, seen = [], [], [], None, 0
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        features, carry = _chunk_features(chunk, carry)
+        xs.append(features.astype(np.float32))
+        ys.append(chunk[TARGET].to_numpy(dtype=np.float32))
+        if TIME_COLUMN in chunk:
+            ts.append(pd.to_datetime(chunk[TIME_COLUMN]).to_numpy().astype("datetime64[D]").astype(np.int64))
+        else:
+            ts.append(np.arange(seen, seen + len(chunk), dtype=np.int64))
+        seen += len(chunk)
+    X = np.concatenate(xs) if xs else np.zeros((0, len(FEATURES)), dtype=np.float32)
+    y = np.concatenate(ys) if ys else np.zeros(0, dtype=np.float32)
+    t = np.concatenate(ts) if ts else np.zeros(0, dtype=np.int64)
 
-print("✅ Model training complete")
-print(f"📈 R² Score on test set: {r2:.3f}")
+    if cache:
+        tmp = cache + ".tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for name, arr in (("X", X), ("y", y), ("t", t)):
+            np.save(os.path.join(tmp, f"{name}.npy"), arr)
+        os.replace(tmp, cache)
+    return X, y, t, data_hash
 
-# -------------------------------
-# 7. Save Model
-# -------------------------------
-MODEL_FILE = "dengue_model_v2.pkl"
-joblib.dump(model, MODEL_FILE)
+def load_raw(path=DATA_FILE, chunksize=CHUNK_ROWS):
+    """(N, 4) float64 raw weather in CHANNELS order, row-aligned with load_features."""
+    usecols = [COLUMNS[c] for c in CHANNELS]
+    chunks = pd.read_csv(path, usecols=usecols, dtype={c: DTYPES[c] for c in usecols}, chunksize=chunksize)
+    parts = [chunk[usecols].to_numpy(dtype=np.float64) for chunk in chunks]
+    return np.concatenate(parts) if parts else np.zeros((0, len(CHANNELS)))
 
-print(f"💾 Model saved as '{MODEL_FILE}'")
+def time_split(t, test_size=0.2):
+    """Boolean train mask: everything before the last test_size of days."""
+    days = np.unique(t)
+    cutoff = days[int(len(days) * (1 - test_size))] if len(days) > 1 else days[-1] + 1
+    return t < cutoff
 
 # -------------------------------
-# 8. Feature Importance (Explainability)
+# 3-8. Train, Evaluate, Save
 # -------------------------------
-feature_importance = pd.DataFrame({
-    "feature": FEATURES,
-    "importance": model.feature_importances_
-}).sort_values(by="importance", ascending=False)
+def save_model(model, data_hash, metrics, rows, **extra):
+    """Write model + metadata as the next registry version; returns its path."""
+    # Each run becomes a new registry version; the app serves it once activated
+    # (POST /api/models/activate) or on the next restart.
+    model_file = ModelRegistry().next_version_path()
+    # Uncompressed so the registry can memory-map the tree arrays.
+    joblib.dump(model, model_file)
+    params = {k: v for k, v in model.get_params().items() if isinstance(v, (int, float, str, bool, type(None)))}
+    write_metadata(model_file, {
+        "model_type": type(model).__name__,
+        "params": params,
+        "features": FEATURES,
+        "training_hash": data_hash,
+        "metrics": metrics,
+        "rows": int(rows),
+        "trained_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        **extra,
+    })
+    return model_file
+
+def fit_ensemble(ml, raw, engineered, y, t):
+    """
+    Stack the held-out ML predictions with the rule and trend scores.
+
+    Weights are fitted on the earlier half of the held-out days and scored
+    on the later half, then refitted on all of them. Returns (Ensemble,
+    {"ml": r2, "ensemble": r2} on the later half).
+    """
+    rule, trend = rule_scores(raw), trend_scores(engineered)
+    first = time_split(t, test_size=0.5)
+    held = fit_weights(ml[first], rule[first], trend[first], y[first])
+    later = ~first
+    if not first.any() or not later.any():
+        # Single held-out day: nothing to validate the weights on.
+        return fit_weights(ml, rule, trend, y), {"ml": float(r2_score(y, ml)), "ensemble": float("nan")}
+    scores = {
+        "ml": float(r2_score(y[later], ml[later])),
+        "ensemble": float(r2_score(y[later], held.predict(ml[later], rule[later], trend[later]))),
+    }
+    return fit_weights(ml, rule, trend, y), scores
+
+def train(path=DATA_FILE, kind="gbr", chunksize=CHUNK_ROWS, cache_dir=FEATURE_CACHE_DIR):
+    with stage("load + features"):
+        X, y, t, data_hash = load_features(path, chunksize, cache_dir)
+    print(f"📊 {len(X):,} rows, {X.nbytes / 2**20:,.1f} MB feature matrix")
+
+    # Hold out the most recent 20% of days: a random split would let the
+    # model see the future of the days it is tested on.
+    with stage("split"):
+        train_mask = time_split(t)
+        X_train, X_test, y_train, y_test = X[train_mask], X[~train_mask], y[train_mask], y[~train_mask]
+
+    model = make_model(kind)
+    with stage(f"fit ({kind})"):
+        model.fit(X_train, y_train)
+
+    with stage("evaluate"):
+        y_pred = model.predict(X_test)
+        r2 = r2_score(y_test, y_pred)
+
+    print("✅ Model training complete")
+    print(f"📈 R² Score on test set: {r2:.3f}")
+
+    with stage("stack ensemble"):
+        ensemble, ensemble_r2 = fit_ensemble(y_pred, load_raw(path, chunksize)[~train_mask], X_test, y_test, t[~train_mask])
+    print(f"🧮 Ensemble weights {ensemble.describe()['weights']}, intercept {ensemble.intercept:.2f}")
+    print(f"📈 R² on the later half of the test set: ML {ensemble_r2['ml']:.3f}, ensemble {ensemble_r2['ensemble']:.3f}")
+
+    with stage("save"):
+        metrics = {"r2": round(float(r2), 4), "ensemble_r2": round(ensemble_r2["ensemble"], 4)}
+        fitted = {k: v for k, v in ensemble.describe().items() if k != "source"}
+        model_file = save_model(model, data_hash, metrics, len(X), ensemble=fitted)
+    print(f"💾 Model saved as '{model_file}'")
+
+    if hasattr(model, "feature_importances_"):
+        feature_importance = pd.DataFrame({
+            "feature": FEATURES,
+            "importance": model.feature_importances_
+        }).sort_values(by="importance", ascending=False)
+
+        print("\n🔍 Feature Importance:")
+        print(feature_importance.to_string(index=False))
+    return model, model_file
+
 
-print("\n🔍 Feature Importance:")
-print(feature_importance.to_string(index=False))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the dengue risk model")
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--model", choices=sorted(MODELS), default="gbr")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--no-cache", action="store_true", help="recompute features even if cached")
+    args = parser.parse_args()
+    train(args.data, args.model, args.chunksize, None if args.no_cache else FEATURE_CACHE_DIR)
@@ -0,0 +1,296 @@
+"""
+Flattened tree-ensemble inference.
+
+FlatEnsemble copies a fitted GradientBoostingRegressor or
+HistGradientBoostingRegressor into flat NumPy arrays (feature, threshold,
+left, right, leaf value per node, every tree concatenated) and predicts by
+walking all trees at once: one vectorized step per tree level instead of
+one sklearn call per tree. Single-row requests, which /api/risk and
+/api/daily-task make, avoid sklearn's per-call input validation and
+per-tree dispatch.
+
+Results are bit-for-bit identical to model.predict:
+- GBR compares float32 inputs with float64 thresholds, as sklearn does.
+- Leaf values are pre-multiplied by the learning rate, the same single
+  rounding as sklearn's `out += scale * value`.
+- Trees are added to the baseline one at a time, in stage order, with a
+  cumulative sum (np.sum would use pairwise summation and round differently).
+compile_model() checks this on random inputs before the model is served and
+returns None (keep sklearn) if anything differs.
+
+    python tree_inference.py [model.pkl]   # p50/p99 latency, sklearn vs flat
+"""
+import os
+import time
+
+import numpy as np
+
+# Serve flattened ensembles when possible (0 = always use sklearn predict).
+FLAT_INFERENCE = os.getenv("FLAT_INFERENCE", "1") == "1"
+# Above this many rows sklearn's compiled per-row loop is faster than the
+# vectorized walk, so larger batches are delegated to the estimator.
+FLAT_MAX_ROWS = int(os.getenv("FLAT_MAX_ROWS", 32))
+
+
+class FlatEnsemble:
+    __slots__ = ("feature", "threshold", "left", "right", "value", "missing_left", "roots",
+                 "baseline", "depth", "x_dtype", "n_features_in_", "source", "estimator")
+
+    def __init__(self, feature, threshold, left, right, value, missing_left, roots, baseline, depth,
+                 x_dtype, n_features, source):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.missing_left = missing_left
+        self.roots = roots
+        self.baseline = baseline
+        self.depth = depth
+        self.x_dtype = x_dtype
+        self.n_features_in_ = n_features
+        self.source = source
+        self.estimator = None
+
+    # --- export ---
+
+    @classmethod
+    def from_model(cls, model):
+        name = type(model).__name__
+        if name == "GradientBoostingRegressor":
+            flat = cls._from_gbr(model)
+        elif name == "HistGradientBoostingRegressor":
+            flat = cls._from_hgb(model)
+        else:
+            raise TypeError(f"unsupported model type {name}")
+        flat.estimator = model
+        return flat
+
+    @classmethod
+    def _from_gbr(cls, model):
+        from sklearn.dummy import DummyRegressor
+
+        if not (model.init_ == "zero" or isinstance(model.init_, DummyRegressor)):
+            raise TypeError("only constant init estimators are supported")
+        n_features = model.n_features_in_
+        baseline = float(model._raw_predict_init(np.zeros((1, n_features)))[0, 0])
+        trees = [est.tree_ for est in model.estimators_[:, 0]]
+
+        parts, offset, depth = [], 0, 0
+        for tree in trees:
+            leaf = tree.children_left < 0
+            node = np.arange(tree.node_count)
+            parts.append((
+                np.where(leaf, 0, tree.feature),
+                np.where(leaf, np.inf, tree.threshold),
+                np.where(leaf, node, tree.children_left) + offset,
+                np.where(leaf, node, tree.children_right) + offset,
+                # Same single rounding as sklearn's `scale * value`.
+                model.learning_rate * tree.value[:, 0, 0],
+                np.zeros(tree.node_count, dtype=bool),
+            ))
+            offset += tree.node_count
+            depth = max(depth, tree.max_depth)
+        return cls._assemble(parts, [len(p[0]) for p in parts], baseline, depth, np.float32, n_features, "gbr")
+
+    @classmethod
+    def _from_hgb(cls, model):
+        if getattr(model, "n_trees_per_iteration_", 1) != 1:
+            raise TypeError("only single-output models are supported")
+        baseline = float(np.asarray(model._baseline_prediction).ravel()[0])
+        parts, sizes, offset, depth = [], [], 0, 0
+        for (predictor,) in model._predictors:
+            nodes = predictor.nodes
+            if nodes["is_categorical"].any():
+                raise TypeError("categorical splits are not supported")
+            leaf = nodes["is_leaf"].astype(bool)
+            node = np.arange(len(nodes))
+            parts.append((
+                np.where(leaf, 0, nodes["feature_idx"]),
+                np.where(leaf, np.inf, nodes["num_threshold"]),
+                np.where(leaf, node, nodes["left"]) + offset,
+                np.where(leaf, node, nodes["right"]) + offset,
+                # Leaf values are already shrunk by the learning rate; internal
+                # values (used only for contributions) are not.
+                np.where(leaf, nodes["value"], nodes["value"] * model.learning_rate).astype(np.float64),
+                nodes["missing_go_to_left"].astype(bool),
+            ))
+            sizes.append(len(nodes))
+            offset += len(nodes)
+            depth = max(depth, int(nodes["depth"].max()))
+        return cls._assemble(parts, sizes, baseline, depth, np.float64, model.n_features_in_, "hgb")
+
+    @classmethod
+    def _assemble(cls, parts, sizes, baseline, depth, x_dtype, n_features, source):
+        cols = list(zip(*parts))
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        return cls(
+            np.concatenate(cols[0]).astype(np.int32),
+            np.concatenate(cols[1]).astype(np.float64),
+            np.concatenate(cols[2]).astype(np.int32),
+            np.concatenate(cols[3]).astype(np.int32),
+            np.concatenate(cols[4]).astype(np.float64),
+            np.concatenate(cols[5]),
+            roots, baseline, depth, x_dtype, n_features, source,
+        )
+
+    # --- inference ---
+
+    def _leaves(self, X):
+        """(rows, trees) leaf node index for every row of X (already x_dtype)."""
+        rows = np.arange(len(X))[:, None]
+        idx = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = X[rows, self.feature[idx]]
+            go_left = x <= self.threshold[idx]
+            if self.source == "hgb":
+                go_left = np.where(np.isnan(x), self.missing_left[idx], go_left)
+            idx = np.where(go_left, self.left[idx], self.right[idx])
+        return idx
+
+    def _leaves_row(self, x):
+        """Leaf node index in every tree for a single row (1-D fast path)."""
+        idx = self.roots
+        for _ in range(self.depth):
+            v = x[self.feature[idx]]
+            go_left = v <= self.threshold[idx]
+            if self.source == "hgb":
+                go_left = np.where(np.isnan(v), self.missing_left[idx], go_left)
+            idx = np.where(go_left, self.left[idx], self.right[idx])
+        return idx
+
+    def _sum(self, leaf_values):
+        # Sequential, stage-ordered accumulation onto the baseline.
+        acc = np.empty((leaf_values.shape[0], leaf_values.shape[1] + 1))
+        acc[:, 0] = self.baseline
+        acc[:, 1:] = leaf_values
+        return np.cumsum(acc, axis=1)[:, -1]
+
+    def predict(self, X, flat_only=False):
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.n_features_in_)
+        if len(X) > FLAT_MAX_ROWS and self.estimator is not None and not flat_only:
+            return self.estimator.predict(X)
+        Xc = X.astype(self.x_dtype, copy=False)
+        if len(Xc) == 1:
+            return self._sum(self.value[self._leaves_row(Xc[0])][None, :])
+        return self._sum(self.value[self._leaves(Xc)])
+
+    def contributions(self, X):
+        """
+        Tree-path (Saabas) attributions: (bias (N,), contributions (N, F)).
+
+        Along each row's path through every tree, the change in node value
+        at a split is credited to the split feature; bias is the baseline
+        plus every root value. bias + contributions.sum(1) equals predict(X)
+        up to float rounding.
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.n_features_in_).astype(self.x_dtype, copy=False)
+        rows = np.arange(len(X))[:, None]
+        idx = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        contrib = np.zeros((len(X), self.n_features_in_))
+        for _ in range(self.depth):
+            feat = self.feature[idx]
+            x = X[rows, feat]
+            go_left = x <= self.threshold[idx]
+            if self.source == "hgb":
+                go_left = np.where(np.isnan(x), self.missing_left[idx], go_left)
+            nxt = np.where(go_left, self.left[idx], self.right[idx])
+            # Leaves point at themselves, so their delta is 0.
+            delta = self.value[nxt] - self.value[idx]
+            for f in range(self.n_features_in_):
+                contrib[:, f] += np.where(feat == f, delta, 0.0).sum(axis=1)
+            idx = nxt
+        bias = np.full(len(X), self.baseline + self.value[self.roots].sum())
+        return bias, contrib
+
+    def describe(self):
+        return {"engine": "flat", "source": self.source, "trees": len(self.roots),
+                "nodes": len(self.feature), "depth": self.depth}
+
+
+def _probe_inputs(flat, n, rng):
+    """Random rows spanning each feature's thresholds, plus exact threshold hits."""
+    X = np.empty((n, flat.n_features_in_))
+    internal = np.isfinite(flat.threshold)
+    for f in range(flat.n_features_in_):
+        thr = flat.threshold[internal & (flat.feature == f)]
+        lo, hi = (thr.min(), thr.max()) if len(thr) else (0.0, 1.0)
+        pad = (hi - lo) * 0.1 + 1.0
+        X[:, f] = rng.uniform(lo - pad, hi + pad, n)
+        if len(thr):
+            hits = rng.random(n) < 0.1
+            X[hits, f] = rng.choice(thr, hits.sum())
+    return X
+
+def compile_model(model, n_check=2000, seed=0):
+    """FlatEnsemble for model if supported and bit-identical on a probe set, else None."""
+    try:
+        flat = FlatEnsemble.from_model(model)
+    except (TypeError, AttributeError, ValueError) as e:
+        print(f"Flat inference unavailable for {type(model).__name__}: {e}")
+        return None
+    X = _probe_inputs(flat, n_check, np.random.default_rng(seed))
+    expected = model.predict(X)
+    single = np.concatenate([flat.predict(row) for row in X[:64]])
+    if not (np.array_equal(flat.predict(X, flat_only=True), expected) and np.array_equal(single, expected[:64])):
+        print(f"Flat inference differs from {type(model).__name__}.predict; using sklearn")
+        return None
+    return flat
+
+# --------------------
+# Benchmark
+# --------------------
+def _latencies(fn, rows, repeat):
+    out = np.empty(repeat)
+    for i in range(repeat):
+        row = rows[i % len(rows)]
+        start = time.perf_counter()
+        fn(row)
+        out[i] = time.perf_counter() - start
+    return out * 1e6
+
+def benchmark(model, repeat=2000, batch_sizes=(8, 32, 128, 1_000)):
+    flat = compile_model(model)
+    if flat is None:
+        raise SystemExit("model could not be flattened")
+    rng = np.random.default_rng(1)
+    rows = _probe_inputs(flat, 512, rng).reshape(512, 1, -1)
+
+    print(f"{type(model).__name__}: {flat.describe()}")
+    print(f"{'single row':<14}{'p50 us':>10}{'p99 us':>10}")
+    for label, fn in (("sklearn", model.predict), ("flat", flat.predict)):
+        lat = _latencies(fn, rows, repeat)
+        print(f"{label:<14}{np.percentile(lat, 50):>10.1f}{np.percentile(lat, 99):>10.1f}")
+
+    print(f"{'batch rows':<14}{'sklearn us/row':>16}{'flat us/row':>13}{'identical':>11}")
+    for n in batch_sizes:
+        X = _probe_inputs(flat, n, rng)
+        start = time.perf_counter()
+        a = model.predict(X)
+        sk = (time.perf_counter() - start) / n * 1e6
+        start = time.perf_counter()
+        b = flat.predict(X, flat_only=True)
+        fl = (time.perf_counter() - start) / n * 1e6
+        print(f"{n:<14,}{sk:>16.2f}{fl:>13.2f}{str(np.array_equal(a, b)):>11}")
+    print(f"(batches over FLAT_MAX_ROWS={FLAT_MAX_ROWS} are delegated to sklearn when serving)")
+
+if __name__ == "__main__":
+    import argparse
+
+    import joblib
+
+    parser = argparse.ArgumentParser(description="sklearn vs flattened ensemble latency")
+    parser.add_argument("model", nargs="?", help="model .pkl (default: active registry model)")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.model:
+        model = joblib.load(args.model)
+    else:
+        from model_registry import ModelRegistry
+
+        info, _ = ModelRegistry(compile=None).get()
+        model = info.model if info is not None else None
+        if model is None:
+            raise SystemExit("no loadable model in the registry; pass a .pkl path")
+    benchmark(model, args.repeat)
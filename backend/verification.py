@@ -0,0 +1,336 @@
+"""
+Off-request photo verification for daily tasks.
+
+POST /api/tasks/verify streams the photo into a content-addressed store
+(VERIFY_STORE_PATH/ab/abcd..., named by its SHA-256, so a re-submitted photo
+is kept once), records a job in SQLite (the same photo for the same task
+maps to the existing job) and hands the file to a process pool. When the
+verifier returns, the result is written back and, if the photo passed,
+on_verified(job) completes the task. Clients poll
+GET /api/tasks/verify/<job_id>, optionally long-polling with ?wait=N.
+Jobs without a result at startup are submitted again.
+
+Verifiers run in the worker processes, so they must be module-level
+functions: verifier(path, task_type) -> (verified, reason). Register more
+with register_verifier(); VERIFIER picks one.
+"""
+import base64
+import binascii
+import datetime
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import db
+from http_client import LATENCY_BUCKETS_MS
+
+VERIFY_STORE_PATH = os.getenv(
+    "VERIFY_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"),
+)
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", 2))
+VERIFIER = os.getenv("VERIFIER", "basic")
+VERIFY_MAX_BYTES = int(os.getenv("VERIFY_MAX_BYTES", 10 * 1024 * 1024))
+# Seconds a legacy (base64 JSON) request waits for its result before getting a 202.
+VERIFY_WAIT = float(os.getenv("VERIFY_WAIT", 10))
+# Longest ?wait= a status request may hold the connection for.
+VERIFY_MAX_WAIT = 30.0
+CHUNK_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# --------------------
+# Image Store
+# --------------------
+class ImageStore:
+    """Uploads on disk, named by SHA-256 of their content."""
+
+    def __init__(self, root=VERIFY_STORE_PATH, max_bytes=VERIFY_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "deduplicated": 0, "bytes_stored": 0}
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put_stream(self, stream):
+        """Copy `stream` into the store chunk by chunk; returns its digest."""
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError(f"Photo is larger than {self.max_bytes // (1024 * 1024)} MB", 413)
+                    sha.update(chunk)
+                    f.write(chunk)
+            if not size:
+                raise UploadError("No image provided. Please upload a photo to verify.")
+            digest = sha.hexdigest()
+            path = self.path(digest)
+            with self._lock:
+                if os.path.exists(path):
+                    self._stats["deduplicated"] += 1
+                    return digest
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                self._stats["stored"] += 1
+                self._stats["bytes_stored"] += size
+            return digest
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def put_base64(self, data):
+        """Legacy uploads: base64 text, optionally a data: URL."""
+        if data.startswith("data:"):
+            data = data.partition(",")[2]
+        try:
+            raw = base64.b64decode(data, validate=False)
+        except (binascii.Error, ValueError):
+            raise UploadError("Image is not valid base64")
+        return self.put_stream(_BytesReader(raw))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class _BytesReader:
+    def __init__(self, data):
+        self._view = memoryview(data)
+
+    def read(self, n):
+        chunk, self._view = self._view[:n], self._view[n:]
+        return bytes(chunk)
+
+# --------------------
+# Verifiers
+# --------------------
+_IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"RIFF")
+MIN_IMAGE_BYTES = 1024
+
+def accept_verifier(path, task_type):
+    """Trusts any upload (the behaviour before verification existed)."""
+    return True, "accepted"
+
+def basic_verifier(path, task_type):
+    """Accepts JPEG/PNG/GIF/WebP files of a plausible photo size."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if not head.startswith(_IMAGE_SIGNATURES) or (head.startswith(b"RIFF") and head[8:12] != b"WEBP"):
+        return False, "not an image"
+    if os.path.getsize(path) < MIN_IMAGE_BYTES:
+        return False, "image too small"
+    return True, "image ok"
+
+
+VERIFIERS = {"accept": accept_verifier, "basic": basic_verifier}
+
+def register_verifier(name, verifier):
+    """Make a module-level function verifier(path, task_type) -> (verified, reason) available as VERIFIER=name."""
+    VERIFIERS[name] = verifier
+
+
+def _run_verifier(verifier, path, task_type):
+    """Worker-process entry point: the verdict plus when it started and ended."""
+    started_at = time.time()
+    verified, reason = verifier(path, task_type)
+    return bool(verified), reason, started_at, time.time()
+
+def _warm_up():
+    return None
+
+# --------------------
+# Queue
+# --------------------
+class VerificationQueue:
+    """
+    on_verified(job) -> (points, message) is called in the parent process for
+    every photo that passes; job is the dict returned by status().
+    """
+
+    def __init__(self, store=None, verifier=None, workers=VERIFY_WORKERS):
+        self.store = store or ImageStore()
+        self.verifier = verifier or VERIFIERS[VERIFIER]
+        self.workers = workers
+        self.on_verified = None
+        self.task_type = lambda task_id: None
+        # Workers are forked up front: the app calls this before starting any
+        # background thread, and "spawn" would re-import the app in every worker.
+        self._pool = self._new_pool()
+        for _ in range(workers):
+            self._pool.submit(_warm_up)
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._finished = 0
+        self._buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._stats = {"submitted": 0, "resubmitted": 0, "verified": 0, "rejected": 0, "errors": 0,
+                       "pool_restarts": 0, "wait_ms_total": 0.0, "verify_ms_total": 0.0}
+
+    def start(self, on_verified, task_type=None):
+        """
+        Resubmit jobs left over from a previous run. task_type(task_id) gives
+        the verifier the kind of action the photo should show.
+        """
+        self.on_verified = on_verified
+        self.task_type = task_type or self.task_type
+        for job_id in db.queued_verifications():
+            row = db.get_verification(job_id)
+            self._submit(job_id, row[2], row[4])
+        return self
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # --- API ---
+
+    def submit(self, user_id, task_id, date_str, stream=None, base64_data=None):
+        """Store the photo and queue it; returns (job id, whether it was already submitted)."""
+        digest = self.store.put_stream(stream) if stream is not None else self.store.put_base64(base64_data)
+        job_id, queued = db.create_verification(user_id, task_id, date_str, digest, time.time())
+        if queued:
+            self._submit(job_id, task_id, digest)
+        else:
+            with self._cond:
+                self._stats["resubmitted"] += 1
+        return job_id, not queued
+
+    def status(self, job_id):
+        row = db.get_verification(job_id)
+        if row is None:
+            return None
+        (job_id, user_id, task_id, date_str, digest, status, verified, points, message,
+         created_at, started_at, finished_at) = row
+        return {
+            "job_id": job_id,
+            "user_id": user_id,
+            "task_id": task_id,
+            "date": date_str,
+            "image_hash": digest,
+            "status": status,
+            "verified": None if verified is None else bool(verified),
+            "points_earned": points,
+            "message": message,
+            "queued_ms": _ms(created_at, started_at),
+            "verify_ms": _ms(started_at, finished_at),
+            "created_at": _iso(created_at),
+            "finished_at": _iso(finished_at),
+        }
+
+    def wait(self, job_id, timeout):
+        """status(job_id) once it has a result, or as it is after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                finished = self._finished
+            job = self.status(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] != "queued" or remaining <= 0:
+                return job
+            with self._cond:
+                if self._finished == finished:
+                    self._cond.wait(remaining)
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s["queue_depth"] = self._queued
+            buckets = list(self._buckets)
+        done = s["verified"] + s["rejected"]
+        s["wait_ms_avg"] = round(s.pop("wait_ms_total") / done, 1) if done else 0.0
+        s["verify_ms_avg"] = round(s.pop("verify_ms_total") / done, 1) if done else 0.0
+        labels = [f"le_{b}ms" for b in LATENCY_BUCKETS_MS] + ["inf"]
+        s["latency_histogram"] = dict(zip(labels, buckets))
+        s["workers"] = self.workers
+        s["verifier"] = self.verifier.__name__
+        s["store"] = self.store.stats()
+        return s
+
+    # --- results ---
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+
+    def _replace_pool(self, broken):
+        """Swap in a fresh pool after a worker died; the jobs it held fail as errors."""
+        with self._cond:
+            if self._pool is not broken:
+                return
+            self._pool = self._new_pool()
+            self._stats["pool_restarts"] += 1
+        print("Verification worker died; restarted the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, job_id, task_id, digest):
+        with self._cond:
+            self._queued += 1
+            self._stats["submitted"] += 1
+            pool = self._pool
+        try:
+            future = pool.submit(_run_verifier, self.verifier, self.store.path(digest), self.task_type(task_id))
+        except BrokenProcessPool as e:
+            self._replace_pool(pool)
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda f: self._finish(job_id, f, pool))
+
+    def _finish(self, job_id, future, pool):
+        # Runs on the pool's result thread; keep it to a few quick writes.
+        status, verified, points, message = "error", None, 0, "Verification failed. Please try again."
+        started_at = finished_at = time.time()
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._replace_pool(pool)
+        try:
+            verified, reason, started_at, finished_at = future.result()
+            if verified:
+                points, message = self.on_verified(self.status(job_id))
+            else:
+                message = f"Could not verify the action ({reason}). Please try again."
+            status = "done"
+        except Exception as e:
+            print(f"Verification job {job_id} failed: {e}")
+        try:
+            db.finish_verification(job_id, status, verified, points, message, started_at, finished_at)
+        except Exception as e:
+            print(f"Verification job {job_id}: could not record result: {e}")
+        row = db.get_verification(job_id)
+        created_at = row[9] if row else started_at
+        total_ms = (finished_at - created_at) * 1000
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and total_ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        with self._cond:
+            self._queued -= 1
+            self._finished += 1
+            if status == "error":
+                self._stats["errors"] += 1
+            else:
+                self._stats["verified" if verified else "rejected"] += 1
+                self._stats["wait_ms_total"] += (started_at - created_at) * 1000
+                self._stats["verify_ms_total"] += (finished_at - started_at) * 1000
+                self._buckets[i] += 1
+            self._cond.notify_all()
+
+
+def _ms(start, end):
+    return round((end - start) * 1000, 1) if start and end else None
+
+def _iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(timespec="seconds") if ts else None
@@ -0,0 +1,134 @@
+import datetime
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from http_client import UpstreamError, upstream
+from weather_cache import WeatherCache
+
+load_dotenv()
+
+OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+# Point this at a local stub (see stub_weather.py) for testing.
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org").rstrip("/")
+
+weather_cache = WeatherCache()
+openweather = upstream("openweather")
+
+# --------------------
+# Upstream Fetchers
+# --------------------
+def fetch_real_weather(lat, lon):
+    try:
+        url = (
+            f"{OPENWEATHER_BASE_URL}/data/2.5/weather"
+            f"?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
+        )
+        r = openweather.get(url)
+        if r.status_code == 200:
+            d = r.json()
+            return {
+                "temp": d["main"]["temp"],
+                "humidity": d["main"]["humidity"],
+                "rainfall": d.get("rain", {}).get("1h", 0) * 24,
+                "salinity": 0.5,
+            }
+    except UpstreamError as e:
+        print("Weather error:", e)
+    except (KeyError, TypeError, ValueError) as e:
+        print("Weather parse error:", e)
+    return None
+
+def fetch_forecast(lat, lon):
+    try:
+        url = (
+            f"{OPENWEATHER_BASE_URL}/data/2.5/forecast"
+            f"?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
+        )
+        r = openweather.get(url)
+        if r.status_code != 200:
+            return None
+        return parse_forecast(r.json())
+    except UpstreamError as e:
+        print("Forecast error:", e)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        print("Forecast parse error:", e)
+    return None
+
+# --------------------
+# Forecast Ingestion
+# --------------------
+# Columns of DailyForecast.steps (one row per 3-hour forecast step).
+FORECAST_COLUMNS = ("dt", "temp", "humidity", "rain_3h")
+
+
+class DailyForecast:
+    """
+    A 5-day/3-hour forecast parsed once into a (steps x FORECAST_COLUMNS)
+    array, with per-day aggregates for every day it covers.
+    """
+    __slots__ = ("steps", "days", "temp", "humidity", "rainfall")
+
+    def __init__(self, steps):
+        self.steps = steps
+
+        # Local calendar day of every step, matching datetime.fromtimestamp().
+        utc_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+        day = ((steps[:, 0] + utc_offset) // 86400).astype(np.int64)
+        self.days, idx = np.unique(day, return_inverse=True)
+
+        counts = np.bincount(idx)
+        self.temp = np.bincount(idx, weights=steps[:, 1]) / counts
+        self.humidity = np.bincount(idx, weights=steps[:, 2]) / counts
+        self.rainfall = np.bincount(idx, weights=steps[:, 3]) * 4
+
+    def for_date(self, target_date):
+        epoch_day = (target_date - datetime.date(1970, 1, 1)).days
+        i = np.searchsorted(self.days, epoch_day)
+        if i < len(self.days) and self.days[i] == epoch_day:
+            temp, humidity, rainfall = self.temp[i], self.humidity[i], self.rainfall[i]
+        else:
+            # Beyond the forecast horizon: fall back to the last step.
+            _, temp, humidity, rain_3h = self.steps[-1]
+            rainfall = rain_3h * 4
+        return {
+            "temp": float(temp),
+            "humidity": float(humidity),
+            "rainfall": float(rainfall),
+            "salinity": 0.5,
+        }
+
+    def for_days_ahead(self, days_ahead, now=None):
+        now = now or datetime.datetime.now()
+        return self.for_date((now + datetime.timedelta(days=days_ahead)).date())
+
+
+def parse_forecast(data):
+    items = data["list"]
+    steps = np.empty((len(items), len(FORECAST_COLUMNS)), dtype=np.float64)
+    for i, x in enumerate(items):
+        steps[i] = (x["dt"], x["main"]["temp"], x["main"]["humidity"], x.get("rain", {}).get("3h", 0))
+    if not len(steps):
+        raise ValueError("empty forecast list")
+    return DailyForecast(steps)
+
+# --------------------
+# Cached Helpers (used by the API)
+# --------------------
+def get_real_weather(lat, lon):
+    if not OPENWEATHER_API_KEY:
+        return None
+    return weather_cache.get("observation", lat, lon, fetch_real_weather)
+
+def get_forecast(lat, lon):
+    """Parsed DailyForecast for the grid cell around (lat, lon), or None."""
+    if not OPENWEATHER_API_KEY:
+        return None
+    return weather_cache.get("forecast", lat, lon, fetch_forecast)
+
+def get_forecast_weather(lat, lon, days_ahead=2):
+    forecast = get_forecast(lat, lon)
+    if forecast is None:
+        return None
+    return forecast.for_days_ahead(days_ahead)
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --------------------
+# Configuration
+# --------------------
+# Grid cell size in degrees (0.05° ≈ 5.5 km in the Mekong Delta). Every
+# lat/lon inside one cell shares a single upstream weather lookup.
+WEATHER_CACHE_GRID = float(os.getenv("WEATHER_CACHE_GRID", 0.05))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 600))
+# Extra time past the TTL during which a stale value is still served while
+# a background refresh runs.
+WEATHER_CACHE_STALE = float(os.getenv("WEATHER_CACHE_STALE", 1800))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 4096))
+
+
+def grid_cell(lat, lon, grid=WEATHER_CACHE_GRID):
+    return (int(round(lat / grid)), int(round(lon / grid)))
+
+
+def cell_center(cell, grid=WEATHER_CACHE_GRID):
+    return (round(cell[0] * grid, 6), round(cell[1] * grid, 6))
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class _InFlight:
+    __slots__ = ("event", "value")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class WeatherCache:
+    """
+    TTL + LRU cache keyed on (kind, grid cell).
+
+    - Concurrent misses for the same key share one upstream fetch.
+    - Entries older than `ttl` but younger than `ttl + stale_ttl` are served
+      immediately while a single background thread refreshes them.
+    - `fetch(lat, lon)` is always called with the cell centre, so every
+      caller in a cell sees the same value.
+    """
+
+    def __init__(self, grid=WEATHER_CACHE_GRID, ttl=WEATHER_CACHE_TTL,
+                 stale_ttl=WEATHER_CACHE_STALE, max_entries=WEATHER_CACHE_SIZE):
+        self.grid = grid
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "fetch_errors": 0,
+            "evictions": 0,
+            "fetches": 0,
+            "fetch_ms_total": 0.0,
+            "fetch_ms_max": 0.0,
+        }
+
+    def key(self, kind, lat, lon):
+        return (kind,) + grid_cell(lat, lon, self.grid)
+
+    def get(self, kind, lat, lon, fetch):
+        key = self.key(kind, lat, lon)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry.value
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if key not in self._inflight:
+                        self._inflight[key] = _InFlight()
+                        self._stats["refreshes"] += 1
+                        threading.Thread(
+                            target=self._fetch, args=(key, fetch), daemon=True
+                        ).start()
+                    return entry.value
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = _InFlight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if pending is not None:
+            pending.event.wait()
+            return pending.value
+
+        return self._fetch(key, fetch)
+
+    def _fetch(self, key, fetch):
+        lat, lon = cell_center(key[1:], self.grid)
+        start = time.perf_counter()
+        value = None
+        try:
+            value = fetch(lat, lon)
+        except Exception as e:
+            print("Weather cache fetch error:", e)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            pending = self._inflight.pop(key, None)
+            self._stats["fetches"] += 1
+            self._stats["fetch_ms_total"] += elapsed_ms
+            self._stats["fetch_ms_max"] = max(self._stats["fetch_ms_max"], elapsed_ms)
+
+            if value is None:
+                # Keep serving whatever we had; failures are not cached.
+                self._stats["fetch_errors"] += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    value = entry.value
+            else:
+                self._entries[key] = _Entry(value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+
+        if pending is not None:
+            pending.value = value
+            pending.event.set()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["entries"] = len(self._entries)
+            s["inflight"] = len(self._inflight)
+
+        lookups = s["hits"] + s["stale_hits"] + s["misses"] + s["coalesced"]
+        s["hit_rate"] = round((s["hits"] + s["stale_hits"] + s["coalesced"]) / lookups, 4) if lookups else 0.0
+        s["fetch_ms_avg"] = round(s["fetch_ms_total"] / s["fetches"], 2) if s["fetches"] else 0.0
+        s["fetch_ms_total"] = round(s["fetch_ms_total"], 2)
+        s["fetch_ms_max"] = round(s["fetch_ms_max"], 2)
+        s["grid"] = self.grid
+        s["ttl"] = self.ttl
+        s["stale_ttl"] = self.stale_ttl
+        s["max_entries"] = self.max_entries
+        return s
@@ -0,0 +1,269 @@
+"""
+Per-location daily weather history, persisted in memory-mapped .npy files.
+
+Each weather grid cell (weather_cache.grid_cell) owns one row of a
+(capacity, WINDOW, 4) array. A day's observation goes in slot
+day % WINDOW, and a parallel array records which day each slot holds, so
+gaps and out-of-order backfills need no bookkeeping: a slot only counts for
+a window if it holds exactly the day asked for.
+
+Files (prefix = WEATHER_HISTORY_PATH):
+    <prefix>.values.npy  float64 (capacity, WINDOW, 4) readings, CHANNELS order
+    <prefix>.days.npy    int64   (capacity, WINDOW) day ordinal of each slot
+    <prefix>.cells.npy   int64   (capacity, 2) grid cell of each row
+
+Writes land in the OS page cache and are flushed every
+WEATHER_HISTORY_FLUSH seconds and at exit, so a restart picks up the
+history without refetching. One process should own the files; other
+processes may open them read-only.
+"""
+import atexit
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+from feature_engineering import CHANNELS, WINDOW
+from weather_cache import WEATHER_CACHE_GRID, grid_cell
+
+WEATHER_HISTORY_PATH = os.getenv(
+    "WEATHER_HISTORY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_history"),
+)
+WEATHER_HISTORY_CAPACITY = int(os.getenv("WEATHER_HISTORY_CAPACITY", 1024))
+WEATHER_HISTORY_FLUSH = float(os.getenv("WEATHER_HISTORY_FLUSH", 30))
+
+_EMPTY = np.iinfo(np.int64).min
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# CSV column names accepted by backfill_csv for each channel.
+CSV_COLUMNS = {
+    "temp": ("temp", "Temperature"),
+    "rainfall": ("rainfall", "Rainfall"),
+    "humidity": ("humidity", "Humidity"),
+    "salinity": ("salinity", "Salinity"),
+}
+
+
+class WeatherHistory:
+    def __init__(self, path=WEATHER_HISTORY_PATH, capacity=WEATHER_HISTORY_CAPACITY,
+                 flush_interval=WEATHER_HISTORY_FLUSH):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._open(capacity)
+        atexit.register(self.flush)
+
+    # --- storage ---
+
+    def _file(self, name):
+        return f"{self.path}.{name}.npy"
+
+    def _open(self, capacity):
+        if os.path.exists(self._file("cells")):
+            self.values = np.load(self._file("values"), mmap_mode="r+")
+            self.days = np.load(self._file("days"), mmap_mode="r+")
+            self.cells = np.load(self._file("cells"), mmap_mode="r+")
+            capacity = min(len(self.values), len(self.days), len(self.cells))
+            if not len(self.values) == len(self.days) == len(self.cells):
+                # A crash between _create's renames left files of two capacities;
+                # rows below the smaller one are in every file, so rewrite at that size.
+                print(f"Weather history {self.path}: files disagree on capacity, repairing at {capacity}")
+                old = {"values": self.values[:capacity], "days": self.days[:capacity], "cells": self.cells[:capacity]}
+                self.values, self.days, self.cells = self._create(capacity, old)
+        else:
+            self.values, self.days, self.cells = self._create(capacity)
+        used = np.flatnonzero(self.cells[:, 0] != _EMPTY)
+        self._rows = {(int(a), int(b)): int(i) for i, (a, b) in zip(used, self.cells[used])}
+
+    def _create(self, capacity, old=None):
+        # Write under temporary names and rename one file at a time. A crash
+        # between the renames leaves a mix of old and new capacities, which
+        # _open repairs: the new files hold every row of the old ones.
+        shapes = {
+            "values": ((capacity, WINDOW, len(CHANNELS)), np.float64, np.nan),
+            "days": ((capacity, WINDOW), np.int64, _EMPTY),
+            "cells": ((capacity, 2), np.int64, _EMPTY),
+        }
+        arrays = []
+        for name, (shape, dtype, fill) in shapes.items():
+            tmp = self._file(name) + ".tmp"
+            arr = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+            arr[:] = fill
+            if old is not None:
+                arr[:len(old[name])] = old[name]
+            arr.flush()
+            arrays.append(arr)
+        for name in shapes:
+            os.replace(self._file(name) + ".tmp", self._file(name))
+        return arrays
+
+    def _grow(self, needed):
+        capacity = len(self.cells)
+        while capacity < needed:
+            capacity *= 2
+        old = {"values": self.values, "days": self.days, "cells": self.cells}
+        self.values, self.days, self.cells = self._create(capacity, old)
+
+    def _lookup(self, cells, create):
+        rows = np.full(len(cells), -1, dtype=np.int64)
+        new = []
+        for i, cell in enumerate(cells):
+            row = self._rows.get(cell)
+            if row is None and create:
+                row = self._rows[cell] = len(self._rows)
+                new.append((row, cell))
+            if row is not None:
+                rows[i] = row
+        if new:
+            if len(self._rows) > len(self.cells):
+                self._grow(len(self._rows))
+            idx = [r for r, _ in new]
+            self.cells[idx] = [c for _, c in new]
+        return rows
+
+    # --- writes ---
+
+    def ingest(self, cells, days, X):
+        """
+        Store readings; cells[i] observed X[i] (CHANNELS order) on days[i].
+
+        A cell may appear several times (e.g. a backfill chunk); a reading
+        never overwrites a newer day sharing its slot.
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(CHANNELS))
+        days = np.broadcast_to(np.asarray(days, dtype=np.int64), len(X))
+        with self._lock:
+            rows = self._lookup(cells, create=True)
+            # Keep one reading per (row, slot): the newest day, and for
+            # repeats of the same day the last one given (lexsort is stable).
+            order = np.lexsort((days, rows))
+            key = (rows * WINDOW + days % WINDOW)[order]
+            _, last = np.unique(key[::-1], return_index=True)
+            keep = order[len(order) - 1 - last]
+            rows, days, X = rows[keep], days[keep], X[keep]
+            slots = days % WINDOW
+            # Never overwrite a newer day already in the slot.
+            newer = days >= self.days[rows, slots]
+            rows, slots = rows[newer], slots[newer]
+            self.values[rows, slots] = X[newer]
+            self.days[rows, slots] = days[newer]
+            self._dirty = True
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+        return int(newer.sum())
+
+    def observe(self, lat, lon, weather, day=None):
+        """Record one weather dict (as returned by get_real_weather) for today."""
+        day = day if day is not None else datetime.date.today().toordinal()
+        return self.ingest([grid_cell(lat, lon)], day, [[weather[c] for c in CHANNELS]])
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._dirty:
+            for arr in (self.values, self.days, self.cells):
+                arr.flush()
+            self._dirty = False
+        self._last_flush = time.monotonic()
+
+    # --- reads ---
+
+    def window(self, cells, end_day=None, n=WINDOW):
+        """
+        (len(cells), n, 4) readings for the n days ending at end_day,
+        oldest first; missing days (and unknown cells) are NaN.
+        """
+        if not 0 < n <= WINDOW:
+            raise ValueError(f"n must be in 1..{WINDOW}")
+        end_day = end_day if end_day is not None else datetime.date.today().toordinal()
+        wanted = end_day - n + 1 + np.arange(n, dtype=np.int64)
+        with self._lock:
+            rows = self._lookup(cells, create=False)
+            safe = np.maximum(rows, 0)[:, None]
+            slots = (wanted % WINDOW)[None, :]
+            out = np.array(self.values[safe, slots])
+            valid = (self.days[safe, slots] == wanted[None, :]) & (rows >= 0)[:, None]
+        out[~valid] = np.nan
+        return out
+
+    def known_cells(self):
+        with self._lock:
+            return list(self._rows)
+
+    def replay(self, feature_history, end_day=None):
+        """Rebuild a FeatureHistory from the stored windows (e.g. at startup)."""
+        cells = self.known_cells()
+        if not cells:
+            return 0
+        end_day = end_day if end_day is not None else datetime.date.today().toordinal()
+        win = self.window(cells, end_day)
+        start = end_day - WINDOW + 1
+        for k in range(WINDOW):
+            have = ~np.isnan(win[:, k, 0])
+            if have.any():
+                feature_history.update([c for c, h in zip(cells, have) if h], start + k, win[have, k])
+        return len(cells)
+
+    def stats(self):
+        with self._lock:
+            n = len(self._rows)
+            filled = int((self.days[:n] != _EMPTY).sum())
+            return {"cells": n, "capacity": len(self.cells), "readings": filled, "path": self.path}
+
+# --------------------
+# Backfill
+# --------------------
+def backfill_csv(history, path, chunksize=100_000):
+    """
+    Load daily readings from a CSV with lat, lon and date columns plus
+    temp/rainfall/humidity/salinity (or the Temperature/Rainfall/... names
+    used by the training data). Salinity defaults to 0.5 when absent.
+    """
+    import pandas as pd
+
+    total = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        cols = {c.lower(): c for c in chunk.columns}
+        missing = [c for c in ("lat", "lon", "date") if c not in cols]
+        if missing:
+            raise ValueError(f"{path}: missing columns {missing}")
+        X = np.empty((len(chunk), len(CHANNELS)))
+        for j, channel in enumerate(CHANNELS):
+            name = next((n for n in CSV_COLUMNS[channel] if n in chunk.columns), None)
+            if name is None and channel != "salinity":
+                raise ValueError(f"{path}: no column for {channel}")
+            X[:, j] = chunk[name].to_numpy(dtype=np.float64) if name else 0.5
+
+        # Same cells as grid_cell(), vectorized.
+        lat_cells = np.rint(chunk[cols["lat"]].to_numpy(dtype=np.float64) / WEATHER_CACHE_GRID).astype(np.int64)
+        lon_cells = np.rint(chunk[cols["lon"]].to_numpy(dtype=np.float64) / WEATHER_CACHE_GRID).astype(np.int64)
+        epoch_days = pd.to_datetime(chunk[cols["date"]]).to_numpy().astype("datetime64[D]").astype(np.int64)
+        days = epoch_days + _EPOCH_ORDINAL
+        cells = list(zip(lat_cells.tolist(), lon_cells.tolist()))
+        total += history.ingest(cells, days, X)
+    history.flush()
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-location weather history store")
+    parser.add_argument("--path", default=WEATHER_HISTORY_PATH)
+    parser.add_argument("--backfill", metavar="CSV", help="load daily readings from a CSV file")
+    args = parser.parse_args()
+
+    history = WeatherHistory(args.path)
+    if args.backfill:
+        start = time.perf_counter()
+        n = backfill_csv(history, args.backfill)
+        print(f"Backfilled {n:,} readings in {time.perf_counter() - start:.2f}s")
+    print(history.stats())
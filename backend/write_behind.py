@@ -0,0 +1,323 @@
+"""
+Write-behind batching for daily task writes.
+
+WriteBehindTaskStore exposes the same task and points functions as db.py
+(get_task, get_task_status, assign_task, complete_task, get_balance,
+redeem, leaderboard, upsert_user_location) but, instead of
+committing every assignment/completion on the request thread, it records
+the write in an in-memory overlay and queues it. A background thread
+applies queued writes with db.apply_task_batch in one transaction when
+TASK_WRITE_BEHIND_BATCH writes are pending or TASK_WRITE_BEHIND_INTERVAL
+seconds have passed, whichever comes first.
+
+Durability: a request is acknowledged before its write is committed. A
+clean shutdown (atexit, SIGTERM handled by the server) flushes
+everything; a crash or SIGKILL loses at most the writes queued since the
+last flush (bounded by the batch size and interval). Reads from the same
+process see their own writes immediately through the overlay; other
+processes see them after the flush. Points credited by queued completions
+are included in get_balance for the same process; redeem flushes first so
+the atomic deduction in SQLite sees them. Leave it disabled when several
+worker processes share one database and cross-process read-your-writes
+matters.
+
+on_flush, if set, is called with no arguments after every flush that
+commits, e.g. to drop cached responses built from the rows it changed.
+"""
+import atexit
+import os
+import threading
+import time
+
+import db
+
+TASK_WRITE_BEHIND = os.getenv("TASK_WRITE_BEHIND", "0") == "1"
+TASK_WRITE_BEHIND_BATCH = int(os.getenv("TASK_WRITE_BEHIND_BATCH", 500))
+TASK_WRITE_BEHIND_INTERVAL = float(os.getenv("TASK_WRITE_BEHIND_INTERVAL", 0.05))
+# Backpressure: request threads block once this many writes are queued,
+# and give up with WriteBehindFull after waiting this many seconds.
+TASK_WRITE_BEHIND_MAX_PENDING = int(os.getenv("TASK_WRITE_BEHIND_MAX_PENDING", 20_000))
+TASK_WRITE_BEHIND_WAIT = float(os.getenv("TASK_WRITE_BEHIND_WAIT", 5))
+
+
+class WriteBehindFull(Exception):
+    """The queue stayed full for max_wait seconds, e.g. because flushes keep failing."""
+
+
+class WriteBehindTaskStore:
+    def __init__(self, path=None, batch_size=TASK_WRITE_BEHIND_BATCH, interval=TASK_WRITE_BEHIND_INTERVAL,
+                 max_pending=TASK_WRITE_BEHIND_MAX_PENDING, max_wait=TASK_WRITE_BEHIND_WAIT):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self.on_flush = None
+
+        # (user_id, date) -> [task_id, status, risk_level] not yet committed
+        self._overlay = {}
+        self._assigns = []
+        self._completes = []
+        # user_id -> (district_id, lat, lon) not yet committed; one entry per user
+        self._locations = {}
+        self._pending_points = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flushing = False
+        # Writes in the batch being committed, and whether the last commit failed
+        self._in_flight = 0
+        self._failing = False
+        self._stats = {"flushes": 0, "rows_flushed": 0, "max_batch": 0, "flush_ms_total": 0.0, "flush_errors": 0,
+                       "rejected_full": 0}
+
+        self._thread = threading.Thread(target=self._run, name="task-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- db.py-compatible API ---
+
+    def get_task(self, user_id, date_str):
+        with self._cond:
+            pending = self._overlay.get((user_id, date_str))
+            if pending is not None:
+                return (pending[0], pending[1])
+        return db.get_task(user_id, date_str, conn=db.connect(self.path))
+
+    def get_task_status(self, user_id, task_id, date_str):
+        with self._cond:
+            pending = self._overlay.get((user_id, date_str))
+            if pending is not None and pending[0] == task_id:
+                return pending[1]
+        return db.get_task_status(user_id, task_id, date_str, conn=db.connect(self.path))
+
+    def assign_task(self, user_id, task_id, date_str, risk_level, district_id=None):
+        existing = self.get_task(user_id, date_str)
+        if existing:
+            return existing
+        with self._cond:
+            self._wait_for_room()
+            # Re-check under the lock: another thread may have queued one meanwhile.
+            pending = self._overlay.get((user_id, date_str))
+            if pending is not None:
+                return (pending[0], pending[1])
+            self._overlay[(user_id, date_str)] = [task_id, "assigned", risk_level]
+            self._assigns.append((user_id, task_id, date_str, risk_level, district_id))
+            self._notify_if_full()
+        return (task_id, "assigned")
+
+    def complete_task(self, user_id, task_id, date_str, points=0):
+        with self._cond:
+            pending = self._overlay.get((user_id, date_str))
+        if pending is None:
+            status = db.get_task_status(user_id, task_id, date_str, conn=db.connect(self.path))
+            if status != "assigned":
+                return False
+        elif pending[0] != task_id or pending[1] == "completed":
+            return False
+
+        with self._cond:
+            self._wait_for_room()
+            pending = self._overlay.get((user_id, date_str))
+            if pending is not None and pending[1] == "completed":
+                return False
+            if pending is None:
+                self._overlay[(user_id, date_str)] = [task_id, "completed", None]
+            else:
+                pending[1] = "completed"
+            self._completes.append((user_id, task_id, date_str, points))
+            if points:
+                self._pending_points[user_id] = self._pending_points.get(user_id, 0) + points
+            self._notify_if_full()
+        return True
+
+    def upsert_user_location(self, user_id, district_id, lat, lon):
+        with self._cond:
+            pending = self._locations.get(user_id)
+        current = pending[0] if pending else db.get_user_district(user_id, conn=db.connect(self.path))
+        if current == district_id:
+            return False
+        with self._cond:
+            self._locations[user_id] = (district_id, lat, lon)
+        return True
+
+    def get_balance(self, user_id):
+        # Read under the lock with no flush in progress, so queued points are
+        # counted exactly once (either still pending or already committed).
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            return db.get_balance(user_id, conn=db.connect(self.path)) + self._pending_points.get(user_id, 0)
+
+    def redeem(self, user_id, cost, ref):
+        self.flush()
+        return db.redeem(user_id, cost, ref, conn=db.connect(self.path))
+
+    def leaderboard(self, limit=10):
+        return db.leaderboard(limit, conn=db.connect(self.path))
+
+    # --- flushing ---
+
+    def _wait_for_room(self):
+        # Caller holds self._cond.
+        deadline = time.monotonic() + self.max_wait
+        while len(self._assigns) + len(self._completes) + self._in_flight >= self.max_pending and not self._closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats["rejected_full"] += 1
+                raise WriteBehindFull(f"{self.max_pending} task writes still queued after {self.max_wait:g}s")
+            self._cond.notify_all()
+            self._cond.wait(remaining)
+
+    def _notify_if_full(self):
+        if len(self._assigns) + len(self._completes) >= self.batch_size:
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._assigns) + len(self._completes) < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._closed and not (self._assigns or self._completes or self._locations):
+                    return
+            self.flush()
+            if self._failing and not self._closed:
+                # Retry a failed commit once per interval, not in a tight loop.
+                time.sleep(self.interval)
+
+    def flush(self):
+        """Commit everything queued so far. Safe to call from any thread."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            assigns, self._assigns = self._assigns, []
+            completes, self._completes = self._completes, []
+            locations, self._locations = self._locations, {}
+            pending_points, self._pending_points = self._pending_points, {}
+            if not (assigns or completes or locations):
+                return 0
+            self._flushing = True
+            self._in_flight = len(assigns) + len(completes)
+            overlay = {k: list(v) for k, v in self._overlay.items()}
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            db.apply_task_batch(assigns, completes, [(u, *loc) for u, loc in locations.items()],
+                                conn=db.connect(self.path))
+            ok = True
+        except Exception as e:
+            print("Write-behind flush error:", e)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._cond:
+            self._flushing = False
+            self._in_flight = 0
+            self._failing = not ok
+            if ok:
+                n = len(assigns) + len(completes)
+                self._stats["flushes"] += 1
+                self._stats["rows_flushed"] += n
+                self._stats["max_batch"] = max(self._stats["max_batch"], n)
+                self._stats["flush_ms_total"] += elapsed_ms
+                # Drop overlay entries that are now durable and unchanged since the snapshot.
+                for key, value in overlay.items():
+                    if self._overlay.get(key) == value:
+                        del self._overlay[key]
+            else:
+                # Put the batch back in front so it is retried on the next flush.
+                self._stats["flush_errors"] += 1
+                self._assigns[:0] = assigns
+                self._completes[:0] = completes
+                for user_id, loc in locations.items():
+                    self._locations.setdefault(user_id, loc)
+                for user_id, points in pending_points.items():
+                    self._pending_points[user_id] = self._pending_points.get(user_id, 0) + points
+            self._cond.notify_all()
+        if ok and self.on_flush:
+            self.on_flush()
+        return len(assigns) + len(completes) if ok else 0
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s["pending"] = len(self._assigns) + len(self._completes)
+            s["overlay"] = len(self._overlay)
+            s["pending_locations"] = len(self._locations)
+        s["flush_ms_avg"] = round(s["flush_ms_total"] / s["flushes"], 2) if s["flushes"] else 0.0
+        s["flush_ms_total"] = round(s["flush_ms_total"], 2)
+        return s
+
+# --------------------
+# Benchmark
+# --------------------
+def benchmark(path, threads=16, seconds=5, synchronous="FULL"):
+    """
+    Requests/sec for the assign + verify pair on user_daily_tasks, committing
+    per request vs. through the write-behind queue. synchronous=FULL makes
+    every commit pay an fsync, as on a durable production setting.
+    """
+    import datetime
+
+    def run(store, label):
+        stop = time.monotonic() + seconds
+        done = [0]
+        lock = threading.Lock()
+        today = datetime.date.today().isoformat()
+
+        def worker(w):
+            conn = db.connect(path)
+            n = 0
+            while time.monotonic() < stop:
+                user = f"{label}-{w}-{n}"
+                if store is db:
+                    store.assign_task(user, "T1", today, 80.0, conn=conn)
+                    store.complete_task(user, "T1", today, 50, conn=conn)
+                else:
+                    store.assign_task(user, "T1", today, 80.0)
+                    store.complete_task(user, "T1", today, 50)
+                n += 1
+            with lock:
+                done[0] += n
+
+        ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        if store is not db:
+            store.close()
+        print(f"{label:<14}{done[0] / seconds:>12,.0f} req/s")
+        return store
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.DB_SYNCHRONOUS = synchronous
+
+    print(f"{threads} threads, synchronous={synchronous}, {seconds}s each")
+    run(db, "direct")
+    store = run(WriteBehindTaskStore(path), "write-behind")
+    print("write-behind:", store.stats())
+    rows = db.connect(path).execute("SELECT COUNT(*), SUM(status='completed') FROM user_daily_tasks").fetchone()
+    print(f"rows={rows[0]:,} completed={rows[1]:,}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write-behind vs. direct task writes")
+    parser.add_argument("--db", default="loadtest.db")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--synchronous", default="FULL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+    benchmark(args.db, args.threads, args.seconds, args.synchronous)